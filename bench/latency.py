@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""End-to-end latency benchmark: a local server plus N synthetic panels.
+
+Starts `main.py -s --no-mdns` as a subprocess, connects synthetic panels
+straight to 127.0.0.1 (no mDNS, so it works offline), readies them all, then
+streams doodad input and ping probes from every panel at a fixed rate.
+Reports ping round-trip percentiles, input throughput and the server's frame
+timings and CPU time per frame (from tmp/stats-server.json and rusage).
+
+Run from the project root: `python -m bench.latency --panels 9 --doodads 5`
+or `python main.py --bench --panels 9`.
+"""
+import argparse
+import json
+import resource
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from common.doodad import DoodadInputPacket, DoodadKind
+from common.gamestate import ClientState, GameState, GameStatePacket, ResyncPacket, StateDeltaPacket, \
+    StateSnapshotPacket, StateView
+from common.packets import LineFramer, Packet, decode_line
+from common.ring import RingSocket, connect_ring, ring_listener_name
+from common.stats import LatencyHistogram
+from common.wire import PingPacket, PongPacket, WelcomePacket, WIRE_JSON, SUPPORTED_WIRES, encode_datagrams, encode_for, \
+    new_framer
+from server.network import PORT
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+class SyntheticPanel:
+    """One fake panel speaking the real handshake and wire protocol."""
+
+    def __init__(self, player: int, doodads: int, wire: str, auto_ready: bool = True, udp: bool = False):
+        self.player = player
+        self.auto_ready = auto_ready
+        self.doodad_ids = [f"{(player << 8) + i:04X}" for i in range(doodads)]
+        kinds = list(DoodadKind)
+        self.kinds = [kinds[i % len(kinds)] for i in range(doodads)]
+        self.offer_udp = udp
+        self.udp: Optional[socket.socket] = None
+        self.udp_token = 0
+        self.udp_seq = 0
+        self.wire = WIRE_JSON
+        self.offered_wire = wire
+        self.framer = LineFramer()
+        self.awaiting_welcome = True
+        self.state: Optional[GameState] = None
+        self.view = StateView()
+        self.sock: Optional[socket.socket | RingSocket] = None
+        self.outbox = bytearray()
+        self.pending: Dict[int, float] = {}
+        self.seq = 0
+        self.sent_inputs = 0
+        self.received = 0  # Packets decoded from the server
+
+    def connect(self, port: int, deadline: float, ring: bool = False) -> None:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if ring:
+                    sock = connect_ring(ring_listener_name(port), f"ufogame-bench-{self.player}-{attempt}")
+                else:
+                    sock = socket.create_connection(("127.0.0.1", port), timeout=1.0)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        if not ring:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        handshake = {
+            "player": self.player,
+            "capabilities": [
+                {"id": ident, "player": self.player, "kind": kind.name}
+                for ident, kind in zip(self.doodad_ids, self.kinds)
+            ],
+            "wire": [self.offered_wire],
+            "state_sync": True,
+        }
+        if self.offer_udp:
+            handshake["udp"] = True
+        self.attach(sock, (json.dumps(handshake) + "\n").encode("utf-8"))
+
+    def attach(self, sock: socket.socket | RingSocket, handshake: bytes) -> None:
+        """Use an already connected socket, sending `handshake` (a JSON line) first."""
+        self.sock = sock
+        self.sock.sendall(handshake)
+        self.sock.setblocking(False)
+
+    def send(self, packet: Packet) -> None:
+        self.outbox += encode_for(packet, self.wire)
+
+    def flush(self) -> None:
+        try:
+            while self.outbox:
+                sent = self.sock.send(self.outbox)
+                del self.outbox[:sent]
+        except BlockingIOError:
+            pass
+
+    def receive(self, rtts: LatencyHistogram) -> bool:
+        """Read what is available; False once the server closes the connection."""
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return True
+        if not data:
+            return False
+        for packet in self._decode(data):
+            self.received += 1
+            if isinstance(packet, PongPacket):
+                sent = self.pending.pop(packet.seq, None)
+                if sent is not None:
+                    rtts.record(time.perf_counter() - sent)
+            elif isinstance(packet, GameStatePacket):
+                self.view.reset()
+                self.state = packet.state
+            elif isinstance(packet, (StateSnapshotPacket, StateDeltaPacket)):
+                changes = self.view.apply(packet)
+                if changes is None:
+                    self.send(ResyncPacket(seq=self.view.seq or 0))
+                elif "state" in changes:
+                    self.state = GameState(changes["state"])
+                    if self.state == GameState.IDLE and self.auto_ready:
+                        self.send(ClientState(ready=True))
+        return True
+
+    def _decode(self, data: bytes) -> List[Packet]:
+        if not self.awaiting_welcome:
+            return self.framer.decode(data)
+        lines = self.framer.feed(data, max_lines=1)
+        if not lines:
+            return []
+        self.awaiting_welcome = False
+        first = decode_line(lines[0])
+        rest = self.framer.take_buffer()
+        if isinstance(first, WelcomePacket):
+            self.wire = first.wire
+            if first.udp_token:
+                self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.udp.connect((self.sock.getpeername()[0], first.udp_port))
+                self.udp_token = first.udp_token
+            self.framer = new_framer(self.wire)
+            return self.framer.decode(rest)
+        return [first, *self.framer.decode(rest)]
+
+    def drive(self, step: int) -> None:
+        """Send one round of slider/button input plus a ping probe; sliders use UDP if negotiated."""
+        sliders = []
+        for i, (ident, kind) in enumerate(zip(self.doodad_ids, self.kinds)):
+            packet = DoodadInputPacket(doodad=ident, value=(step * 7 + i * 31) % 1024)
+            if self.udp is not None and kind == DoodadKind.Slider:
+                sliders.append(packet)
+            else:
+                self.send(packet)
+        for self.udp_seq, datagram in encode_datagrams(self.udp_token, self.udp_seq + 1, sliders):
+            self.udp.send(datagram)
+        self.sent_inputs += len(self.doodad_ids)
+        self.seq += 1
+        now = time.perf_counter()
+        self.pending[self.seq] = now
+        self.send(PingPacket(seq=self.seq, sent=now))
+
+
+def _wait_for_state(panels: List[SyntheticPanel], sel: selectors.BaseSelector, state: GameState,
+                    rtts: LatencyHistogram, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for key, _ in sel.select(0.05):
+            key.data.receive(rtts)
+        for panel in panels:
+            panel.flush()
+        if all(panel.state == state for panel in panels):
+            return True
+    return False
+
+
+def run_benchmark(args) -> int:
+    if not 1 <= args.panels <= 9:
+        print("--panels must be 1-9 (the server accepts players 1-9); use --doodads to scale input")
+        return 2
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if args.transport == "ring" and args.udp:
+        print("--udp needs the tcp transport")
+        return 2
+    server = subprocess.Popen([sys.executable, str(PROJECT_ROOT / "main.py"), "-s", "--no-mdns",
+                               "--transport", args.transport],
+                              cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    panels = [SyntheticPanel(player, args.doodads, args.wire, udp=args.udp) for player in range(1, args.panels + 1)]
+    sel = selectors.DefaultSelector()
+    rtts = LatencyHistogram()
+    try:
+        for panel in panels:
+            panel.connect(PORT, time.monotonic() + 10.0, ring=args.transport == "ring")
+            sel.register(panel.sock, selectors.EVENT_READ, panel)
+        if not _wait_for_state(panels, sel, GameState.IN_LEVEL, rtts, timeout=10.0):
+            print("Panels never reached IN_LEVEL; is another server already on the port?")
+            return 1
+
+        interval = 1.0 / args.rate
+        start = time.monotonic()
+        next_round = start
+        step = 0
+        while time.monotonic() - start < args.duration:
+            now = time.monotonic()
+            if now >= next_round:
+                for panel in panels:
+                    panel.drive(step)
+                    panel.flush()
+                step += 1
+                next_round += interval
+            for key, _ in sel.select(max(0.0, next_round - time.monotonic())):
+                if not key.data.receive(rtts):
+                    print(f"Server closed panel {key.data.player}")
+                    return 1
+        # Collect stragglers
+        drain_until = time.monotonic() + 0.5
+        while time.monotonic() < drain_until and any(panel.pending for panel in panels):
+            for key, _ in sel.select(0.05):
+                key.data.receive(rtts)
+        elapsed = time.monotonic() - start
+    finally:
+        for panel in panels:
+            if panel.sock is not None:
+                panel.sock.close()
+            if panel.udp is not None:
+                panel.udp.close()
+        if server.poll() is None:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    sent_inputs = sum(panel.sent_inputs for panel in panels)
+    lost = sum(len(panel.pending) for panel in panels)
+    print(f"panels={args.panels} doodads/panel={args.doodads} wire={args.wire}{' + udp' if args.udp else ''} "
+          f"transport={args.transport} rate={args.rate}/s "
+          f"duration={elapsed:.1f}s")
+    print(f"input: {sent_inputs} doodad packets, {sent_inputs / elapsed:,.0f}/s; "
+          f"pings: {rtts.count} answered, {lost} unanswered")
+    print("round trip ms: " + ", ".join(f"{k}={v}" for k, v in rtts.summary_ms().items()))
+
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    stats_path = PROJECT_ROOT / "tmp" / "stats-server.json"
+    try:
+        stats = json.loads(stats_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        print(f"server CPU {cpu:.2f}s (no {stats_path.name} to break down per frame)")
+        return 0
+    frames = max(1, stats.get("frames", 0))
+    print(f"server: {stats.get('frames')} frames, {stats.get('overruns')} overruns, "
+          f"CPU {cpu:.2f}s total, {cpu / frames * 1e3:.3f} ms CPU/frame (includes startup)")
+    print("server frame ms: " + ", ".join(f"{k}={v}" for k, v in stats.get("frame_ms", {}).items()))
+    for name, summary in stats.get("phases_ms", {}).items():
+        if name != "idle":
+            print(f"  {name:<8} p50={summary.get('p50')} p99={summary.get('p99')} max={summary.get('max')}")
+    if args.udp:
+        print("server udp: " + ", ".join(f"{k}={v}" for k, v in stats.get("counters", {}).get("udp", {}).items()))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--panels", type=int, default=9, help="Synthetic panels (players 1-9)")
+    parser.add_argument("--doodads", type=int, default=3, help="Doodads declared per panel")
+    parser.add_argument("--rate", type=float, default=50.0, help="Input rounds per second per panel")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of measured input")
+    parser.add_argument("--wire", choices=SUPPORTED_WIRES, default=SUPPORTED_WIRES[0], help="Encoding to offer")
+    parser.add_argument("--udp", action="store_true", help="Offer the datagram channel and send slider input over it")
+    parser.add_argument("--transport", choices=("tcp", "ring"), default="tcp",
+                        help="ring: shared-memory rings instead of loopback TCP, to measure the server without the kernel")
+    return run_benchmark(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
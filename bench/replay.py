@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Replay a recorded server session through server.main.run_frame.
+
+Each recorded panel becomes a socketpair handed to server.network as if it had
+just been accepted, so the handshake, framing, dispatch and send paths all run
+for real. Recorded inbound packets are written to the panel side at their
+original offsets divided by --speed (0 = as fast as possible). Outbound
+packets are read back and counted against what the recording says was sent.
+
+Game-logic timers (countdowns) still run on the real clock, so at high speeds
+the outbound counts can legitimately differ from the recording.
+
+Run from the project root: `python -m bench.replay tmp/sessions/session-....ufolog --speed 4`
+"""
+import argparse
+import logging
+import selectors
+import socket
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict
+
+import server.main as server_main
+import server.network as net
+from bench.latency import SyntheticPanel
+from common.config import load_config
+from common.logger import get_logger
+from common.loop import EventLoop
+from common.runner import TickPolicy
+from common.sessionlog import ALL_PLAYERS, KIND_CONNECT, KIND_DISCONNECT, KIND_IN, KIND_OUT, read_session
+from common.stats import LatencyHistogram
+from common.wire import WIRE_JSON, encode_for
+
+# How long to keep pumping frames for a new panel's greeting before giving up on it
+GREETING_TIMEOUT = 1.0
+
+
+class Replay:
+    def __init__(self, logger: logging.Logger, speed: float):
+        self.logger = logger
+        self.speed = speed
+        self.loop = EventLoop()
+        self.selector = selectors.DefaultSelector()
+        self.panels: Dict[int, SyntheticPanel] = {}
+        self.expected = Counter()  # Outbound packets per player according to the recording
+        self.received = Counter()
+        self.frames = 0
+        self.unused = LatencyHistogram()  # SyntheticPanel.receive wants one for pongs
+        config = load_config(Path(server_main.__file__).parent / "config.toml")
+        server_main._tick_policy = TickPolicy.from_config(config)
+        server_main._loop = self.loop
+        server_main.reset()
+        net.attach_loop(self.loop)
+        net.PORT = 0  # The listener must exist for run_frame, but nothing connects to it
+
+    def frame(self) -> None:
+        start = time.perf_counter()
+        server_main.run_frame(self.logger)
+        server_main._stats.record_frame(time.perf_counter() - start, float("inf"))
+        self.frames += 1
+        self.drain()
+
+    def drain(self) -> None:
+        for key, _ in self.selector.select(0):
+            panel = key.data
+            if not panel.receive(self.unused):
+                self.disconnect(panel.player)
+        for panel in list(self.panels.values()):
+            self.flush(panel)
+
+    def flush(self, panel: SyntheticPanel) -> None:
+        try:
+            panel.flush()
+        except OSError:
+            # The server dropped this panel; later records for it are skipped
+            self.disconnect(panel.player)
+
+    def wait_until(self, deadline: float) -> None:
+        """Run frames at the server's tick period until `deadline` (monotonic)."""
+        while True:
+            self.frame()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            period = server_main._tick_policy.period(server_main.game_state())
+            self.loop.run_once(min(remaining, period) if period is not None else remaining)
+
+    def connect(self, player: int, handshake: bytes) -> None:
+        self.disconnect(player)
+        server_side, panel_side = socket.socketpair()
+        panel = self.panels[player] = SyntheticPanel(player, 0, WIRE_JSON, auto_ready=False)
+        panel.attach(panel_side, handshake.rstrip(b"\r\n") + b"\n")
+        self.selector.register(panel_side, selectors.EVENT_READ, panel)
+        net.adopt_connection(server_side, ("replay", player))
+        # Inbound packets must not be encoded until the panel knows the negotiated wire
+        give_up = time.monotonic() + GREETING_TIMEOUT
+        while panel.awaiting_welcome and time.monotonic() < give_up:
+            self.frame()
+            self.loop.run_once(0.001)
+
+    def disconnect(self, player: int) -> None:
+        panel = self.panels.pop(player, None)
+        if panel is None:
+            return
+        self.received[player] += panel.received
+        try:
+            self.selector.unregister(panel.sock)
+        except (KeyError, ValueError):
+            pass
+        panel.sock.close()
+
+    def run(self, path: Path) -> int:
+        records = list(read_session(path))
+        if not records:
+            print(f"{path}: no records")
+            return 1
+        connected = set()
+        start = time.monotonic()
+        for record in records:
+            if self.speed > 0:
+                self.wait_until(start + record.t / self.speed)
+            if record.kind == KIND_CONNECT:
+                connected.add(record.player)
+                self.connect(record.player, record.payload)
+            elif record.kind == KIND_DISCONNECT:
+                connected.discard(record.player)
+                self.disconnect(record.player)
+            elif record.kind == KIND_IN:
+                panel = self.panels.get(record.player)
+                if panel is not None and record.packet is not None:
+                    panel.outbox += encode_for(record.packet, panel.wire)
+                    self.flush(panel)
+            elif record.kind == KIND_OUT:
+                for player in (connected if record.player == ALL_PLAYERS else (record.player,)):
+                    self.expected[player] += 1
+            if self.speed <= 0:
+                self.frame()
+        self.wait_until(time.monotonic() + 0.2)  # Let the last inputs take effect
+        elapsed = time.monotonic() - start
+        for player in list(self.panels):
+            self.disconnect(player)
+
+        print(f"{path.name}: {len(records)} records over {records[-1].t:.1f}s replayed in {elapsed:.2f}s "
+              f"({self.frames} frames)")
+        print("server frame ms: " + ", ".join(f"{k}={v}" for k, v in server_main._stats.frame.summary_ms().items()))
+        for name, hist in server_main._stats.phases.items():
+            summary = hist.summary_ms()
+            print(f"  {name:<8} p50={summary.get('p50')} p99={summary.get('p99')} max={summary.get('max')}")
+        for player in sorted(set(self.expected) | set(self.received)):
+            print(f"  player {player}: {self.received[player]} packets out (recorded {self.expected[player]})")
+        return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("session", type=Path, help="Session file from tmp/sessions/")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time scale; 0 replays as fast as possible")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the server's log output")
+    args = parser.parse_args(argv)
+    logger = get_logger("replay")
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+    # Don't record the replay itself
+    net.stop_session_log()
+    return Replay(logger, args.speed).run(args.session)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Compare the JSON-line and binary wire encodings.
+
+Checks every sample packet survives an encode/decode round trip in both
+encodings, then reports frame sizes, per-packet encode/decode cost and bulk
+decode throughput for a stream of slider input.
+
+Run from the project root: `python -m bench.wire`
+"""
+import argparse
+import sys
+import time
+from typing import Callable, List
+
+from common.doodad import DoodadInputPacket
+from common.gamestate import ClientState, GameState, GameStatePacket, StartLevelPacket, StateDeltaPacket
+from common.packets import Packet, TextPacket
+from common.wire import WIRE_BINARY, WIRE_JSON, encode_for, new_framer
+
+SAMPLES: List[Packet] = [
+    ClientState(ready=True),
+    GameStatePacket(state=GameState.LEVEL_COUNTDOWN, countdown=2),
+    StateDeltaPacket(seq=41, base=40, changes={"countdown": 2}),
+    DoodadInputPacket(doodad="0D50", value=731),
+    StartLevelPacket(
+        doodad_names={"2312": "Fermion Starter", "F3DC": "Quantum Reflux", "0D50": "Double Quantum Laser"},
+        level=3,
+    ),
+    TextPacket(text="Hello from server"),
+]
+
+
+def _per_call_us(fn: Callable[[], object], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def check_round_trip() -> bool:
+    ok = True
+    for wire in (WIRE_JSON, WIRE_BINARY):
+        stream = b"".join(encode_for(p, wire) for p in SAMPLES)
+        framer = new_framer(wire)
+        # Feed in awkward chunk sizes so frames straddle reads
+        decoded: List[Packet] = []
+        for i in range(0, len(stream), 7):
+            decoded.extend(framer.decode(stream[i:i + 7]))
+        if decoded != SAMPLES:
+            print(f"FAIL round trip ({wire}): {decoded}")
+            ok = False
+    return ok
+
+
+def report_sizes_and_costs(iterations: int) -> None:
+    print(f"{'packet':<18} {'json B':>7} {'bin B':>6} {'enc json us':>12} {'enc bin us':>11} {'dec json us':>12} {'dec bin us':>11}")
+    for packet in SAMPLES:
+        row = [type(packet).__name__]
+        encoded = {wire: encode_for(packet, wire) for wire in (WIRE_JSON, WIRE_BINARY)}
+        row += [len(encoded[WIRE_JSON]), len(encoded[WIRE_BINARY])]
+        for wire in (WIRE_JSON, WIRE_BINARY):
+            row.append(_per_call_us(lambda: encode_for(packet, wire), iterations))
+        for wire in (WIRE_JSON, WIRE_BINARY):
+            framer = new_framer(wire)
+            data = encoded[wire]
+            row.append(_per_call_us(lambda: framer.decode(data), iterations))
+        print("{:<18} {:>7} {:>6} {:>12.2f} {:>11.2f} {:>12.2f} {:>11.2f}".format(*row))
+
+
+def report_throughput(count: int) -> None:
+    inputs = [DoodadInputPacket(doodad="0D50", value=i % 1024) for i in range(count)]
+    for wire in (WIRE_JSON, WIRE_BINARY):
+        stream = b"".join(encode_for(p, wire) for p in inputs)
+        framer = new_framer(wire)
+        start = time.perf_counter()
+        decoded = 0
+        for i in range(0, len(stream), 4096):
+            decoded += len(framer.decode(stream[i:i + 4096]))
+        elapsed = time.perf_counter() - start
+        print(f"{wire:>5}: {decoded} slider packets, {len(stream)} bytes, "
+              f"{decoded / elapsed:,.0f} packets/s, {len(stream) / elapsed / 1e6:.1f} MB/s decoded")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000, help="Calls per per-packet measurement")
+    parser.add_argument("--stream", type=int, default=100000, help="Slider packets in the throughput stream")
+    args = parser.parse_args(argv)
+
+    if not check_round_trip():
+        return 1
+    print("Round trip OK for both encodings\n")
+    report_sizes_and_costs(args.iterations)
+    print()
+    report_throughput(args.stream)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
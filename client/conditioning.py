@@ -0,0 +1,164 @@
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from common.doodad import Doodad, DoodadInputPacket, DoodadKind
+from common.loop import EventLoop
+
+# Turns raw doodad samples from USB into the input worth sending to the server.
+#
+# Per DoodadKind, from the [input.<Kind>] tables of client/config.toml:
+#   coalesce      keep only the last sample per doodad each frame
+#   deadband      drop values within this distance of the last value sent
+#   min_interval  send at most one value per doodad this often (seconds); a value
+#                 held back is sent when the interval ends, so the final
+#                 position always arrives
+#   edges         "changes" sends only values that differ from the last one sent,
+#                 "press" only transitions to a new non-zero value (button
+#                 presses), "all" every sample
+# Doodads the panel does not declare pass through unchanged.
+
+EDGE_MODES = ("changes", "press", "all")
+
+
+class KindSettings(NamedTuple):
+    coalesce: bool = False
+    deadband: int = 0
+    min_interval: float = 0.0
+    edges: str = "changes"
+
+
+DEFAULT_SETTINGS: Dict[DoodadKind, KindSettings] = {
+    DoodadKind.SingleButton: KindSettings(),
+    DoodadKind.MultiButton: KindSettings(),
+    DoodadKind.Slider: KindSettings(coalesce=True, deadband=2, min_interval=0.02),
+}
+_PASS_THROUGH = KindSettings(edges="all")
+
+
+class _DoodadInput:
+    __slots__ = ("sent", "sent_at", "seen", "held")
+
+    def __init__(self):
+        self.sent: Optional[int] = None  # Last value sent
+        self.sent_at = float("-inf")
+        self.seen: Optional[int] = None  # Last value sampled, for press detection
+        self.held: Optional[DoodadInputPacket] = None  # Waiting out min_interval
+
+
+_settings: Dict[DoodadKind, KindSettings] = dict(DEFAULT_SETTINGS)
+_inputs: Dict[str, _DoodadInput] = {}
+_held: Dict[str, KindSettings] = {}  # Doodads with a value waiting out min_interval
+_loop: EventLoop | None = None
+# Samples in, values sent, and why the rest were dropped
+counters: Dict[str, int] = {"in": 0, "out": 0, "coalesced": 0, "unchanged": 0, "deadband": 0, "rate_limited": 0}
+
+
+def _parse_settings(table: object, default: KindSettings) -> KindSettings:
+    if not isinstance(table, dict):
+        return default
+    edges = str(table.get("edges", default.edges)).lower()
+    return KindSettings(
+        coalesce=bool(table.get("coalesce", default.coalesce)),
+        deadband=max(0, int(table.get("deadband", default.deadband))),
+        min_interval=max(0.0, float(table.get("min_interval", default.min_interval))),
+        edges=edges if edges in EDGE_MODES else default.edges,
+    )
+
+
+def configure(config: dict, loop: EventLoop | None) -> None:
+    """Read the [input.<DoodadKind>] tables; held values wake `loop` when they are due."""
+    global _loop
+    _loop = loop
+    table = config.get("input", {})
+    if not isinstance(table, dict):
+        table = {}
+    for kind, default in DEFAULT_SETTINGS.items():
+        _settings[kind] = _parse_settings(table.get(kind.name), default)
+    reset()
+
+
+def reset() -> None:
+    """Forget what was sent; call when the server connection is new."""
+    _inputs.clear()
+    _held.clear()
+
+
+def settings_for(kind: DoodadKind) -> KindSettings:
+    return _settings.get(kind, _PASS_THROUGH)
+
+
+def _send(state: _DoodadInput, packet: DoodadInputPacket, now: float, out: List[DoodadInputPacket]) -> None:
+    state.sent = packet.value
+    state.sent_at = now
+    state.held = None
+    _held.pop(packet.doodad, None)
+    counters["out"] += 1
+    out.append(packet)
+
+
+def _offer(packet: DoodadInputPacket, settings: KindSettings, now: float, out: List[DoodadInputPacket]) -> None:
+    state = _inputs.get(packet.doodad)
+    if state is None:
+        state = _inputs[packet.doodad] = _DoodadInput()
+    value = packet.value
+    if settings.edges == "press":
+        pressed = value != 0 and value != state.seen
+        state.seen = value
+        if not pressed:
+            counters["unchanged"] += 1
+            return
+    elif state.sent is not None:
+        if settings.edges == "changes" and value == state.sent:
+            # Back where it was; anything held back is moot
+            counters["unchanged"] += 1
+            state.held = None
+            _held.pop(packet.doodad, None)
+            return
+        if abs(value - state.sent) < settings.deadband:
+            counters["deadband"] += 1
+            state.held = None
+            _held.pop(packet.doodad, None)
+            return
+    due = state.sent_at + settings.min_interval
+    if now < due:
+        counters["rate_limited"] += 1
+        state.held = packet
+        if packet.doodad not in _held:
+            _held[packet.doodad] = settings
+            if _loop is not None:
+                _loop.call_at(due)  # Send it when the interval ends even if no input follows
+        return
+    _send(state, packet, now, out)
+
+
+def condition(packets: Iterable[DoodadInputPacket], doodad: Callable[[str], Optional[Doodad]],
+              now: Optional[float] = None) -> List[DoodadInputPacket]:
+    """Filter this frame's samples, plus any held values now due, into packets to send.
+
+    `doodad` looks up the panel's doodad by id (Panel.doodad). Call every frame,
+    even with no samples, so held values go out on time.
+    """
+    if now is None:
+        now = time.monotonic()
+    out: List[DoodadInputPacket] = []
+    latest: Dict[str, DoodadInputPacket] = {}
+    kinds: Dict[str, KindSettings] = {}
+    for packet in packets:
+        counters["in"] += 1
+        settings = kinds.get(packet.doodad)
+        if settings is None:
+            d = doodad(packet.doodad)
+            settings = kinds[packet.doodad] = settings_for(d.kind) if d is not None else _PASS_THROUGH
+        if settings.coalesce:
+            if latest.pop(packet.doodad, None) is not None:
+                counters["coalesced"] += 1
+            latest[packet.doodad] = packet
+        else:
+            _offer(packet, settings, now, out)
+    for packet in latest.values():
+        _offer(packet, kinds[packet.doodad], now, out)
+    for ident, settings in list(_held.items()):
+        state = _inputs[ident]
+        if state.held is not None and now >= state.sent_at + settings.min_interval:
+            _send(state, state.held, now, out)
+    return out
@@ -0,0 +1,304 @@
+import logging
+import time
+from threading import Condition
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+try:
+    import serial  # type: ignore
+    from serial.tools import list_ports  # type: ignore
+except Exception:  # pragma: no cover
+    serial = None
+    list_ports = None
+
+try:
+    import pyudev  # type: ignore
+except Exception:  # pragma: no cover
+    pyudev = None
+
+from common.loop import EventLoop
+
+
+# Finds doodad serial ports without re-enumerating USB every frame.
+#
+# Enumeration results are cached and only refreshed when udev reports a tty
+# add/remove (if pyudev is installed and a loop is attached) or, failing that,
+# every SCAN_INTERVAL. Ports that fail to open back off exponentially; ports
+# whose USB ids do not match the configured doodad ids are never opened.
+
+
+class PortInfo(NamedTuple):
+    device: str
+    vid: Optional[int] = None
+    pid: Optional[int] = None
+    serial_number: Optional[str] = None
+
+    def identity(self) -> Optional[Tuple[int, int, str]]:
+        """Stable id of the physical device, if it reports a serial number."""
+        if self.vid is None or self.pid is None or not self.serial_number:
+            return None
+        return self.vid, self.pid, self.serial_number
+
+    def describe(self) -> str:
+        if self.vid is None or self.pid is None:
+            return self.device
+        ids = f"{self.vid:04X}:{self.pid:04X}"
+        return f"{self.device} ({ids} {self.serial_number})" if self.serial_number else f"{self.device} ({ids})"
+
+
+class SerialBackend:
+    """Real ports via pyserial, with hot-plug events from pyudev when available."""
+
+    name = "serial"
+
+    def available(self) -> bool:
+        return serial is not None
+
+    def enumerate(self) -> List[PortInfo]:
+        if list_ports is None:
+            return []
+        ports = []
+        for p in list_ports.comports():
+            dev = getattr(p, "device", None) or getattr(p, "name", None)
+            if not dev:
+                continue
+            ports.append(PortInfo(str(dev), getattr(p, "vid", None), getattr(p, "pid", None),
+                                  getattr(p, "serial_number", None)))
+        return ports
+
+    def open(self, port: PortInfo, timeout: float):
+        # write_timeout=0 makes writes non-blocking; client.usb buffers what is left
+        return serial.Serial(port.device, baudrate=115200, timeout=timeout, write_timeout=0)
+
+    def start_monitor(self, loop: EventLoop, on_change: Callable[[], None]) -> bool:
+        """Watch udev for tty add/remove; False if pyudev is missing or netlink is unavailable."""
+        if pyudev is None:
+            return False
+        try:
+            monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+            monitor.filter_by(subsystem="tty")
+            monitor.start()
+        except Exception:
+            return False
+
+        def _on_ready(mask: int) -> None:
+            changed = False
+            while True:
+                try:
+                    event = monitor.poll(timeout=0)
+                except Exception:
+                    event = None
+                if event is None:
+                    break
+                if event.action in ("add", "remove"):
+                    changed = True
+            if changed:
+                on_change()
+
+        loop.register(monitor, _on_ready)
+        return True
+
+
+class FakeSerial:
+    """In-memory stand-in for serial.Serial; the test side uses `feed` and `written`."""
+
+    def __init__(self, device: str):
+        self.port = device
+        self.is_open = True
+        self.timeout: Optional[float] = None
+        self.written = bytearray()
+        self._rx = bytearray()
+        self._cond = Condition()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._rx)
+
+    def feed(self, data: bytes) -> None:
+        """Bytes the doodad sends to the panel."""
+        with self._cond:
+            self._rx += data
+            self._cond.notify_all()
+
+    def read(self, size: int = 1) -> bytes:
+        with self._cond:
+            if not self.is_open:
+                raise OSError("device disconnected")
+            if not self._rx:
+                self._cond.wait(self.timeout)
+            if not self.is_open:
+                raise OSError("device disconnected")
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise OSError("device disconnected")
+        self.written += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+
+class FakeBackend:
+    """Hardware-free backend: devices are plugged and unplugged from code."""
+
+    name = "fake"
+
+    def __init__(self):
+        self.ports: Dict[str, PortInfo] = {}
+        self.handles: Dict[str, FakeSerial] = {}
+        self._on_change: Optional[Callable[[], None]] = None
+
+    def available(self) -> bool:
+        return True
+
+    def plug(self, device: str, vid: int = 0x2E8A, pid: int = 0x000A, serial_number: Optional[str] = None) -> FakeSerial:
+        self.ports[device] = PortInfo(device, vid, pid, serial_number or device)
+        handle = self.handles[device] = FakeSerial(device)
+        if self._on_change is not None:
+            self._on_change()
+        return handle
+
+    def unplug(self, device: str) -> None:
+        self.ports.pop(device, None)
+        handle = self.handles.pop(device, None)
+        if handle is not None:
+            handle.close()
+        if self._on_change is not None:
+            self._on_change()
+
+    def enumerate(self) -> List[PortInfo]:
+        return list(self.ports.values())
+
+    def open(self, port: PortInfo, timeout: float) -> FakeSerial:
+        handle = self.handles.get(port.device)
+        if handle is None or not handle.is_open:
+            raise OSError(f"could not open port {port.device}")
+        handle.timeout = timeout
+        return handle
+
+    def start_monitor(self, loop: EventLoop, on_change: Callable[[], None]) -> bool:
+        def _changed() -> None:
+            on_change()
+            loop.wake()
+
+        self._on_change = _changed
+        return True
+
+
+# Rescan period without hot-plug events; with them, only a slow safety net
+SCAN_INTERVAL = 1.0
+MONITORED_SCAN_INTERVAL = 30.0
+# Open failures back off from RETRY_MIN doubling to RETRY_MAX seconds
+RETRY_MIN = 1.0
+RETRY_MAX = 60.0
+
+_backend: SerialBackend | FakeBackend = SerialBackend()
+_monitored = False
+_ports: List[PortInfo] = []  # Cached result of the last enumeration
+_scan_due = True
+_next_scan = 0.0
+# device -> (identity seen when it failed, failures so far, monotonic retry time)
+_failures: Dict[str, Tuple[Optional[Tuple[int, int, str]], int, float]] = {}
+# (vid, pid) pairs that identify doodads; empty accepts any serial port
+_doodad_ids: Set[Tuple[int, int]] = set()
+_skipped: Set[str] = set()  # Ports already logged as not being doodads
+
+
+def _parse_usb_ids(values: Iterable[object]) -> Set[Tuple[int, int]]:
+    ids = set()
+    for value in values:
+        vid, _, pid = str(value).partition(":")
+        try:
+            ids.add((int(vid, 16), int(pid, 16)))
+        except ValueError:
+            continue
+    return ids
+
+
+def configure(config: dict, loop: EventLoop | None, logger: logging.Logger) -> None:
+    """Apply the client config's [usb] table and start hot-plug monitoring if possible."""
+    global _backend, _monitored, _doodad_ids, _scan_due
+    usb_config = config.get("usb", {})
+    if not isinstance(usb_config, dict):
+        usb_config = {}
+    _backend = FakeBackend() if str(usb_config.get("backend", "serial")).lower() == "fake" else SerialBackend()
+    _doodad_ids = _parse_usb_ids(usb_config.get("doodads", []))
+    _monitored = loop is not None and _backend.start_monitor(loop, mark_changed)
+    _scan_due = True
+    mode = "hot-plug events" if _monitored else f"rescans every {SCAN_INTERVAL:g}s"
+    logger.info(f"USB backend {_backend.name}: new devices found via {mode}")
+
+
+def backend() -> SerialBackend | FakeBackend:
+    return _backend
+
+
+def mark_changed() -> None:
+    """Hot-plug hint: re-enumerate on the next poll."""
+    global _scan_due
+    _scan_due = True
+
+
+def _is_doodad(port: PortInfo) -> bool:
+    if not _doodad_ids:
+        return True
+    return (port.vid, port.pid) in _doodad_ids
+
+
+def candidate_ports(open_devices: Set[str], logger: logging.Logger) -> List[PortInfo]:
+    """Ports worth trying to open now; empty without enumerating unless a scan is due."""
+    global _ports, _scan_due, _next_scan
+    now = time.monotonic()
+    if _scan_due or now >= _next_scan:
+        _ports = _backend.enumerate()
+        _scan_due = False
+        _next_scan = now + (MONITORED_SCAN_INTERVAL if _monitored else SCAN_INTERVAL)
+        present = {port.device for port in _ports}
+        for dev in list(_failures):
+            if dev not in present:
+                del _failures[dev]
+        _skipped.intersection_update(present)
+    elif not _failures:
+        return []
+
+    open_identities = set()
+    candidates = []
+    for port in _ports:
+        if port.device in open_devices:
+            open_identities.add(port.identity())
+            continue
+        if not _is_doodad(port):
+            if port.device not in _skipped:
+                _skipped.add(port.device)
+                logger.debug(f"Ignoring non-doodad serial port {port.describe()}")
+            continue
+        failure = _failures.get(port.device)
+        if failure is not None:
+            identity, _, retry_at = failure
+            if identity == port.identity() and now < retry_at:
+                continue
+        candidates.append(port)
+    # The same physical doodad can briefly show up under two names while re-enumerating
+    return [port for port in candidates if port.identity() is None or port.identity() not in open_identities]
+
+
+def open_port(port: PortInfo, timeout: float, logger: logging.Logger):
+    """Open a candidate port, or record the failure and return None."""
+    try:
+        handle = _backend.open(port, timeout)
+    except Exception as e:
+        _, failures, _ = _failures.get(port.device, (None, 0, 0.0))
+        delay = min(RETRY_MAX, RETRY_MIN * (2 ** failures))
+        _failures[port.device] = (port.identity(), failures + 1, time.monotonic() + delay)
+        logger.debug(f"Failed opening {port.describe()}: {e}; retrying in {delay:g}s")
+        return None
+    _failures.pop(port.device, None)
+    return handle
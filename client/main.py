@@ -1,64 +1,144 @@
 import logging
+from pathlib import Path
 
 import client.network
-from client.network import attempt_connection, receive_packets, send_packet
-from client import usb as usb_io
+from client.network import attempt_connection, receive_packets, send_input, send_packet, flush_outbound
+from client import conditioning, usb as usb_io
 
-from common.gamestate import GameStatePacket, GameState, ClientState, StartLevelPacket
+from common.config import load_config
+from common.doodad import DoodadInputPacket
+from common.gamestate import GameStatePacket, GameState, ClientState, ResyncPacket, StateDeltaPacket, \
+    StateSnapshotPacket, StateView
+from common.logger import get_logger
+from common.loop import EventLoop
 from common.panel import Panel
 from common.packets import TextPacket
-from common.runner import run
+from common.runner import run, TickPolicy
+from common.stats import get_stats
 
 _state = GameState.IDLE
+_view = StateView()  # This panel's copy of the server's versioned state
 _panel = None
+_stats = get_stats("client")
+_loop: EventLoop | None = None
+_tick_policy = TickPolicy({})
+DISCONNECTED_FRAME_SECONDS = 0.05
 
-def main(player: int | None):
-    global _panel
+def main(player: int | None, transport: str | None = None):
+    global _panel, _stats, _loop, _tick_policy
     if player is None:
         print("No player specified")
         return 1
     _panel = Panel(player)
+    _stats = get_stats(f"client-{player}")
     client.network.PANEL = _panel
-    return run(
-        logger_name=f"client-{player}",
-        advertise_instance=f"ufogame-{player}",
-        advertise_port=8200 + player,
-        advertise_properties={"player": str(player)},
-        run_frame=run_frame,
-    )
+    config = load_config(Path(__file__).parent / "config.toml")
+    # "select" wakes on server/USB input as it arrives; "poll" sleeps between frames
+    if str(config.get("loop", "poll")).lower() == "select":
+        _loop = EventLoop()
+    client.network.attach_loop(_loop)
+    client.network.configure_discovery(config)
+    # "tcp", or "ring" for shared-memory rings to a server on this host; the CLI overrides config
+    client.network.configure_transport(str(transport or config.get("transport", "tcp")).lower())
+    client.network.configure_udp(config)
+    usb_io.attach_loop(_loop)
+    # The same logger run() uses; getting it here starts the log writer, so configuration messages are kept
+    usb_io.configure(config, get_logger(f"client-{player}"))
+    conditioning.configure(config, _loop)
+    _stats.counter_sources["input"] = conditioning.counters
+    _tick_policy = TickPolicy.from_config(config)
+    try:
+        return run(
+            logger_name=f"client-{player}",
+            advertise_instance=f"ufogame-{player}",
+            advertise_port=8200 + player,
+            advertise_properties={"player": str(player)},
+            run_frame=run_frame,
+            loop=_loop,
+            tick=tick_period,
+        )
+    finally:
+        client.network.stop_discovery()
+        if _loop is not None:
+            _loop.close()
 
-def run_frame(logger: logging.Logger) -> bool:
-    global _state, _panel
+
+def tick_period() -> float | None:
+    # Keep polling while disconnected so reconnect attempts and USB rescans continue
     if client.network.SOCKET is None:
-        if not attempt_connection(logger):
-            return True
+        return _tick_policy.default or DISCONNECTED_FRAME_SECONDS
+    return _tick_policy.period(_state)
+
+def run_frame(logger: logging.Logger) -> bool:
+    with _stats.phase("network"):
+        # Connecting never blocks, so USB keeps being serviced while the server is away
+        connected = attempt_connection(logger)
+        if connected:
+            handle_server_packets(logger, receive_packets(logger))
+            flush_outbound()
+
+    with _stats.phase("usb"):
+        # USB device handling: attempt connections and drain packets
+        usb_io.attempt_connections(logger)
+        usb_packets = usb_io.receive_packets(logger)
+        inputs = []
+        for dev, dev_packets in usb_packets.items():
+            for p in dev_packets:
+                if isinstance(p, DoodadInputPacket):
+                    inputs.append(p)
+                else:
+                    logger.info("usb %s: %s", dev, p)
+        if connected:
+            # Only meaningful changes leave the panel; the server routes them by (player, doodad id)
+            outgoing = conditioning.condition(inputs, _panel.doodad)
+            for p in outgoing:
+                send_input(p)
+            if outgoing:
+                flush_outbound()  # Slider datagrams go out this frame, not the next
+        else:
+            # The next connection starts from nothing sent
+            conditioning.reset()
+        usb_io.flush_outbound(logger)
+
+    return True
 
-    packets = receive_packets(logger)
+
+def handle_server_packets(logger: logging.Logger, packets) -> None:
     for p in packets:
         if isinstance(p, TextPacket):
-            logger.info(f"recv: {p.text}")
+            logger.info("recv: %s", p.text)
         if isinstance(p, GameStatePacket):
-            _state = p.state
-            countdown_info = f" {p.countdown}" if getattr(p, "countdown", 0) else ""
-            logger.info(f"recv: {p.state}{countdown_info}")
-            if p.state == GameState.RESET:
-                pass # RESET self
-            elif p.state == GameState.IDLE:
-                send_packet(ClientState(ready=True))  # TODO: Wait for user to turn key.
-            elif p.state == GameState.LEVEL_COUNTDOWN:
-                # Potentially update UI with p.countdown
-                pass
-            elif p.state == GameState.IN_LEVEL:
-                # Potentially update UI with p.level
-                pass
-        if isinstance(p, StartLevelPacket):
-            logger.info(f"Starting level {p.level}, doodads: {p.doodad_names}")
-    
-    # USB device handling: attempt connections and drain packets
-    usb_io.attempt_connections(logger)
-    usb_packets = usb_io.receive_packets(logger)
-    for dev, dev_packets in usb_packets.items():
-        for p in dev_packets:
-            logger.info(f"usb {dev}: {p}")
-    
-    return True
+            # Sent on connect: forget everything; a snapshot follows
+            _view.reset()
+            handle_state(logger, p.state, p.countdown)
+        if isinstance(p, (StateSnapshotPacket, StateDeltaPacket)):
+            changes = _view.apply(p)
+            if changes is None:
+                logger.info("State delta %s does not follow version %s; requesting resync", p.seq, _view.seq)
+                send_packet(ResyncPacket(seq=_view.seq or 0))
+            elif changes:
+                handle_state_changes(logger, changes)
+
+
+def handle_state_changes(logger: logging.Logger, changes: dict) -> None:
+    if "state" in changes or "countdown" in changes:
+        handle_state(logger, GameState(_view.get("state", _state)), _view.get("countdown", 0))
+    if "doodad_names" in changes:
+        logger.info(f"Starting level {_view.get('level')}, doodads: {changes['doodad_names']}")
+
+
+def handle_state(logger: logging.Logger, state: GameState, countdown: int) -> None:
+    global _state
+    _state = state
+    countdown_info = f" {countdown}" if countdown else ""
+    logger.info(f"recv: {state}{countdown_info}")
+    if state == GameState.RESET:
+        pass # RESET self
+    elif state == GameState.IDLE:
+        send_packet(ClientState(ready=True))  # TODO: Wait for user to turn key.
+    elif state == GameState.LEVEL_COUNTDOWN:
+        # Potentially update UI with countdown
+        pass
+    elif state == GameState.IN_LEVEL:
+        # Potentially update UI with the level
+        pass
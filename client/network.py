@@ -1,65 +1,373 @@
+import errno
 import json
 import logging
+import os
+import random
+import select
+import selectors
 import socket
+import time
+from threading import Thread
 
-from zeroconf import Zeroconf, IPVersion
-
-from common.packets import Packet, decode_lines, encode_packet
+from common.connect import ServiceCache
+from common.doodad import DoodadInputPacket, DoodadKind
+from common.loop import EventLoop
+from common.packets import Packet, LineFramer, decode_line
 from common.panel import Panel, panel_to_json
+from common.ring import RingSocket, connect_ring, ring_listener_name
+from common.wire import BinaryFramer, UdpAckPacket, WelcomePacket, SUPPORTED_WIRES, WIRE_JSON, encode_datagrams, \
+    encode_for, new_framer
 
-SOCKET: socket.socket | None = None
+SOCKET: socket.socket | RingSocket | None = None
 PANEL: Panel | None = None
-_RX_BUFFER: bytes = b""
+_RX_FRAMER: LineFramer | BinaryFramer = LineFramer()
+_WIRE = WIRE_JSON  # Encoding for this connection; switched by the server's WelcomePacket
+_AWAITING_WELCOME = False
+_TX_BUFFER = bytearray()  # Encoded bytes the kernel has not accepted yet
+# If the server stops reading for this long, reconnect rather than buffer without bound
+MAX_TX_BYTES = 64 * 1024
+# With a loop attached, socket activity wakes the runner; frames do the actual I/O
+_loop: EventLoop | None = None
+_want_write = False
+# Server instance found via a long-lived mDNS browser; started on the first connect attempt
+SERVER_INSTANCE = "ufogame-0"
+DEFAULT_SERVER_PORT = 8200
+_discovery: ServiceCache | None = None
+# Static (host, port) from config, tried whenever mDNS has no current record. A host name
+# is resolved on a background thread, so connect_ex() only ever gets numeric addresses
+_fallback_config: tuple[str, int] | None = None
+_fallback_address: tuple[str, int] | None = None  # Resolved; None until then
+_fallback_resolving = False
+# "tcp", or "ring" for shared-memory rings to a server on this host (test mode); ring
+# connections skip mDNS and go to the server's RingListener for the fallback port
+TRANSPORT = "tcp"
+_ring_count = 0
+# Non-blocking connect in progress, and when to give up on it
+_CONNECTING: socket.socket | None = None
+_connect_address: tuple[str, int] = ("", 0)
+_connect_discovered = False
+_connect_deadline = 0.0
+CONNECT_TIMEOUT = 2.0
+# Delay between failed attempts doubles from BACKOFF_MIN up to BACKOFF_MAX
+BACKOFF_MIN = 0.1
+BACKOFF_MAX = 5.0
+_backoff = 0.0
+_next_attempt = 0.0
+# Slider input goes out as datagrams when the server accepts the offer in its WelcomePacket;
+# everything else, and all input if the channel fails, stays on TCP
+_offer_udp = True
+_UDP_SOCKET: socket.socket | RingSocket | None = None
+_udp_token = 0
+_udp_seq = 0
+_UDP_PENDING: dict[str, DoodadInputPacket] = {}  # Latest value per slider since the last flush
+# Each value is sent UDP_REPEATS more times, UDP_REPEAT_INTERVAL apart, so one lost
+# datagram cannot strand a slider that has stopped moving
+UDP_REPEATS = 2
+UDP_REPEAT_INTERVAL = 0.05
+_udp_repeat: dict[str, tuple[DoodadInputPacket, int]] = {}
+_next_repeat = 0.0
+# The server acks the newest datagram it took, over TCP. Datagrams can vanish without
+# any local error (firewalls, access point client isolation), so with no ack for
+# UDP_ACK_TIMEOUT after sending, sliders go back to TCP for the rest of the connection
+UDP_ACK_TIMEOUT = 1.0
+_udp_unacked: dict[str, tuple[int, DoodadInputPacket]] = {}  # Latest value per slider and its datagram seq
+_udp_unacked_since: float | None = None
+
+
+def attach_loop(loop: EventLoop | None) -> None:
+    global _loop
+    _loop = loop
+
+
+def _wake_on(sock: socket.socket, write: bool) -> None:
+    global _want_write
+    if _loop is not None:
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if write else 0)
+        _loop.modify(sock, _on_socket_event, events)
+    _want_write = write
+
+
+def _on_socket_event(mask: int) -> None:
+    if mask & selectors.EVENT_WRITE:
+        flush_outbound()
+
+
+def configure_discovery(config: dict) -> None:
+    """Read the optional static `server` address ("host" or "host:port") from config."""
+    global _fallback_config, _fallback_address
+    value = str(config.get("server", "")).strip()
+    _fallback_config = _fallback_address = None
+    if not value:
+        return
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        host, port = value, str(DEFAULT_SERVER_PORT)
+    _fallback_config = (host, int(port))
+    _resolve_fallback()
+
+
+def _resolve_fallback() -> None:
+    """Look up the fallback host in the background; numeric addresses are used as they are."""
+    global _fallback_address, _fallback_resolving
+    if _fallback_config is None or _fallback_resolving:
+        return
+    host, port = _fallback_config
+    try:
+        socket.inet_aton(host)
+        _fallback_address = _fallback_config
+        return
+    except OSError:
+        pass
+    _fallback_resolving = True
+
+    def resolve() -> None:
+        global _fallback_address, _fallback_resolving
+        try:
+            infos = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)
+            _fallback_address = (infos[0][4][0], port)
+        except OSError:
+            pass  # Tried again on the next connect attempt that needs it
+        finally:
+            _fallback_resolving = False
+
+    Thread(target=resolve, name="resolve-server", daemon=True).start()
+
+
+def configure_transport(transport: str) -> None:
+    global TRANSPORT
+    TRANSPORT = transport if transport in ("tcp", "ring") else "tcp"
+
+
+def configure_udp(config: dict) -> None:
+    """Whether to offer the server a datagram channel for slider input (`udp`, default true)."""
+    global _offer_udp
+    _offer_udp = bool(config.get("udp", True))
+
+
+def stop_discovery() -> None:
+    global _discovery
+    if _discovery is not None:
+        _discovery.close()
+        _discovery = None
+
+
+def _server_address() -> tuple[tuple[str, int] | None, bool]:
+    """Address to try next and whether it came from mDNS (vs. the static fallback)."""
+    global _discovery
+    if _discovery is None:
+        _discovery = ServiceCache(SERVER_INSTANCE)
+        _discovery.start()
+    address = _discovery.lookup()
+    if address is not None:
+        return address, True
+    if _fallback_address is None:
+        _resolve_fallback()
+    return _fallback_address, False
+
+
+def _reset_connection() -> None:
+    global SOCKET, _RX_FRAMER, _WIRE, _AWAITING_WELCOME, _want_write
+    if SOCKET is not None:
+        if _loop is not None:
+            _loop.unregister(SOCKET)
+        try:
+            SOCKET.close()
+        except Exception:
+            pass
+    SOCKET = None
+    _RX_FRAMER = LineFramer()
+    _WIRE = WIRE_JSON
+    _AWAITING_WELCOME = False
+    _want_write = False
+    _TX_BUFFER.clear()
+    _close_udp()
+
+
+def _close_udp() -> None:
+    global _UDP_SOCKET, _udp_token, _udp_unacked_since
+    if _UDP_SOCKET is not None:
+        try:
+            _UDP_SOCKET.close()
+        except Exception:
+            pass
+    _UDP_SOCKET = None
+    _udp_token = 0
+    _UDP_PENDING.clear()
+    _udp_repeat.clear()
+    _udp_unacked.clear()
+    _udp_unacked_since = None
+
+
+def _open_udp(welcome: WelcomePacket) -> None:
+    global _UDP_SOCKET, _udp_token, _udp_seq
+    u = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        u.setblocking(False)
+        u.connect((_connect_address[0], welcome.udp_port))
+    except OSError:
+        u.close()
+        return
+    _UDP_SOCKET = u
+    _udp_token = welcome.udp_token
+    _udp_seq = 0
+
+
+def _schedule_retry(logger: logging.Logger, reason: str) -> None:
+    """Back off before the next attempt: exponential, with jitter so panels do not retry in lockstep."""
+    global _next_attempt, _backoff
+    _backoff = min(BACKOFF_MAX, _backoff * 2) if _backoff else BACKOFF_MIN
+    delay = _backoff * random.uniform(0.5, 1.0)
+    _next_attempt = time.monotonic() + delay
+    logger.debug(f"{reason}; retrying in {delay:.2f}s")
+
+
+def _abort_connect() -> None:
+    global _CONNECTING
+    if _CONNECTING is not None:
+        if _loop is not None:
+            _loop.unregister(_CONNECTING)
+        try:
+            _CONNECTING.close()
+        except Exception:
+            pass
+    _CONNECTING = None
 
 
 def attempt_connection(logger: logging.Logger) -> bool:
-    global SOCKET, PANEL
-    if SOCKET is None:
+    """Advance the non-blocking connect; True once connected. Never blocks the frame."""
+    global _CONNECTING, _connect_address, _connect_deadline, _connect_discovered
+    if SOCKET is not None:
+        return True
+    if TRANSPORT == "ring":
+        return _attempt_ring_connection(logger)
+    now = time.monotonic()
+    if _CONNECTING is None:
+        if now < _next_attempt:
+            return False
+        address, discovered = _server_address()
+        if address is None:
+            _schedule_retry(logger, f"No {SERVER_INSTANCE} service found via mDNS and no fallback address resolved")
+            return False
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
         try:
-            service_type = "_ufogame-0._tcp.local."
-            instance_name = f"ufogame-0.{service_type}"
-            zc = Zeroconf(ip_version=IPVersion.All)
-            try:
-                info = zc.get_service_info(service_type, instance_name, timeout=1000)
-            finally:
-                zc.close()
-            if not info or not info.addresses:
-                logger.debug("No ufogame-0 service found via mDNS")
-                return False
-            ip_bytes = info.addresses[0]
-            ip_str = socket.inet_ntoa(ip_bytes)
-            port = info.port
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(0.75)
-            s.connect((ip_str, port))
-            # Send PANEL handshake as JSON line before switching to nonblocking
-            try:
-                payload = json.dumps(panel_to_json(PANEL) if PANEL else {}) + "\n"
-                s.sendall(payload.encode("utf-8"))
-            except Exception as e:
-                try:
-                    s.close()
-                except Exception:
-                    pass
-                logger.debug(f"Failed sending handshake: {e}")
-                return False
-            s.setblocking(False)
-            SOCKET = s
-            logger.info(f"Connected to server at {ip_str}:{port}")
+            err = s.connect_ex(address)
         except Exception as e:
-            if SOCKET is not None:
-                try:
-                    SOCKET.close()
-                except Exception:
-                    pass
-                SOCKET = None
-            logger.debug(f"Connect attempt failed: {e}")
+            s.close()
+            _schedule_retry(logger, f"Connect attempt to {address[0]}:{address[1]} failed: {e}")
             return False
-        return True
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            s.close()
+            _connect_failed(logger, address, discovered, os.strerror(err))
+            return False
+        _CONNECTING = s
+        _connect_address = address
+        _connect_discovered = discovered
+        _connect_deadline = now + CONNECT_TIMEOUT
+        if _loop is not None:
+            # Writable means the connect finished either way; the wake runs a frame to look
+            _loop.register(s, _on_socket_event, selectors.EVENT_WRITE)
+
+    s = _CONNECTING
+    _, writable, _ = select.select([], [s], [], 0)
+    if not writable:
+        if now >= _connect_deadline:
+            _abort_connect()
+            _connect_failed(logger, _connect_address, _connect_discovered, "timed out")
+        return False
+    err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if err:
+        _abort_connect()
+        _connect_failed(logger, _connect_address, _connect_discovered, os.strerror(err))
+        return False
+
+    if _loop is not None:
+        _loop.unregister(s)
+    _CONNECTING = None
+    if not _start_session(logger, s, _offer_udp):
+        return False
+    ip_str, port = _connect_address
+    logger.info(f"Connected to server at {ip_str}:{port}")
+    return True
+
+
+def _attempt_ring_connection(logger: logging.Logger) -> bool:
+    global _ring_count
+    if time.monotonic() < _next_attempt:
+        return False
+    port = _fallback_config[1] if _fallback_config is not None else DEFAULT_SERVER_PORT
+    listener = ring_listener_name(port)
+    _ring_count += 1
+    try:
+        s = connect_ring(listener, f"ufogame-p{PANEL.player if PANEL else 0}-{os.getpid()}-{_ring_count}")
+    except OSError as e:
+        _schedule_retry(logger, f"No ring server {listener} on this host: {e}")
+        return False
+    # Datagrams would go through the kernel, so everything stays on the ring
+    if not _start_session(logger, s, offer_udp=False):
+        return False
+    logger.info(f"Connected to server ring {listener}")
+    return True
+
+
+def _start_session(logger: logging.Logger, s: socket.socket | RingSocket, offer_udp: bool) -> bool:
+    """Make `s` the server connection and queue the handshake."""
+    global SOCKET, _AWAITING_WELCOME
+    _reset_connection()
+    SOCKET = s
+    _AWAITING_WELCOME = True
+    _wake_on(s, write=False)
+    # The handshake goes out through the normal send buffer, so a full socket cannot block us
+    handshake = panel_to_json(PANEL) if PANEL else {}
+    handshake["wire"] = list(SUPPORTED_WIRES)
+    handshake["state_sync"] = True  # Versioned snapshots/deltas instead of GameStatePacket/StartLevelPacket
+    if offer_udp:
+        handshake["udp"] = True
+    _TX_BUFFER.extend((json.dumps(handshake) + "\n").encode("utf-8"))
+    if not flush_outbound():
+        _schedule_retry(logger, "Failed sending handshake")
+        return False
+    return True
+
+
+def _connect_failed(logger: logging.Logger, address: tuple[str, int], discovered: bool, reason: str) -> None:
+    if discovered and _discovery is not None:
+        # Keep retrying the cached address, but check it is still current
+        _discovery.refresh()
+    elif not discovered and _fallback_address is not None and _fallback_address != _fallback_config:
+        _resolve_fallback()  # The host name may point somewhere else by now
+    _schedule_retry(logger, f"Connect attempt to {address[0]}:{address[1]} failed: {reason}")
+
+
+def _reset_backoff() -> None:
+    """The server accepted the handshake, so the next disconnect retries right away."""
+    global _backoff, _next_attempt
+    _backoff = 0.0
+    _next_attempt = 0.0
+
+
+def _read_greeting(data: bytes) -> list[Packet]:
+    """Consume the server's first line, switching encoding if it is a WelcomePacket."""
+    global _RX_FRAMER, _WIRE, _AWAITING_WELCOME
+    lines = _RX_FRAMER.feed(data, max_lines=1)
+    if not lines:
+        return []
+    _AWAITING_WELCOME = False
+    _reset_backoff()
+    first = decode_line(lines[0])
+    rest = _RX_FRAMER.take_buffer()
+    if isinstance(first, WelcomePacket):
+        _WIRE = first.wire
+        if first.udp_token:
+            _open_udp(first)
+        _RX_FRAMER = new_framer(_WIRE)
+        return _RX_FRAMER.decode(rest)
+    # Server predates wire negotiation, so the first line is already a packet
+    return [first, *_RX_FRAMER.decode(rest)]
 
 
 def receive_packets(logger: logging.Logger) -> list[Packet]:
-    global SOCKET, _RX_BUFFER
+    global SOCKET
     packets: list[Packet] = []
     if SOCKET is None:
         return packets
@@ -70,39 +378,129 @@ def receive_packets(logger: logging.Logger) -> list[Packet]:
             except BlockingIOError:
                 break
             if not data:
-                try:
-                    SOCKET.close()
-                except Exception:
-                    pass
-                SOCKET = None
+                if _AWAITING_WELCOME:
+                    # Closed before greeting us (handshake rejected?); don't hammer it
+                    _schedule_retry(logger, "Server closed connection during handshake")
+                _reset_connection()
                 logger.info("Server closed connection; will retry")
                 break
-            _RX_BUFFER += data
-            decoded, remainder = decode_lines(_RX_BUFFER)
-            _RX_BUFFER = remainder
-            packets.extend(decoded)
+            if _AWAITING_WELCOME:
+                packets.extend(_read_greeting(data))
+            else:
+                packets.extend(_RX_FRAMER.decode(data))
     except Exception as e:
-        try:
-            SOCKET.close()
-        except Exception:
-            pass
-        SOCKET = None
+        _reset_connection()
         logger.debug(f"Socket error; resetting: {e}")
+    if any(isinstance(p, UdpAckPacket) for p in packets):
+        _udp_acked(max(p.seq for p in packets if isinstance(p, UdpAckPacket)))
+        packets = [p for p in packets if not isinstance(p, UdpAckPacket)]
     return packets
 
 
+def _udp_acked(seq: int) -> None:
+    global _udp_unacked_since
+    for ident, (sent_seq, _) in list(_udp_unacked.items()):
+        if sent_seq <= seq:
+            del _udp_unacked[ident]
+    # The channel works; anything still unacked gets a fresh timeout
+    _udp_unacked_since = time.monotonic() if _udp_unacked else None
+    if _udp_unacked and _loop is not None:
+        _loop.call_at(_udp_unacked_since + UDP_ACK_TIMEOUT)
+
+
+def _fall_back_to_tcp() -> None:
+    """Stop using datagrams; the newest value of every slider not known to have arrived goes over TCP."""
+    latest = {ident: packet for ident, (_, packet) in _udp_unacked.items()}
+    latest.update(_UDP_PENDING)
+    _close_udp()
+    for packet in latest.values():
+        send_packet(packet)
+
+
 def send_packet(packet: Packet) -> bool:
-    global SOCKET
     if SOCKET is None:
         return False
+    data = encode_for(packet, _WIRE)
+    if len(_TX_BUFFER) + len(data) > MAX_TX_BYTES:
+        _reset_connection()
+        return False
+    _TX_BUFFER.extend(data)
+    return flush_outbound()
+
+
+def send_input(packet: DoodadInputPacket) -> bool:
+    """Send doodad input: slider positions on the datagram channel when there is one, the rest on TCP."""
+    if _UDP_SOCKET is not None and PANEL is not None:
+        doodad = PANEL.doodad(packet.doodad)
+        if doodad is not None and doodad.kind == DoodadKind.Slider:
+            # Latest value wins; the next flush_outbound sends it
+            _UDP_PENDING[packet.doodad] = packet
+            return True
+    return send_packet(packet)
+
+
+def _flush_datagrams() -> None:
+    """Send this frame's slider values plus any repeats that are due."""
+    global _udp_seq, _next_repeat, _udp_unacked_since
+    now = time.monotonic()
+    if _udp_unacked_since is not None and now - _udp_unacked_since >= UDP_ACK_TIMEOUT:
+        _fall_back_to_tcp()
+        return
+    if not _UDP_PENDING and (not _udp_repeat or now < _next_repeat):
+        return
+    packets = list(_UDP_PENDING.values())
+    if now >= _next_repeat:
+        packets += [packet for ident, (packet, _) in _udp_repeat.items() if ident not in _UDP_PENDING]
+    unsent = 0
+    try:
+        for seq, datagram in encode_datagrams(_udp_token, _udp_seq + 1, packets):
+            _UDP_SOCKET.send(datagram)
+            _udp_seq = seq
+    except (BlockingIOError, InterruptedError):
+        unsent = 1  # Dropped like any other lost datagram; the repeat covers it, so wait for its ack
+    except OSError:
+        # No route, or the server refused the port: fall back to TCP for good
+        _fall_back_to_tcp()
+        return
+    for ident, packet in _UDP_PENDING.items():
+        _udp_unacked[ident] = (_udp_seq + unsent, packet)
+    if _udp_unacked and _udp_unacked_since is None:
+        _udp_unacked_since = now
+        if _loop is not None:
+            _loop.call_at(now + UDP_ACK_TIMEOUT)  # Check for the ack even if no other frame runs
+    had_repeats = bool(_udp_repeat)
+    if now >= _next_repeat:
+        for ident, (packet, left) in list(_udp_repeat.items()):
+            if ident in _UDP_PENDING:
+                continue
+            if left > 1:
+                _udp_repeat[ident] = (packet, left - 1)
+            else:
+                del _udp_repeat[ident]
+        _next_repeat = now + UDP_REPEAT_INTERVAL
+        had_repeats = False
+    for ident, packet in _UDP_PENDING.items():
+        _udp_repeat[ident] = (packet, UDP_REPEATS)
+    _UDP_PENDING.clear()
+    if _udp_repeat and not had_repeats and _loop is not None:
+        _loop.call_at(_next_repeat)  # Repeats go out even if no other frame runs
+
+
+def flush_outbound() -> bool:
+    """Write as much queued output as the socket accepts; False if the connection was reset."""
+    if SOCKET is None:
+        return False
+    if _UDP_SOCKET is not None:
+        _flush_datagrams()
     try:
-        data = encode_packet(packet)
-        SOCKET.sendall(data)
-        return True
+        while _TX_BUFFER:
+            sent = SOCKET.send(_TX_BUFFER)
+            del _TX_BUFFER[:sent]
+    except (BlockingIOError, InterruptedError):
+        pass
     except Exception:
-        try:
-            SOCKET.close()
-        except Exception:
-            pass
-        SOCKET = None
+        _reset_connection()
         return False
+    if bool(_TX_BUFFER) != _want_write:
+        _wake_on(SOCKET, write=bool(_TX_BUFFER))
+    return True
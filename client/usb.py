@@ -1,130 +1,241 @@
+import itertools
 import logging
-from typing import Dict, List
+import select
+import selectors
+from queue import Empty, SimpleQueue
+from threading import Event, Thread
+from typing import Dict, List, Optional, Set, Tuple
 
-try:
-    import serial  # type: ignore
-    from serial.tools import list_ports  # type: ignore
-except Exception as e:  # pragma: no cover
-    serial = None
-    list_ports = None
-
-from common.packets import Packet, decode_lines, encode_packet
+from client import devices
+from common.loop import EventLoop
+from common.packets import Packet, LineFramer, encode_packet
 
 
 # Open USB CDC devices and exchange Packet-framed JSON lines.
 _SERIALS: Dict[str, "serial.Serial"] = {}
-_RX_BUFFERS: Dict[str, bytes] = {}
+# One reader thread per device frames and decodes lines as they arrive
+_READERS: Dict[str, "_Reader"] = {}
+# Readers hand (device, packets, note) to the frame; packets=None means the device failed
+_INBOX: "SimpleQueue[Tuple[str, Optional[List[Packet]], str]]" = SimpleQueue()
+# Doodad packets are small; anything longer is a misbehaving device
+MAX_DOODAD_LINE = 4096
+# Bounds how long a reader blocks in read(), and so how quickly it notices a close
+READ_TIMEOUT = 0.1
+# Output queued this frame per device, keyed so a newer packet for the same doodad
+# replaces an older one; flush_outbound moves it into _TX_BUFFERS
+_PENDING: Dict[str, Dict[object, bytes]] = {}
+# Encoded bytes the device has not accepted yet
+_TX_BUFFERS: Dict[str, bytearray] = {}
+# A doodad that stops reading loses queued output rather than growing it without bound
+MAX_TX_BYTES = 16 * 1024
+_unique_keys = itertools.count()
+_WRITE_WAIT: Set[str] = set()  # Devices registered with the loop for writability
+# Devices whose _TX_BUFFERS entry starts partway through a line; the rest of it must
+# still go out, or the device would read the next line glued onto the first half
+_TX_MID_LINE: Set[str] = set()
+# With a loop attached, readers wake the runner when they queue packets
+_loop: EventLoop | None = None
+
+
+class _Reader(Thread):
+    """Blocking reads from one serial port, framed and decoded off the frame path."""
+
+    def __init__(self, dev: str, ser: "serial.Serial"):
+        super().__init__(name=f"usb-{dev}", daemon=True)
+        self.dev = dev
+        self.ser = ser
+        self.stop = Event()
+        self.framer = LineFramer(MAX_DOODAD_LINE)
+
+    def run(self) -> None:
+        try:
+            while not self.stop.is_set():
+                data = self.ser.read(self.ser.in_waiting or 1)
+                if not data:
+                    continue
+                dropped = self.framer.dropped_lines
+                packets = self.framer.decode(data)
+                if self.framer.dropped_lines != dropped:
+                    _post(self.dev, [], f"discarded line over {MAX_DOODAD_LINE} bytes")
+                if packets:
+                    _post(self.dev, packets)
+        except Exception as e:
+            if not self.stop.is_set():
+                _post(self.dev, None, str(e))
 
 
-def _iter_candidate_ports() -> List[str]:
-    if list_ports is None:
-        return []
-    ports = []
-    for p in list_ports.comports():
-        dev = getattr(p, "device", None) or getattr(p, "name", None)
-        if not dev:
-            continue
-        ports.append(str(dev))
-    return ports
+def _post(dev: str, packets: Optional[List[Packet]], note: str = "") -> None:
+    _INBOX.put((dev, packets, note))
+    if _loop is not None:
+        _loop.wake()
+
+
+def attach_loop(loop: EventLoop | None) -> None:
+    global _loop
+    _loop = loop
+
+
+def configure(config: dict, logger: logging.Logger) -> None:
+    """Pick the device backend and doodad ids from config; call after attach_loop."""
+    devices.configure(config, _loop, logger)
+
+
+def _close_device(dev: str) -> None:
+    ser = _SERIALS.pop(dev, None)
+    reader = _READERS.pop(dev, None)
+    _PENDING.pop(dev, None)
+    _TX_BUFFERS.pop(dev, None)
+    _TX_MID_LINE.discard(dev)
+    _WRITE_WAIT.discard(dev)
+    if reader is not None:
+        reader.stop.set()
+    if ser is None:
+        return
+    if _loop is not None:
+        _loop.unregister(ser)
+    # Unplugged or re-enumerating; look at the port list again on the next frame
+    devices.mark_changed()
+    try:
+        ser.close()
+    except Exception:
+        pass
 
 
 def attempt_connections(logger: logging.Logger) -> bool:
-    """Scan for new USB serial devices and open them.
+    """Open doodad ports the device manager reports as new or due for a retry.
 
     Returns True if at least one connection is (or remains) available; False if none.
     """
-    if serial is None:
+    if not devices.backend().available():
         logger.debug("pyserial not installed; USB disabled")
         return False
 
-    any_available = bool(_SERIALS)
-    for dev in _iter_candidate_ports():
-        if dev in _SERIALS:
-            any_available = True
+    for port in devices.candidate_ports(set(_SERIALS), logger):
+        ser = devices.open_port(port, READ_TIMEOUT, logger)
+        if ser is None:
             continue
-        try:
-            ser = serial.Serial(dev, baudrate=115200, timeout=0)  # Non-blocking
-            _SERIALS[dev] = ser
-            _RX_BUFFERS[dev] = b""
-            any_available = True
-            logger.info(f"USB device connected: {dev}")
-        except Exception as e:
-            logger.debug(f"Failed opening {dev}: {e}")
+        dev = port.device
+        _SERIALS[dev] = ser
+        _PENDING[dev] = {}
+        _TX_BUFFERS[dev] = bytearray()
+        reader = _READERS[dev] = _Reader(dev, ser)
+        reader.start()
+        logger.info(f"USB device connected: {port.describe()}")
     # Drop handles that disappeared
     for dev in list(_SERIALS.keys()):
         ser = _SERIALS[dev]
         if not ser.is_open:
-            try:
-                ser.close()
-            except Exception:
-                pass
-            _SERIALS.pop(dev, None)
-            _RX_BUFFERS.pop(dev, None)
+            _close_device(dev)
             logger.info(f"USB device disconnected: {dev}")
-    return any_available
+    return bool(_SERIALS)
 
 
 def receive_packets(logger: logging.Logger) -> Dict[str, List[Packet]]:
-    """Drain available data from each USB device and decode Packets.
+    """Collect packets the reader threads decoded since the last frame.
 
     Returns mapping of device-id (port name) to list of Packets.
     """
     packets_by_dev: Dict[str, List[Packet]] = {}
-    for dev, ser in list(_SERIALS.items()):
+    while True:
         try:
-            while True:
-                data = ser.read(4096)
-                if not data:
-                    break
-                buf = _RX_BUFFERS.get(dev, b"") + data
-                decoded, remainder = decode_lines(buf)
-                _RX_BUFFERS[dev] = remainder
-                if decoded:
-                    packets_by_dev.setdefault(dev, []).extend(decoded)
-        except Exception as e:
-            try:
-                ser.close()
-            except Exception:
-                pass
-            _SERIALS.pop(dev, None)
-            _RX_BUFFERS.pop(dev, None)
-            logger.info(f"USB device error/disconnected: {dev} ({e})")
+            dev, packets, note = _INBOX.get_nowait()
+        except Empty:
+            break
+        if packets is None:
+            if dev in _SERIALS:
+                _close_device(dev)
+                logger.info(f"USB device error/disconnected: {dev} ({note})")
+            continue
+        if note:
+            logger.info(f"USB device {dev}: {note}")
+        # A reader can post once more after its device was closed; drop that
+        if packets and dev in _SERIALS:
+            packets_by_dev.setdefault(dev, []).extend(packets)
     return packets_by_dev
 
 
+def _coalesce_key(packet: Packet) -> object:
+    """Packets aimed at one doodad supersede earlier ones of the same type in a frame."""
+    doodad = getattr(packet, "doodad", None)
+    if doodad is None:
+        return next(_unique_keys)
+    return packet.type, doodad
+
+
 def send_packet(dev: str, packet: Packet) -> bool:
-    ser = _SERIALS.get(dev)
-    if ser is None:
-        return False
-    try:
-        ser.write(encode_packet(packet))
-        ser.flush()
-        return True
-    except Exception:
-        try:
-            ser.close()
-        except Exception:
-            pass
-        _SERIALS.pop(dev, None)
-        _RX_BUFFERS.pop(dev, None)
+    """Queue a packet for one device; it is written by the next flush_outbound."""
+    pending = _PENDING.get(dev)
+    if pending is None:
         return False
+    key = _coalesce_key(packet)
+    pending.pop(key, None)  # Re-insert so the newest value keeps its place at the end
+    pending[key] = encode_packet(packet)
+    return True
 
 
 def send_packet_all(packet: Packet) -> int:
+    """Queue one packet for every device, encoding it once."""
     data = encode_packet(packet)
-    delivered = 0
-    for dev, ser in list(_SERIALS.items()):
-        try:
-            ser.write(data)
-            ser.flush()
-            delivered += 1
-        except Exception:
-            try:
-                ser.close()
-            except Exception:
-                pass
-            _SERIALS.pop(dev, None)
-            _RX_BUFFERS.pop(dev, None)
-    return delivered
+    key = _coalesce_key(packet)
+    for pending in _PENDING.values():
+        pending.pop(key, None)
+        pending[key] = data
+    return len(_PENDING)
+
 
+def _writable(ser) -> bool:
+    fileno = getattr(ser, "fileno", None)
+    if fileno is None:
+        return True
+    _, ready, _ = select.select([], [fileno()], [], 0)
+    return bool(ready)
 
+
+def _write_device(dev: str) -> bool:
+    """Write what the device accepts without blocking; False if it was closed."""
+    ser = _SERIALS.get(dev)
+    tx = _TX_BUFFERS.get(dev)
+    if ser is None or tx is None:
+        return False
+    try:
+        # pyserial spins on EAGAIN even with write_timeout=0, so only write when the tty has room
+        while tx and _writable(ser):
+            written = ser.write(tx)  # write_timeout=0: returns what the tty took
+            if not written:
+                break
+            if tx[written - 1] == 0x0A:
+                _TX_MID_LINE.discard(dev)
+            else:
+                _TX_MID_LINE.add(dev)
+            del tx[:written]
+    except Exception:
+        _close_device(dev)
+        return False
+    if _loop is not None and bool(tx) != (dev in _WRITE_WAIT):
+        # Wake when the tty drains rather than polling it every frame
+        if tx:
+            _WRITE_WAIT.add(dev)
+            _loop.register(ser, lambda mask, dev=dev: _write_device(dev), selectors.EVENT_WRITE)
+        else:
+            _WRITE_WAIT.discard(dev)
+            _loop.unregister(ser)
+    return True
+
+
+def flush_outbound(logger: logging.Logger) -> int:
+    """Move this frame's queued packets to each device and write them; returns devices written."""
+    written = 0
+    for dev in list(_PENDING):
+        pending = _PENDING[dev]
+        tx = _TX_BUFFERS[dev]
+        if pending:
+            if len(tx) > MAX_TX_BYTES:
+                # Drop whole lines only: the end of a line the device has started stays queued
+                keep = tx.find(b"\n") + 1 if dev in _TX_MID_LINE else 0
+                logger.info(f"USB device {dev}: not reading; dropped {len(tx) - keep} queued bytes")
+                del tx[keep:]
+            tx += b"".join(pending.values())
+            pending.clear()
+        if tx and _write_device(dev):
+            written += 1
+    return written
@@ -0,0 +1,14 @@
+import tomllib
+from pathlib import Path
+from typing import Any, Dict
+
+
+def load_config(path: Path) -> Dict[str, Any]:
+    """Read a TOML config file; a missing or unreadable file yields an empty dict."""
+    if not path.exists():
+        return {}
+    try:
+        with path.open("rb") as f:
+            return tomllib.load(f)
+    except Exception:
+        return {}
@@ -1,7 +1,14 @@
-from threading import Event, Thread
-from typing import Optional
-from zeroconf import IPVersion, ServiceInfo, Zeroconf
+from threading import Event, Lock, Thread
+from typing import Optional, Tuple
+from zeroconf import IPVersion, ServiceBrowser, ServiceInfo, ServiceListener, Zeroconf, current_time_millis
 import socket
+import time
+
+# Used when the responder's records are no longer in zeroconf's cache to read a TTL from
+DEFAULT_SERVICE_TTL = 120.0
+# Fraction of the TTL after which lookup() starts re-resolving in the background, so a
+# server that is still there never drops out of the cache
+REFRESH_AT = 0.8
 
 
 def start_mdns_advertiser(instance: str, port: int, properties: Optional[dict] = None) -> Event:
@@ -14,15 +21,7 @@ def start_mdns_advertiser(instance: str, port: int, properties: Optional[dict] =
 def _advertise_mdns(instance: str, port: int, properties: dict, stop_event: Event) -> None:
     zeroconf = Zeroconf(ip_version=IPVersion.All)
     asc = socket.gethostname()
-    # Derive service type as _ufogame-{n}._tcp.local. when instance matches ufogame-{n}
-    type_ = "_ufogame._tcp.local."
-    try:
-        if instance.startswith("ufogame-"):
-            suffix = instance.split("-", 1)[1]
-            if suffix.isdigit():
-                type_ = f"_ufogame-{suffix}._tcp.local."
-    except Exception:
-        pass
+    type_ = service_type(instance)
     name = f"{instance}.{type_}"
     ip = _get_local_ip()
     info = ServiceInfo(
@@ -44,6 +43,128 @@ def _advertise_mdns(instance: str, port: int, properties: dict, stop_event: Even
         zeroconf.close()
 
 
+def service_type(instance: str) -> str:
+    """Service type for an instance: _ufogame-{n}._tcp.local. when instance matches ufogame-{n}."""
+    if instance.startswith("ufogame-"):
+        suffix = instance.split("-", 1)[1]
+        if suffix.isdigit():
+            return f"_ufogame-{suffix}._tcp.local."
+    return "_ufogame._tcp.local."
+
+
+class ServiceCache(ServiceListener):
+    """Long-lived mDNS browser holding the current address of one service instance.
+
+    A ServiceBrowser thread resolves the instance when it is announced or
+    updated and forgets it on goodbye packets or record expiry, so `lookup`
+    never touches the network. Entries also expire locally after the TTL the
+    responder advertised, in case a removal is missed; zeroconf does not report
+    refreshed records as updates, so `lookup` re-resolves in the background
+    once most of the TTL has passed.
+    """
+
+    def __init__(self, instance: str):
+        self.type_ = service_type(instance)
+        self.name = f"{instance}.{self.type_}"
+        self._lock = Lock()
+        self._address: Optional[Tuple[str, int]] = None
+        self._expires = 0.0
+        self._refresh_at = float("inf")  # Set once the instance has been resolved
+        self._zeroconf: Optional[Zeroconf] = None
+        self._browser: Optional[ServiceBrowser] = None
+        self._refreshing = False
+
+    def start(self) -> None:
+        if self._zeroconf is None:
+            self._zeroconf = Zeroconf(ip_version=IPVersion.All)
+            self._browser = ServiceBrowser(self._zeroconf, self.type_, listener=self)
+
+    def close(self) -> None:
+        if self._browser is not None:
+            self._browser.cancel()
+            self._browser = None
+        if self._zeroconf is not None:
+            self._zeroconf.close()
+            self._zeroconf = None
+        self.invalidate()
+
+    def lookup(self) -> Optional[Tuple[str, int]]:
+        """Cached (host, port) of the instance, or None if unknown or expired."""
+        with self._lock:
+            now = time.monotonic()
+            if self._address is not None and now >= self._expires:
+                self._address = None
+            address = self._address
+            due = now >= self._refresh_at and not self._refreshing
+        if due:
+            self.refresh()
+        return address
+
+    def invalidate(self) -> None:
+        """Forget the cached address, e.g. after a connect to it failed."""
+        with self._lock:
+            self._address = None
+
+    def refresh(self) -> None:
+        """Re-resolve in the background, e.g. after connecting to the cached address failed."""
+        zc = self._zeroconf
+        with self._lock:
+            if zc is None or self._refreshing:
+                return
+            self._refreshing = True
+        Thread(target=self._refresh, args=(zc,), daemon=True).start()
+
+    def _refresh(self, zc: Zeroconf) -> None:
+        try:
+            if not self._resolve(zc, self.type_, self.name):
+                self.invalidate()
+        except Exception:
+            self.invalidate()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
+        self._resolve(zc, type_, name)
+
+    def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
+        self._resolve(zc, type_, name)
+
+    def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
+        if name.lower() == self.name.lower():
+            with self._lock:
+                self._refresh_at = float("inf")  # Gone for good; the browser reports its return
+            self.invalidate()
+
+    def _resolve(self, zc: Zeroconf, type_: str, name: str) -> bool:
+        if name.lower() != self.name.lower():
+            return False
+        # Runs on the browser (or refresh) thread, so blocking here does not stall frames
+        info = zc.get_service_info(type_, name, timeout=3000)
+        if info is None:
+            return False
+        addresses = info.parsed_addresses(IPVersion.V4Only)
+        if not addresses or not info.port:
+            return False
+        ttl = _remaining_ttl(zc, info)
+        with self._lock:
+            now = time.monotonic()
+            self._address = (addresses[0], info.port)
+            self._expires = now + ttl
+            self._refresh_at = now + ttl * REFRESH_AT
+        return True
+
+
+def _remaining_ttl(zc: Zeroconf, info: ServiceInfo) -> float:
+    """Seconds until the first cached record for the instance or its host expires."""
+    now = current_time_millis()
+    records = list(zc.cache.entries_with_name(info.key))
+    if info.server_key:
+        records += zc.cache.entries_with_name(info.server_key)
+    remaining = [ttl for ttl in (record.get_remaining_ttl(now) for record in records) if ttl > 0]
+    return float(min(remaining)) if remaining else DEFAULT_SERVICE_TTL
+
+
 def _get_local_ip() -> str:
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
@@ -1,4 +1,10 @@
 from enum import Enum
+from typing import Dict, Literal
+
+from pydantic import TypeAdapter
+
+from common.packets import Packet
+from common.wire import register_struct_codec
 
 class DoodadKind(Enum):
     SingleButton = 0
@@ -6,6 +12,9 @@ class DoodadKind(Enum):
     Slider = 2
 
 class Doodad:
+    # Panels can carry many doodads; slots keep each one a few fixed fields
+    __slots__ = ("id", "player", "kind", "name")
+
     def __init__(self, ident: str, player: int, kind: DoodadKind):
         self.id = ident
         self.player = player
@@ -24,3 +33,33 @@ class Doodad:
             case DoodadKind.Slider:
                 return f"Slider({self.id})"
         return f"Doodad({self.id})"
+
+
+class DoodadInputPacket(Packet):
+    """A doodad's control changed: button state or slider position."""
+    type: Literal["doodad_input"] = "doodad_input"
+    doodad: str  # Doodad id, e.g. "0D50"
+    value: int
+
+
+def _pack_doodad_input(p: DoodadInputPacket) -> tuple:
+    ident = int(p.doodad, 16)
+    if f"{ident:04X}" != p.doodad:
+        raise ValueError(f"Doodad id {p.doodad!r} is not 4 upper-case hex digits")
+    return ident, p.value
+
+
+# Slider input is decoded in bulk: ids are formatted once, and a dict goes straight to
+# the compiled validator, which is cheaper than keyword __init__
+_ID_STRINGS: Dict[int, str] = {}
+_VALIDATE_INPUT = TypeAdapter(DoodadInputPacket).validate_python
+
+
+def _unpack_doodad_input(t: tuple) -> DoodadInputPacket:
+    ident = _ID_STRINGS.get(t[0])
+    if ident is None:
+        ident = _ID_STRINGS[t[0]] = f"{t[0]:04X}"
+    return _VALIDATE_INPUT({"doodad": ident, "value": t[1]})
+
+
+register_struct_codec(DoodadInputPacket, 3, "Hi", _pack_doodad_input, _unpack_doodad_input)
@@ -1,7 +1,8 @@
 from enum import Enum
-from typing import Literal
+from typing import Any, Dict, Literal, Optional
 
 from common.packets import Packet
+from common.wire import register_struct_codec
 
 
 class GameState(str, Enum):
@@ -25,3 +26,104 @@ class StartLevelPacket(Packet):
     type: Literal["start_level"] = "start_level"
     doodad_names: dict[str, str]
     level: int | None = None
+
+
+class StateSnapshotPacket(Packet):
+    """Every state field as of `seq`; sent on join and in answer to a ResyncPacket."""
+    type: Literal["state_snapshot"] = "state_snapshot"
+    seq: int
+    fields: Dict[str, Any]
+
+
+class StateDeltaPacket(Packet):
+    """The fields that changed between versions `base` and `seq`, with their new values."""
+    type: Literal["state_delta"] = "state_delta"
+    seq: int
+    base: int
+    changes: Dict[str, Any]
+
+
+class ResyncPacket(Packet):
+    """A delta did not follow on from version `seq`; the server answers with a snapshot."""
+    type: Literal["resync"] = "resync"
+    seq: int
+
+
+_MISSING = object()
+
+
+class StateView:
+    """A panel's copy of the server's versioned state, kept current from snapshots and deltas."""
+
+    def __init__(self):
+        self.seq: Optional[int] = None
+        self.fields: Dict[str, Any] = {}
+        self.resync_requested = False
+
+    def reset(self) -> None:
+        self.seq = None
+        self.fields = {}
+        self.resync_requested = False
+
+    def get(self, field: str, default: Any = None) -> Any:
+        return self.fields.get(field, default)
+
+    def apply(self, packet: Packet) -> Optional[Dict[str, Any]]:
+        """Apply a snapshot or delta and return the fields it changed.
+
+        Returns None when a delta does not follow on from the version held, and
+        a ResyncPacket should be sent; later deltas are ignored until the
+        snapshot arrives, so one gap asks for one resync.
+        """
+        if isinstance(packet, StateSnapshotPacket):
+            changed = {k: v for k, v in packet.fields.items() if self.fields.get(k, _MISSING) != v}
+            self.seq = packet.seq
+            self.fields = dict(packet.fields)
+            self.resync_requested = False
+            return changed
+        if not isinstance(packet, StateDeltaPacket):
+            return {}
+        if self.seq is not None and packet.seq <= self.seq:
+            return {}  # Already covered by a snapshot
+        if packet.base != self.seq:
+            if self.resync_requested:
+                return {}
+            self.resync_requested = True
+            return None
+        self.seq = packet.seq
+        self.fields.update(packet.changes)
+        return packet.changes
+
+
+_STATES = list(GameState)
+# Scalar fields a compact delta can carry, with their bit in the field mask
+_DELTA_SCALARS = ("state", "countdown", "level")
+
+
+def _pack_delta(p: StateDeltaPacket) -> tuple:
+    # Countdown steps and state changes fit a fixed layout; anything else (names) goes as JSON
+    if not p.changes.keys() <= set(_DELTA_SCALARS):
+        raise ValueError("Delta carries non-scalar fields")
+    mask = 0
+    for bit, field in enumerate(_DELTA_SCALARS):
+        if field in p.changes:
+            mask |= 1 << bit
+    state = p.changes.get("state", GameState.IDLE)
+    return (p.seq, p.base, mask, _STATES.index(GameState(state)),
+            p.changes.get("countdown", 0), p.changes.get("level", 0))
+
+
+def _unpack_delta(t: tuple) -> StateDeltaPacket:
+    values = {"state": _STATES[t[3]], "countdown": t[4], "level": t[5]}
+    changes = {field: values[field] for bit, field in enumerate(_DELTA_SCALARS) if t[2] & (1 << bit)}
+    return StateDeltaPacket(seq=t[0], base=t[1], changes=changes)
+
+
+register_struct_codec(ClientState, 1, "?", lambda p: (p.ready,), lambda t: ClientState(ready=t[0]))
+register_struct_codec(
+    GameStatePacket, 2, "Bi",
+    lambda p: (_STATES.index(p.state), p.countdown),
+    lambda t: GameStatePacket(state=_STATES[t[0]], countdown=t[1]),
+)
+register_struct_codec(StateDeltaPacket, 6, "IIBBii", _pack_delta, _unpack_delta)
+register_struct_codec(ResyncPacket, 7, "I", lambda p: (p.seq,), lambda t: ResyncPacket(seq=t[0]))
@@ -1,29 +1,130 @@
+import atexit
 import logging
+import os
 import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from queue import Empty, SimpleQueue
+from typing import Optional
+
+# Records are queued by the logging call and formatted/written on one background
+# thread, so a frame never waits on stdout or the SD card. Each process writes and
+# rotates its own tmp/logs-<name>.txt (RotatingFileHandler is not safe to share
+# between processes): the name given to use_log_file(), which the runner calls
+# with its logger name, or else the first logger the process asks for.
+_FORMATTER = logging.Formatter(
+    fmt="%(asctime)s %(levelname)s %(name)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+# tmp/logs-<name>.txt rolls over to logs-<name>.txt.1 .. .3 at this size
+MAX_LOG_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+# File output is flushed at most this often, when the queue goes idle, or at WARNING+
+FLUSH_INTERVAL = 1.0
+
+_queue: "SimpleQueue[logging.LogRecord]" = SimpleQueue()
+_listener: Optional["_BatchingListener"] = None
+_LOG_DIR = Path(__file__).resolve().parent.parent / "tmp"
+
+
+def _log_path(name: str) -> Path:
+    return _LOG_DIR / f"logs-{name}.txt"
+
+
+class _BatchingFileHandler(RotatingFileHandler):
+    """Lets the file buffer absorb records instead of flushing after every one."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._last_flush = time.monotonic()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        if record.levelno >= logging.WARNING:
+            self.flush_now()
+
+    def flush(self) -> None:
+        # Called by StreamHandler.emit after each record; only flush when due
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush_now()
+
+    def flush_now(self) -> None:
+        super().flush()
+        self._last_flush = time.monotonic()
+
+    def use_file(self, path: Path) -> None:
+        """Write to `path` from now on; the current file is closed, not renamed."""
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.flush_now()
+                self.stream.close()
+                self.stream = None  # Reopened on the next record
+            self.baseFilename = os.path.abspath(path)
+        finally:
+            self.release()
+
+
+class _BatchingListener(QueueListener):
+    def __init__(self, queue, file_handler: _BatchingFileHandler, *handlers: logging.Handler):
+        super().__init__(queue, file_handler, *handlers)
+        self.file_handler = file_handler
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        # Write out whatever is buffered whenever logging pauses
+        while True:
+            try:
+                return self.queue.get(timeout=FLUSH_INTERVAL)
+            except Empty:
+                self.file_handler.flush_now()
+
+    def stop(self) -> None:
+        super().stop()
+        self.file_handler.flush_now()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Queues the record as-is; the message is built on the writer thread.
+
+    QueueHandler.prepare formats in the caller, which would put the cost back
+    on the frame. Log arguments must therefore not be mutated after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _start_listener(name: str) -> None:
+    global _listener
+    console_handler = logging.StreamHandler(stream=sys.stdout)
+    console_handler.setFormatter(_FORMATTER)
+
+    _LOG_DIR.mkdir(parents=True, exist_ok=True)
+    # Opened on the first record, so a process that is renamed before it logs never creates the file
+    file_handler = _BatchingFileHandler(_log_path(name), maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUPS,
+                                        encoding="utf-8", delay=True)
+    file_handler.setFormatter(_FORMATTER)
+
+    _listener = _BatchingListener(_queue, file_handler, console_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def use_log_file(name: str) -> None:
+    """Write this process's log to tmp/logs-<name>.txt; call before logging where possible."""
+    if _listener is None:
+        _start_listener(name)
+    else:
+        _listener.file_handler.use_file(_log_path(name))
 
 
 def get_logger(name: str) -> logging.Logger:
     logger = logging.getLogger(name)
     if not logger.handlers:
+        if _listener is None:
+            _start_listener(name)
         logger.setLevel(logging.INFO)
-        # Console handler
-        console_handler = logging.StreamHandler(stream=sys.stdout)
-        formatter = logging.Formatter(
-            fmt="%(asctime)s %(levelname)s %(name)s - %(message)s",
-            datefmt="%H:%M:%S",
-        )
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-
-        # File handler (project_root/tmp/logs.txt)
-        project_root = Path(__file__).resolve().parent.parent
-        log_file = project_root / "tmp" / "logs.txt"
-        log_file.parent.mkdir(parents=True, exist_ok=True)
-        file_handler = logging.FileHandler(log_file, encoding="utf-8")
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        logger.addHandler(_DeferredQueueHandler(_queue))
         logger.propagate = False
     return logger
-
-
@@ -0,0 +1,149 @@
+import selectors
+import socket
+import time
+from typing import Callable, List, Optional, Set
+
+
+class Timer:
+    __slots__ = ("deadline", "callback", "cancelled")
+
+    def __init__(self, deadline: float, callback: Optional[Callable[[], None]]):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Hashed timing wheel keyed on time.monotonic().
+
+    Each slot covers `resolution` seconds; timers further out than one revolution
+    stay in their slot until their deadline has actually passed.
+    """
+
+    def __init__(self, resolution: float = 0.01, slots: int = 512):
+        self.resolution = resolution
+        self._slots: List[List[Timer]] = [[] for _ in range(slots)]
+        self._tick = int(time.monotonic() / resolution)
+        self._pending: Set[Timer] = set()
+
+    def schedule(self, deadline: float, callback: Optional[Callable[[], None]] = None) -> Timer:
+        timer = Timer(deadline, callback)
+        # Floor, so the slot is scanned no later than the tick containing the deadline
+        tick = max(int(deadline / self.resolution), self._tick)
+        self._slots[tick % len(self._slots)].append(timer)
+        self._pending.add(timer)
+        return timer
+
+    def next_deadline(self) -> Optional[float]:
+        live = [t.deadline for t in self._pending if not t.cancelled]
+        return min(live) if live else None
+
+    def expire(self, now: float) -> List[Timer]:
+        """Remove and return every timer whose deadline is at or before `now`."""
+        target = int(now / self.resolution)
+        n = len(self._slots)
+        # Walk each slot at most once, even after a long stall
+        first = max(self._tick, target - n + 1)
+        due: List[Timer] = []
+        for tick in range(first, target + 1):
+            slot = self._slots[tick % n]
+            if not slot:
+                continue
+            keep: List[Timer] = []
+            for t in slot:
+                if t.cancelled:
+                    self._pending.discard(t)
+                elif t.deadline <= now:
+                    self._pending.discard(t)
+                    due.append(t)
+                else:
+                    keep.append(t)
+            self._slots[tick % n] = keep
+        self._tick = target
+        due.sort(key=lambda t: t.deadline)
+        return due
+
+
+class EventLoop:
+    """Readiness loop over selectors (epoll on Linux) plus a timer wheel.
+
+    Registered file objects carry a callback that receives the ready event mask.
+    `wake()` is safe to call from other threads and signal handlers.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.timers = TimerWheel()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, self._drain_wake)
+
+    def register(self, fileobj, callback: Callable[[int], None], events: int = selectors.EVENT_READ) -> None:
+        try:
+            self.selector.register(fileobj, events, callback)
+        except KeyError:
+            self.selector.modify(fileobj, events, callback)
+
+    def modify(self, fileobj, callback: Callable[[int], None], events: int) -> None:
+        try:
+            self.selector.modify(fileobj, events, callback)
+        except KeyError:
+            self.selector.register(fileobj, events, callback)
+
+    def unregister(self, fileobj) -> None:
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def call_at(self, deadline: float, callback: Optional[Callable[[], None]] = None) -> Timer:
+        """Schedule `callback` at a monotonic deadline; with no callback the timer only wakes the loop."""
+        return self.timers.schedule(deadline, callback)
+
+    def call_later(self, delay: float, callback: Optional[Callable[[], None]] = None) -> Timer:
+        return self.call_at(time.monotonic() + delay, callback)
+
+    def wake(self) -> None:
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def run_once(self, timeout: Optional[float]) -> int:
+        """Block until I/O readiness, a timer deadline or `timeout`; dispatch callbacks.
+
+        Returns the number of ready file objects (timers and wake-ups not included).
+        """
+        deadline = self.timers.next_deadline()
+        if deadline is not None:
+            until_timer = max(0.0, deadline - time.monotonic())
+            timeout = until_timer if timeout is None else min(timeout, until_timer)
+        events = self.selector.select(timeout)
+        ready = 0
+        for key, mask in events:
+            if key.fileobj is not self._wake_r:
+                ready += 1
+            key.data(mask)
+        for timer in self.timers.expire(time.monotonic()):
+            if timer.callback is not None:
+                timer.callback()
+        return ready
+
+    def close(self) -> None:
+        self.selector.close()
+        for s in (self._wake_r, self._wake_w):
+            try:
+                s.close()
+            except Exception:
+                pass
+
+    def _drain_wake(self, mask: int) -> None:
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
@@ -1,5 +1,6 @@
-from random import shuffle
-from typing import List
+from collections import deque
+from random import Random
+from typing import Deque, Iterator, List, Optional, Sequence, Set
 
 ADJECTIVES = [
     "Zingoid",
@@ -38,11 +39,103 @@ NOUNS = [
     "Virtualizer"
 ]
 
-def generate_names(n: int) -> List[str]:
-    adj_idx = list(range(n))
-    shuffle(adj_idx)
-    noun_idx = list(range(n))
-    shuffle(noun_idx)
-    pairs = zip(adj_idx, noun_idx)
 
-    return [f"{ADJECTIVES[adj]} {NOUNS[noun]}" for adj, noun in pairs]
+class _LazyPermutation:
+    """Pseudo-random permutation of range(size), computed one index at a time.
+
+    A small Feistel network permutes the enclosing power-of-two range and
+    cycle-walking skips values >= size, so nothing proportional to `size` is
+    ever built.
+    """
+
+    def __init__(self, size: int, rng: Random):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        bits += bits & 1
+        self._half = bits // 2
+        self._mask = (1 << self._half) - 1
+        self._keys = [rng.getrandbits(32) for _ in range(4)]
+
+    def _scramble(self, x: int) -> int:
+        left, right = x >> self._half, x & self._mask
+        for key in self._keys:
+            mixed = ((right ^ key) * 0x9E3779B1) & 0xFFFFFFFF
+            left, right = right, left ^ ((mixed >> 13) & self._mask)
+        return (left << self._half) | right
+
+    def __getitem__(self, index: int) -> int:
+        x = self._scramble(index)
+        while x >= self.size:
+            x = self._scramble(x)
+        return x
+
+    def __iter__(self) -> Iterator[int]:
+        for index in range(self.size):
+            yield self[index]
+
+
+class NameGenerator:
+    """Draws doodad names from the adjective x noun space without replacement.
+
+    Draws continue one permutation across levels, so a name only comes back
+    after the whole space has been used, and never while it was used in the
+    last `history` levels. If a single level needs more names than that
+    leaves, further names get a mark suffix ("Laser Coil Mk 2").
+    """
+
+    def __init__(self, history: int = 3, seed: Optional[int] = None,
+                 adjectives: Sequence[str] = ADJECTIVES, nouns: Sequence[str] = NOUNS):
+        self.adjectives = adjectives
+        self.nouns = nouns
+        self._size = len(adjectives) * len(nouns)
+        self._rng = Random(seed)
+        self._recent: Deque[Set[str]] = deque(maxlen=max(0, history))
+        self._cycle = iter(_LazyPermutation(self._size, self._rng))
+
+    def _name(self, index: int) -> str:
+        adj, noun = divmod(index, len(self.nouns))
+        return f"{self.adjectives[adj]} {self.nouns[noun]}"
+
+    def level(self, n: int) -> List[str]:
+        """`n` distinct names for the next level."""
+        avoid: Set[str] = set().union(*self._recent)
+        names: List[str] = []
+        used: Set[str] = set()
+        restarted = False
+        while len(names) < n:
+            index = next(self._cycle, None)
+            if index is None:
+                self._cycle = iter(_LazyPermutation(self._size, self._rng))
+                if restarted:
+                    break  # Every plain name is taken or too recent
+                restarted = True
+                continue
+            name = self._name(index)
+            if name not in avoid and name not in used:
+                names.append(name)
+                used.add(name)
+        mark = 2
+        while len(names) < n:
+            for index in _LazyPermutation(self._size, self._rng):
+                name = f"{self._name(index)} Mk {mark}"
+                if name not in avoid:
+                    names.append(name)
+                    if len(names) == n:
+                        break
+            mark += 1
+        if self._recent.maxlen:
+            self._recent.append(used.union(names))
+        return names
+
+
+_generator = NameGenerator()
+
+
+def seed_names(seed: Optional[int], history: int = 3) -> None:
+    """Restart name generation, e.g. with a fixed seed for reproducible benchmark runs."""
+    global _generator
+    _generator = NameGenerator(history=history, seed=seed)
+
+
+def generate_names(n: int) -> List[str]:
+    return _generator.level(n)
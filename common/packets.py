@@ -1,57 +1,49 @@
 from __future__ import annotations
 
-from typing import List, Tuple, Any, Literal, Dict, Type, Optional
+from typing import List, Tuple, Any, Literal, Dict, Type, Optional, Union, Annotated, get_origin
 import json
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 
 
 # Registry of all Packet subclasses by their discriminating 'type' field
 _PACKET_REGISTRY: Dict[str, Type["Packet"]] = {}
-_REGISTRY_BUILT: bool = False
+# Validator over the union of registered packets; rebuilt lazily when the registry changes
+_ADAPTER: Optional[TypeAdapter] = None
 
 
 class Packet(BaseModel):  # Base class for future expansion
-    # Auto-register subclasses that define a Literal 'type' field with a default
-    def __init_subclass__(cls, **kwargs):
-        super().__init_subclass__(**kwargs)
-        try:
-            field = getattr(cls, "model_fields", {}).get("type")
-            type_name: Optional[str] = getattr(field, "default", None)
-            if isinstance(type_name, str) and type_name:
-                _PACKET_REGISTRY[type_name] = cls  # type: ignore[assignment]
-        except Exception:
-            # Best-effort registration only
-            pass
+    # Auto-register subclasses that define a Literal 'type' field with a default.
+    # Runs after pydantic has built model_fields, unlike __init_subclass__.
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs):
+        super().__pydantic_init_subclass__(**kwargs)
+        _register_from_class(cls)
 
 
 def _register_from_class(cls: Type["Packet"]) -> None:
+    global _ADAPTER
     try:
-        field = getattr(cls, "model_fields", {}).get("type")
+        field = cls.model_fields.get("type")
         type_name: Optional[str] = getattr(field, "default", None)
-        if isinstance(type_name, str) and type_name:
-            _PACKET_REGISTRY.setdefault(type_name, cls)  # type: ignore[assignment]
+        if not (isinstance(type_name, str) and type_name) or get_origin(field.annotation) is not Literal:
+            return
+        if _PACKET_REGISTRY.get(type_name) is not cls:
+            _PACKET_REGISTRY[type_name] = cls
+            _ADAPTER = None
     except Exception:
+        # Best-effort registration only
         pass
 
 
-def _walk_subclasses(base: Type["Packet"]) -> List[Type["Packet"]]:
-    result: List[Type["Packet"]] = []
-    for sub in base.__subclasses__():
-        result.append(sub)
-        result.extend(_walk_subclasses(sub))
-    return result
-
-
-def _ensure_registry_populated() -> None:
-    global _REGISTRY_BUILT
-    if _REGISTRY_BUILT:
-        return
-    # Build registry from all imported subclasses
-    for cls in [Packet, * _walk_subclasses(Packet)]:
-        if cls is Packet:
-            continue
-        _register_from_class(cls)
-    _REGISTRY_BUILT = True
+def _packet_adapter() -> Optional[TypeAdapter]:
+    global _ADAPTER
+    if _ADAPTER is None and _PACKET_REGISTRY:
+        models = tuple(_PACKET_REGISTRY.values())
+        if len(models) == 1:
+            _ADAPTER = TypeAdapter(models[0])
+        else:
+            _ADAPTER = TypeAdapter(Annotated[Union[models], Field(discriminator="type")])
+    return _ADAPTER
 
 
 class TextPacket(Packet):
@@ -69,38 +61,97 @@ def encode_packet(packet: Packet) -> bytes:
     return (json.dumps(obj) + "\n").encode("utf-8")
 
 
+def decode_line(line: bytes) -> Packet:
+    """Decode one framed line; anything that is not a known packet becomes a TextPacket.
+
+    Raw JSON bytes are validated in a single pass, with the 'type' tag selecting
+    the model, so no intermediate dict is built.
+    """
+    adapter = _packet_adapter()
+    if adapter is not None:
+        try:
+            return adapter.validate_json(line)
+        except ValidationError:
+            # Not JSON, unknown type or invalid fields; fall through to text
+            pass
+    return TextPacket(text=line.decode("utf-8", errors="replace"))
+
+
+class LineFramer:
+    """Incremental newline framer for one byte stream.
+
+    Bytes already scanned without finding a newline are not scanned again, and a
+    line longer than `max_line` is discarded (up to its terminating newline)
+    instead of growing the buffer without bound.
+    """
+
+    def __init__(self, max_line: int = 65536):
+        self.max_line = max_line
+        self.dropped_lines = 0
+        self._buf = bytearray()
+        self._scan = 0
+        self._discarding = False
+
+    def clear(self) -> None:
+        self._buf.clear()
+        self._scan = 0
+        self._discarding = False
+
+    def feed(self, data: bytes, max_lines: Optional[int] = None) -> List[bytes]:
+        """Append `data` and return complete lines (without the newline).
+
+        With `max_lines`, stop after that many and leave the rest buffered, for
+        callers that switch framing after a specific line (see `take_buffer`).
+        """
+        if self._discarding:
+            nl = data.find(b"\n")
+            if nl == -1:
+                return []
+            self._discarding = False
+            data = memoryview(data)[nl + 1:]
+        self._buf += data
+        lines: List[bytes] = []
+        start = 0
+        pos = self._buf.find(b"\n", self._scan)
+        if pos != -1:
+            with memoryview(self._buf) as view:
+                while pos != -1:
+                    if pos - start > self.max_line:
+                        # Complete but over-long; dropped like one that arrived in pieces
+                        self.dropped_lines += 1
+                    else:
+                        lines.append(view[start:pos].tobytes())
+                    start = pos + 1
+                    if max_lines is not None and len(lines) >= max_lines:
+                        break
+                    pos = self._buf.find(b"\n", start)
+            del self._buf[:start]
+        # A stop at max_lines may leave unscanned newlines behind
+        self._scan = len(self._buf) if pos == -1 else 0
+        if self._scan > self.max_line:
+            self.dropped_lines += 1
+            self.clear()
+            self._discarding = True
+        return lines
+
+    def take_buffer(self) -> bytes:
+        """Remove and return the bytes buffered after the last returned line."""
+        data = bytes(self._buf)
+        self.clear()
+        return data
+
+    def decode(self, data: bytes) -> List[Packet]:
+        """Feed `data` and decode the completed lines into packets."""
+        return [decode_line(line) for line in self.feed(data) if line]
+
+
 def decode_lines(buffer: bytes) -> Tuple[List[Packet], bytes]:
-    _ensure_registry_populated()
-    try:
-        text = buffer.decode("utf-8", errors="replace")
-    except Exception:
-        text = buffer.decode("utf-8", errors="ignore")
-    lines = text.split("\n")
-    if not lines:
-        return [], buffer
-    complete_lines = lines[:-1]
-    remainder = lines[-1].encode("utf-8")
+    complete_lines = buffer.split(b"\n")
+    remainder = complete_lines.pop()
 
     packets: List[Packet] = []
     for line in complete_lines:
         if not line:
             continue
-        try:
-            obj = json.loads(line)
-            if isinstance(obj, dict) and "type" in obj:
-                t = obj.get("type")
-                model_cls = _PACKET_REGISTRY.get(str(t))
-                if model_cls is not None:
-                    try:
-                        packets.append(model_cls.model_validate(obj))
-                        continue
-                    except Exception:
-                        # If validation fails, fall back to text below
-                        pass
-        except Exception:
-            # Not JSON; fall through to text
-            pass
-        packets.append(TextPacket(text=line))
+        packets.append(decode_line(line))
     return packets, remainder
-
-
@@ -1,16 +1,37 @@
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Iterable, Optional
 from common.doodad import Doodad, DoodadKind
 
 
 class Panel:
+    __slots__ = ("player", "_capabilities", "_by_id", "_by_kind")
+
     def __init__(self, player: int):
         self.player: int = player
-        self.capabilities: List[Doodad] = [
+        self.capabilities = [
             Doodad("2312", player, DoodadKind.SingleButton),
             Doodad("F3DC", player, DoodadKind.MultiButton),
             Doodad("0D50", player, DoodadKind.Slider),
         ]
 
+    @property
+    def capabilities(self) -> List[Doodad]:
+        return self._capabilities
+
+    @capabilities.setter
+    def capabilities(self, doodads: Iterable[Doodad]) -> None:
+        # Rebuild the lookup indexes whenever the doodad list is replaced
+        self._capabilities: List[Doodad] = list(doodads)
+        self._by_id: Dict[str, Doodad] = {d.id: d for d in self._capabilities}
+        self._by_kind: Dict[DoodadKind, List[Doodad]] = {}
+        for d in self._capabilities:
+            self._by_kind.setdefault(d.kind, []).append(d)
+
+    def doodad(self, ident: str) -> Optional[Doodad]:
+        return self._by_id.get(ident)
+
+    def doodads_of_kind(self, kind: DoodadKind) -> List[Doodad]:
+        return self._by_kind.get(kind, [])
+
 
 def panel_to_json(panel: Panel) -> Dict[str, Any]:
     return {
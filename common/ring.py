@@ -0,0 +1,352 @@
+import errno
+import os
+import socket
+import struct
+import sys
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+from typing import Sequence, Tuple
+
+# Single-producer single-consumer byte rings in shared memory, for moving data
+# between processes on one host without copying it through the kernel.
+#
+# A Ring is a byte stream like a pipe buffer: the producer appends what fits,
+# the consumer takes what is there. Tail (bytes ever read) is a 64-bit counter
+# in the block written by the consumer only. Head (bytes ever written) is not
+# read from the block: each send rings a doorbell, a message on a connected
+# AF_UNIX SOCK_SEQPACKET socket carrying the new head, and the consumer only
+# reads up to a head it has taken off its doorbell. The socket calls order
+# memory between the processes, so payload written before a doorbell is
+# visible once that doorbell has been received, even on CPUs that reorder
+# stores (ARM); a head read straight from shared memory could overtake the
+# payload it covers. A send whose doorbell cannot be queued is not committed
+# and fails like a full ring.
+#
+# A doorbell stays queued until the bytes it announced have been read, so the
+# socket (what the reader registers with an EventLoop) is readable exactly
+# while recv() has something to return. Because the doorbell is a connection,
+# the peer closing or dying shows up as end-of-file behind its last doorbell,
+# as with TCP.
+#
+# RingSocket pairs two rings and two ends of a doorbell connection into a
+# duplex stream with the non-blocking socket calls the network code uses
+# (send/sendmsg/recv/fileno/close), so it can stand in for a connected TCP
+# socket. RingListener and connect_ring() stand in for listen/accept and
+# connect: the connecting side creates the block, connects to the listener's
+# lobby and sends the block's name as its first message. Write readiness is
+# not signalled; a writer facing a full ring retries on its next wake.
+
+_U64 = struct.Struct("<Q")
+_TAIL = 0
+_DATA = 64
+DEFAULT_CAPACITY = 256 * 1024
+
+
+def _address(name: str):
+    # Abstract socket names need no cleanup; other platforms get a path in the temp dir
+    if sys.platform.startswith("linux"):
+        return "\0ufogame-" + name
+    return os.path.join(tempfile.gettempdir(), f"ufogame-{name}.sock")
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Only the creator may unlink the block, so the attaching side must not track it
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def ring_listener_name(port: int) -> str:
+    """The RingListener a server on `port` accepts ring connections on."""
+    return f"server-{port}"
+
+
+def doorbell_pair() -> Tuple[socket.socket, socket.socket]:
+    """Two connected doorbell ends, for a RingSocket.create()/attach() pair."""
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+
+class Ring:
+    """One direction of byte stream over `capacity` bytes of a shared buffer at `offset`."""
+
+    def __init__(self, buf: memoryview, offset: int, capacity: int):
+        self.buf = buf
+        self.base = offset
+        self.capacity = capacity
+        self._data = offset + _DATA
+        self.head = 0  # Producer side: bytes written, published by doorbell only
+        self.visible = 0  # Consumer side: newest head taken off the doorbell
+        self.tail = 0  # Consumer side: our own copy of _TAIL
+
+    @staticmethod
+    def size(capacity: int) -> int:
+        return _DATA + capacity
+
+    def _get(self, field: int) -> int:
+        return _U64.unpack_from(self.buf, self.base + field)[0]
+
+    def _set(self, field: int, value: int) -> None:
+        _U64.pack_into(self.buf, self.base + field, value)
+
+    def readable(self) -> int:
+        """Bytes the consumer may read: written and announced by a received doorbell."""
+        return self.visible - self.tail
+
+    def writable(self) -> int:
+        # A stale tail only understates the free space
+        return self.capacity - (self.head - self._get(_TAIL))
+
+    def announce(self, head: int) -> None:
+        """Consumer side: a doorbell said the producer had written `head` bytes."""
+        if head > self.visible:
+            self.visible = head
+
+    def write(self, data) -> int:
+        """Append as much of `data` as fits; returns the number of bytes taken.
+
+        The bytes are not readable until a doorbell carrying the new `head`
+        reaches the consumer; to take them back, reset `head`.
+        """
+        head = self.head
+        n = min(len(data), self.writable())
+        if n <= 0:
+            return 0
+        pos = head % self.capacity
+        first = min(n, self.capacity - pos)
+        start = self._data + pos
+        with memoryview(data) as view:
+            self.buf[start:start + first] = view[:first]
+            if n > first:
+                self.buf[self._data:self._data + n - first] = view[first:n]
+        self.head = head + n
+        return n
+
+    def read(self, limit: int) -> bytes:
+        """Take up to `limit` announced bytes; b"" if there are none."""
+        tail = self.tail
+        n = min(limit, self.visible - tail)
+        if n <= 0:
+            return b""
+        pos = tail % self.capacity
+        first = min(n, self.capacity - pos)
+        start = self._data + pos
+        data = bytes(self.buf[start:start + first])
+        if n > first:
+            data += bytes(self.buf[self._data:self._data + n - first])
+        # Freed space is reused a lap later; ARM allows this store to pass the copy's
+        # loads only on paper (load buffering), cores retire the loads before it
+        self.tail = tail + n
+        self._set(_TAIL, self.tail)
+        return data
+
+
+class RingSocket:
+    """A connected, always non-blocking duplex stream over two shared-memory rings.
+
+    The side that creates the block owns it and unlinks it on close; the other
+    side attaches by name. Each side holds one end of a connected doorbell
+    socket (see doorbell_pair() and connect_ring()). recv() returns b"" once
+    the peer has closed or exited and everything it wrote has been read, and
+    send() raises BrokenPipeError once the peer is gone, as with TCP.
+    """
+
+    def __init__(self, name: str, create: bool, bell: socket.socket, capacity: int = DEFAULT_CAPACITY):
+        self.name = name
+        self._owner = create
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=2 * Ring.size(capacity))
+        else:
+            self._shm = _attach(name)
+            capacity = self._shm.size // 2 - _DATA
+        first = Ring(self._shm.buf, 0, capacity)
+        second = Ring(self._shm.buf, Ring.size(capacity), capacity)
+        self._tx, self._rx = (first, second) if create else (second, first)
+        self._bell = bell
+        self._bell.setblocking(False)
+        self._closed = False
+        self._peer_gone = False  # End-of-file reached on the doorbell
+
+    @classmethod
+    def create(cls, name: str, bell: socket.socket, capacity: int = DEFAULT_CAPACITY) -> "RingSocket":
+        return cls(name, True, bell, capacity)
+
+    @classmethod
+    def attach(cls, name: str, bell: socket.socket) -> "RingSocket":
+        return cls(name, False, bell)
+
+    def fileno(self) -> int:
+        """The doorbell; readable while recv() has something to return."""
+        return self._bell.fileno()
+
+    def setblocking(self, flag: bool) -> None:
+        pass  # Always non-blocking
+
+    def getpeername(self):
+        return ("ring", self.name)
+
+    def _ring_peer(self) -> bool:
+        """Announce our head to the peer; False if the doorbell connection is full."""
+        try:
+            self._bell.send(_U64.pack(self._tx.head))
+            return True
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError as e:
+            if e.errno in (errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN):
+                raise BrokenPipeError(errno.EPIPE, "ring peer closed") from e
+            if e.errno == errno.ENOBUFS:
+                return False
+            raise
+
+    def send(self, data) -> int:
+        if self._closed or self._peer_gone:
+            raise BrokenPipeError(errno.EPIPE, "ring peer closed")
+        n = self._tx.write(data)
+        if n == 0 and len(data):
+            raise BlockingIOError(errno.EAGAIN, "ring full")
+        if not self._ring_peer():
+            self._tx.head -= n  # Unannounced bytes are never read; take them back
+            raise BlockingIOError(errno.EAGAIN, "ring doorbell full")
+        return n
+
+    def sendmsg(self, buffers: Sequence) -> int:
+        if self._closed or self._peer_gone:
+            raise BrokenPipeError(errno.EPIPE, "ring peer closed")
+        total = 0
+        for data in buffers:
+            n = self._tx.write(data)
+            total += n
+            if n < len(data):
+                break
+        if total == 0 and any(len(b) for b in buffers):
+            raise BlockingIOError(errno.EAGAIN, "ring full")
+        if not self._ring_peer():
+            self._tx.head -= total
+            raise BlockingIOError(errno.EAGAIN, "ring doorbell full")
+        return total
+
+    def sendall(self, data) -> None:
+        """Only for handshakes that are known to fit; raises BlockingIOError otherwise."""
+        with memoryview(data) as view:
+            while view:
+                view = view[self.send(view):]
+
+    def _take_bells(self) -> None:
+        """Announce the oldest doorbell whose bytes are unread, dropping the ones before it."""
+        rx = self._rx
+        try:
+            while True:
+                msg = self._bell.recv(_U64.size, socket.MSG_PEEK)
+                if not msg:
+                    self._peer_gone = True  # Behind every doorbell it sent
+                    return
+                head = _U64.unpack(msg)[0] if len(msg) == _U64.size else 0
+                rx.announce(head)
+                if head > rx.tail:
+                    return  # Left queued, so the doorbell stays readable until it is read
+                self._bell.recv(_U64.size)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._peer_gone = True  # Reset by the peer exiting
+
+    def recv(self, limit: int) -> bytes:
+        if self._closed:
+            raise OSError(errno.EBADF, "ring closed")
+        rx = self._rx
+        if not rx.readable():
+            # Only what a received doorbell announced is safe to read
+            self._take_bells()
+        data = rx.read(limit)
+        if data:
+            return data
+        if self._peer_gone:
+            return b""
+        raise BlockingIOError(errno.EAGAIN, "ring empty")
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._tx = self._rx = None  # Drop buffer views so the block can be unmapped
+        try:
+            self._bell.close()  # The peer reads end-of-file after our last doorbell
+        except Exception:
+            pass
+        try:
+            self._shm.close()
+        except (BufferError, OSError):
+            pass
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except (FileNotFoundError, OSError):
+                pass
+
+
+class RingListener:
+    """Accepts RingSockets made by connect_ring(), like a listening socket.
+
+    fileno() is readable while connections are waiting; accept() raises
+    BlockingIOError when there are none.
+    """
+
+    # How long accept() waits for a connection's first message, the block name;
+    # connect_ring() sends it straight after connecting
+    NAME_TIMEOUT = 1.0
+
+    def __init__(self, name: str):
+        self.name = name
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self._path = _address(f"{name}-lobby")
+        self._sock.bind(self._path)
+        self._sock.listen(64)
+        self._sock.setblocking(False)
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def accept(self) -> Tuple[RingSocket, Tuple[str, str]]:
+        while True:
+            bell, _ = self._sock.accept()
+            try:
+                bell.settimeout(self.NAME_TIMEOUT)
+                name = bell.recv(256).decode("utf-8", errors="replace")
+                return RingSocket.attach(name, bell), ("ring", name)
+            except (OSError, ValueError):
+                bell.close()  # The caller gave up and unlinked its block already
+                continue
+
+    def close(self) -> None:
+        self._sock.close()
+        if not self._path.startswith("\0"):
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+
+
+def connect_ring(listener: str, name: str, capacity: int = DEFAULT_CAPACITY) -> RingSocket:
+    """Create a RingSocket called `name` and hand it to the RingListener called `listener`.
+
+    Raises OSError (ConnectionRefusedError, FileNotFoundError) if nobody is listening.
+    What is sent before the listener accepts waits in the ring.
+    """
+    bell = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        bell.connect(_address(f"{listener}-lobby"))
+        sock = RingSocket.create(name, bell, capacity)
+    except OSError:
+        bell.close()
+        raise
+    try:
+        bell.send(name.encode("utf-8"))
+    except OSError:
+        sock.close()
+        raise
+    return sock
@@ -1,11 +1,45 @@
 from threading import Event
 import signal
 import time
-from typing import Callable, Optional, Dict
+from typing import Any, Callable, Optional, Dict
 import logging
 
-from .logger import get_logger
+from .logger import get_logger, use_log_file
 from .connect import start_mdns_advertiser
+from .loop import EventLoop
+from .stats import get_stats
+
+DEFAULT_FRAME_SECONDS = 0.05
+
+
+class TickPolicy:
+    """Frame period per game state, from the [tick] table of a role's config.toml.
+
+    Keys are GameState names plus `default`; values are seconds, or "event" to
+    skip the periodic tick and wait only for I/O readiness and timers. Event
+    waiting needs an EventLoop; without one the default period is used instead.
+    """
+
+    def __init__(self, periods: Dict[str, Optional[float]], default: Optional[float] = DEFAULT_FRAME_SECONDS):
+        self.periods = periods
+        self.default = default
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "TickPolicy":
+        table = config.get("tick")
+        periods: Dict[str, Optional[float]] = {}
+        if isinstance(table, dict):
+            for key, value in table.items():
+                if isinstance(value, str) and value.strip().lower() == "event":
+                    periods[key.upper()] = None
+                elif isinstance(value, (int, float)) and value > 0:
+                    periods[key.upper()] = float(value)
+        default = periods.pop("DEFAULT", DEFAULT_FRAME_SECONDS)
+        return cls(periods, default)
+
+    def period(self, state: object) -> Optional[float]:
+        key = getattr(state, "value", state)
+        return self.periods.get(str(key), self.default)
 
 
 def run(
@@ -14,8 +48,24 @@ def run(
     advertise_port: Optional[int],
     advertise_properties: Optional[Dict[str, str]],
     run_frame: Callable[[logging.Logger], bool],
+    loop: Optional[EventLoop] = None,
+    stats_interval: float = 10.0,
+    tick: Optional[Callable[[], Optional[float]]] = None,
 ) -> int:
+    """Call `run_frame` until it returns False or SIGINT arrives.
+
+    `tick` returns the current frame period (50 ms if omitted); it is asked after
+    every frame so the rate can follow game state. Without a `loop`, frames are
+    spaced by sleeping. With a `loop`, the runner blocks on I/O readiness and
+    timers, calling `run_frame` after every wake-up and at least once per period
+    as a game-logic tick; a period of None waits for events only.
+
+    Frame timings go to `get_stats(logger_name)` and are dumped to
+    tmp/stats-{logger_name}.json every `stats_interval` seconds and on exit.
+    """
+    use_log_file(logger_name)
     logger = get_logger(logger_name)
+    stats = get_stats(logger_name)
     logger.info("Starting")
 
     stop_event: Optional[Event] = None
@@ -26,6 +76,8 @@ def run(
 
     def _handle_sigint(signum, frame):
         shutdown.set()
+        if loop is not None:
+            loop.wake()
 
     signal.signal(signal.SIGINT, _handle_sigint)
     logger.info("Running; press Ctrl-C to stop")
@@ -37,13 +89,23 @@ def run(
             if not should_continue:
                 break
             elapsed = time.monotonic() - start
-            min_frame_seconds = 0.05
-            remaining = min_frame_seconds - elapsed
-            if remaining > 0:
-                time.sleep(remaining)
+            period = tick() if tick is not None else DEFAULT_FRAME_SECONDS
+            if period is None and loop is None:
+                period = DEFAULT_FRAME_SECONDS
+            stats.record_frame(elapsed, period if period is not None else float("inf"))
+            stats.dump_if_due(stats_interval)
+            with stats.phase("idle"):
+                if loop is not None:
+                    loop.run_once(None if period is None else max(0.0, period - elapsed))
+                elif period - elapsed > 0:
+                    time.sleep(period - elapsed)
         return 0
     finally:
         logger.info("Shutting down")
+        try:
+            stats.dump()
+        except OSError:
+            pass
         if stop_event is not None:
             stop_event.set()
 
@@ -0,0 +1,123 @@
+import struct
+import time
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+from common.packets import Packet
+from common.wire import decode_binary, encode_binary
+
+# Append-only record of everything a server session sent and received.
+#
+# File: MAGIC, then the wall-clock start time (!d), then records. A record is
+# a !dBBI header (seconds since start on the monotonic clock, kind, player,
+# payload length) and a payload. Packet payloads are bin1 frames (see
+# common.wire), so the log is as compact as the binary wire. CONNECT payloads
+# are the raw handshake line, so a replay can re-run the handshake.
+
+MAGIC = b"UFOSESS1"
+_START = struct.Struct("!d")
+_RECORD = struct.Struct("!dBBI")
+
+KIND_IN = 0  # Packet received from `player`
+KIND_OUT = 1  # Packet sent to `player`, or to every player when player is 0
+KIND_CONNECT = 2  # Handshake line from a newly promoted client
+KIND_DISCONNECT = 3
+ALL_PLAYERS = 0
+
+# Buffered output is written out at most this often (and on close)
+FLUSH_INTERVAL = 1.0
+# Defaults for the server's session_log_max_mb and session_log_keep
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_KEEP = 10
+
+
+class SessionRecord(NamedTuple):
+    t: float
+    kind: int
+    player: int
+    packet: Optional[Packet]  # Decoded packet for KIND_IN / KIND_OUT
+    payload: bytes  # Raw payload (the handshake line for KIND_CONNECT)
+
+
+class SessionWriter:
+    """Buffered writer for one session file; cheap enough to call per packet.
+
+    Recording stops once the file would grow past `max_bytes`; what was written
+    stays a valid session that replays up to that point.
+    """
+
+    def __init__(self, path: Path, max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._file: BinaryIO = open(path, "wb", buffering=64 * 1024)
+        self._file.write(MAGIC + _START.pack(time.time()))
+        self._start = time.monotonic()
+        self._next_flush = self._start + FLUSH_INTERVAL
+        self._left = max_bytes - len(MAGIC) - _START.size if max_bytes else None
+        self.records = 0
+        self.dropped = 0  # Records not written because the file is full
+
+    def _write(self, kind: int, player: int, payload: bytes) -> None:
+        if self._left is not None:
+            size = _RECORD.size + len(payload)
+            if size > self._left:
+                self.dropped += 1
+                return
+            self._left -= size
+        now = time.monotonic()
+        self._file.write(_RECORD.pack(now - self._start, kind, player, len(payload)))
+        self._file.write(payload)
+        self.records += 1
+        if now >= self._next_flush:
+            self._next_flush = now + FLUSH_INTERVAL
+            self._file.flush()
+
+    def packet_in(self, player: int, packet: Packet) -> None:
+        self._write(KIND_IN, player, encode_binary(packet))
+
+    def packet_out(self, player: int, packet: Packet, frame: Optional[bytes] = None) -> None:
+        """`frame` is the packet's bin1 encoding when the caller already has it."""
+        self._write(KIND_OUT, player, frame if frame is not None else encode_binary(packet))
+
+    def connect(self, player: int, handshake: bytes) -> None:
+        self._write(KIND_CONNECT, player, handshake)
+
+    def disconnect(self, player: int) -> None:
+        self._write(KIND_DISCONNECT, player, b"")
+
+    def close(self) -> None:
+        try:
+            self._file.close()
+        except OSError:
+            pass
+
+
+def prune_sessions(directory: Path, keep: int) -> list[Path]:
+    """Delete all but the newest `keep` session files in `directory`; returns those deleted."""
+    sessions = sorted(directory.glob("*.ufolog"), key=lambda p: p.stat().st_mtime, reverse=True)
+    deleted = []
+    for path in sessions[max(0, keep):]:
+        try:
+            path.unlink()
+            deleted.append(path)
+        except OSError:
+            pass
+    return deleted
+
+
+def read_session(path: Path) -> Iterator[SessionRecord]:
+    """Yield the records of a session file; a truncated final record is ignored."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a session log")
+    offset = len(MAGIC) + _START.size
+    while offset + _RECORD.size <= len(data):
+        t, kind, player, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if offset + length > len(data):
+            break
+        payload = data[offset:offset + length]
+        offset += length
+        packet = decode_binary(payload) if kind in (KIND_IN, KIND_OUT) else None
+        yield SessionRecord(t, kind, player, packet, payload)
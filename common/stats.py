@@ -0,0 +1,172 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Log-linear buckets: values below 2**_SUB_BITS microseconds are exact, above that
+# each power of two is split into 2**(_SUB_BITS - 1) buckets (about 3% error).
+_SUB_BITS = 6
+_SUB_COUNT = 1 << _SUB_BITS
+_HALF = _SUB_COUNT >> 1
+
+
+def _bucket_index(micros: int) -> int:
+    if micros < _SUB_COUNT:
+        return micros
+    shift = micros.bit_length() - _SUB_BITS
+    return _SUB_COUNT + (shift - 1) * _HALF + ((micros >> shift) - _HALF)
+
+
+def _bucket_value(index: int) -> int:
+    """Midpoint of a bucket, in microseconds."""
+    if index < _SUB_COUNT:
+        return index
+    shift = (index - _SUB_COUNT) // _HALF + 1
+    mantissa = (index - _SUB_COUNT) % _HALF + _HALF
+    return (mantissa << shift) + ((1 << shift) >> 1)
+
+
+class LatencyHistogram:
+    """HDR-style histogram of durations with fixed relative precision.
+
+    Recording is O(1) and memory grows only with the largest value seen.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._counts: List[int] = []
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def record(self, seconds: float) -> None:
+        micros = int(seconds * 1e6) if seconds > 0 else 0
+        index = _bucket_index(micros)
+        if index >= len(self._counts):
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+        self._counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """Approximate value (seconds) at or below which `pct` percent of samples fall."""
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(self.count * pct / 100.0 + 0.5))
+        seen = 0
+        for index, n in enumerate(self._counts):
+            seen += n
+            if seen >= target:
+                return min(max(_bucket_value(index) / 1e6, self.min), self.max)
+        return self.max or 0.0
+
+    def summary_ms(self) -> Dict[str, float]:
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min": round(self.min * 1e3, 3),
+            "mean": round(self.total / self.count * 1e3, 3),
+            "p50": round(self.percentile(50) * 1e3, 3),
+            "p90": round(self.percentile(90) * 1e3, 3),
+            "p99": round(self.percentile(99) * 1e3, 3),
+            "p99.9": round(self.percentile(99.9) * 1e3, 3),
+            "max": round(self.max * 1e3, 3),
+        }
+
+
+class _PhaseTimer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist: LatencyHistogram):
+        self.hist = hist
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.hist.record(time.perf_counter() - self.start)
+        return False
+
+
+class FrameStats:
+    """Frame durations, budget overruns, per-phase timings and counters for one process role."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.monotonic()
+        self.frames = 0
+        self.overruns = 0
+        self.frame = LatencyHistogram()
+        self.phases: Dict[str, LatencyHistogram] = {}
+        self._timers: Dict[str, _PhaseTimer] = {}
+        # Live counter dicts owned by other modules, copied at snapshot time
+        self.counter_sources: Dict[str, Dict[str, int]] = {}
+        self._next_dump = 0.0
+
+    def phase(self, name: str) -> _PhaseTimer:
+        """Context manager timing one named phase of the current frame."""
+        timer = self._timers.get(name)
+        if timer is None:
+            hist = self.phases[name] = LatencyHistogram()
+            timer = self._timers[name] = _PhaseTimer(hist)
+        return timer
+
+    def record_frame(self, seconds: float, budget: float) -> None:
+        self.frames += 1
+        self.frame.record(seconds)
+        if seconds > budget:
+            self.overruns += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "name": self.name,
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "frame_ms": self.frame.summary_ms(),
+            "phases_ms": {name: hist.summary_ms() for name, hist in self.phases.items()},
+            "counters": {name: dict(src) for name, src in self.counter_sources.items()},
+        }
+
+    def dump(self, path: Optional[Path] = None) -> Path:
+        """Write a JSON snapshot atomically (tmp/stats-{name}.json by default)."""
+        if path is None:
+            project_root = Path(__file__).resolve().parent.parent
+            path = project_root / "tmp" / f"stats-{self.name}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix(".json.part")
+        partial.write_text(json.dumps(self.snapshot(), indent=2), encoding="utf-8")
+        os.replace(partial, path)
+        return path
+
+    def dump_if_due(self, interval: float) -> None:
+        now = time.monotonic()
+        if now < self._next_dump:
+            return
+        self._next_dump = now + interval
+        try:
+            self.dump()
+        except OSError:
+            pass
+
+
+_STATS: Dict[str, FrameStats] = {}
+
+
+def get_stats(name: str) -> FrameStats:
+    """Shared FrameStats for a role, created on first use (like logging.getLogger)."""
+    stats = _STATS.get(name)
+    if stats is None:
+        stats = _STATS[name] = FrameStats(name)
+    return stats
@@ -0,0 +1,166 @@
+import itertools
+import multiprocessing
+import os
+import select
+
+import pytest
+
+from common.ring import RingSocket, connect_ring, doorbell_pair, RingListener
+
+_names = itertools.count()
+
+
+def _pair(capacity: int = 64):
+    name = f"ufogame-test-{os.getpid()}-{next(_names)}"
+    bell_a, bell_b = doorbell_pair()
+    a = RingSocket.create(name, bell_a, capacity)
+    b = RingSocket.attach(name, bell_b)
+    return a, b
+
+
+def _send_and_exit(name: str, bell) -> None:
+    peer = RingSocket.attach(name, bell)
+    peer.send(b"dying words")
+    os._exit(1)  # No close(): the doorbell is closed by the kernel
+
+
+def _readable(sock) -> bool:
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+def _recv_all(sock, limit: int = 1 << 20) -> bytes:
+    data = b""
+    try:
+        while True:
+            chunk = sock.recv(limit)
+            if not chunk:
+                break
+            data += chunk
+    except BlockingIOError:
+        pass
+    return data
+
+
+def test_wraparound_keeps_stream_order():
+    a, b = _pair(64)
+    try:
+        sent = bytearray()
+        received = bytearray()
+        for i in range(200):
+            chunk = bytes((i + j) % 256 for j in range(i % 23 + 1))
+            n = a.send(chunk)
+            sent += chunk[:n]
+            received += b.recv(17 if i % 2 else 64)
+        received += _recv_all(b)
+        assert received == sent
+        assert len(sent) > 10 * 64
+    finally:
+        b.close()
+        a.close()
+
+
+def test_full_ring_refuses_until_read():
+    a, b = _pair(64)
+    try:
+        assert a.send(b"x" * 100) == 64
+        with pytest.raises(BlockingIOError):
+            a.send(b"y")
+        assert b.recv(10) == b"x" * 10
+        assert a.send(b"y" * 20) == 10
+        assert _recv_all(b) == b"x" * 54 + b"y" * 10
+    finally:
+        b.close()
+        a.close()
+
+
+def test_bytes_without_doorbell_are_not_read():
+    a, b = _pair(64)
+    try:
+        a._tx.write(b"early")
+        with pytest.raises(BlockingIOError):
+            b.recv(64)
+        a.send(b"!")
+        assert b.recv(64) == b"early!"
+    finally:
+        b.close()
+        a.close()
+
+
+def test_partial_read_keeps_doorbell_raised():
+    a, b = _pair(64)
+    try:
+        a.send(b"0123456789")
+        assert _readable(b)
+        assert b.recv(4) == b"0123"
+        assert _readable(b)
+        assert b.recv(64) == b"456789"
+        with pytest.raises(BlockingIOError):
+            b.recv(64)
+        assert not _readable(b)
+    finally:
+        b.close()
+        a.close()
+
+
+def test_close_delivers_rest_then_eof():
+    a, b = _pair(64)
+    try:
+        a.send(b"last words")
+        a.close()
+        assert _readable(b)
+        assert b.recv(4) == b"last"
+        assert b.recv(64) == b" words"
+        assert b.recv(64) == b""
+        with pytest.raises(BrokenPipeError):
+            b.send(b"anyone?")
+    finally:
+        b.close()
+        a.close()
+
+
+def test_close_before_any_read_delivers_everything():
+    a, b = _pair(64)
+    try:
+        a.send(b"first ")
+        a.send(b"second")
+        a.close()
+        assert _recv_all(b) == b"first second"
+        assert b.recv(64) == b""
+    finally:
+        b.close()
+        a.close()
+
+
+def test_peer_exit_without_close_reads_as_eof():
+    name = f"ufogame-test-{os.getpid()}-{next(_names)}"
+    bell, child_bell = doorbell_pair()
+    a = RingSocket.create(name, bell, 64)
+    try:
+        child = multiprocessing.get_context("spawn").Process(target=_send_and_exit, args=(name, child_bell))
+        child.start()
+        child_bell.close()
+        child.join(10)
+        assert child.exitcode == 1
+        assert _readable(a)
+        assert a.recv(64) == b"dying words"
+        assert a.recv(64) == b""
+        with pytest.raises(BrokenPipeError):
+            a.send(b"anyone?")
+    finally:
+        a.close()
+
+
+def test_sent_before_accept_is_delivered():
+    name = f"ufogame-test-{os.getpid()}-{next(_names)}"
+    listener = RingListener(name)
+    try:
+        a = connect_ring(name, f"{name}-conn", 64)
+        a.send(b"hello")
+        b, _ = listener.accept()
+        try:
+            assert b.recv(64) == b"hello"
+        finally:
+            b.close()
+            a.close()
+    finally:
+        listener.close()
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import struct
+from typing import Callable, Dict, List, Literal, Optional, Tuple, Type, Union
+
+from common.packets import Packet, LineFramer, decode_line, encode_packet
+
+# Wire encodings a connection can negotiate; the first mutually supported one wins
+WIRE_JSON = "json"
+WIRE_BINARY = "bin1"
+SUPPORTED_WIRES: Tuple[str, ...] = (WIRE_BINARY, WIRE_JSON)
+
+# Binary frame: body length, packet code, then the body
+_HEADER = struct.Struct("!IB")
+# Code 0 carries a JSON packet body for types without a compact codec
+CODE_JSON = 0
+# Input datagram: the connection's token and a per-connection sequence number,
+# then one or more bin1 frames. A datagram not newer than the last one accepted
+# is stale and dropped whole.
+_DATAGRAM = struct.Struct("!II")
+# Stays under the path MTU so datagrams are never fragmented
+MAX_DATAGRAM = 1200
+
+
+class WelcomePacket(Packet):
+    """Sent as a JSON line right after the handshake; everything after it uses `wire`.
+
+    A non-zero `udp_token` means the server accepted the panel's offer of a
+    datagram channel: input datagrams go to `udp_port` carrying that token.
+    """
+    type: Literal["welcome"] = "welcome"
+    wire: str
+    udp_port: int = 0
+    udp_token: int = 0
+
+
+class UdpAckPacket(Packet):
+    """Sent over TCP: the newest input datagram sequence number the server accepted.
+
+    A panel that hears no ack for its datagrams stops using the channel, since
+    datagrams can be dropped silently (firewalls, access point client isolation).
+    """
+    type: Literal["udp_ack"] = "udp_ack"
+    seq: int
+
+
+class PingPacket(Packet):
+    """Round-trip probe; the server answers with a PongPacket echoing both fields."""
+    type: Literal["ping"] = "ping"
+    seq: int
+    sent: float  # Sender's clock; only meaningful to the sender
+
+
+class PongPacket(Packet):
+    type: Literal["pong"] = "pong"
+    seq: int
+    sent: float
+
+
+class _StructCodec:
+    def __init__(self, cls: Type[Packet], code: int, fmt: str,
+                 pack: Callable[[Packet], tuple], unpack: Callable[[tuple], Packet]):
+        self.cls = cls
+        self.code = code
+        self.struct = struct.Struct("!" + fmt)
+        self.pack = pack
+        self.unpack = unpack
+
+
+_CODECS_BY_TYPE: Dict[Type[Packet], _StructCodec] = {}
+_CODECS_BY_CODE: Dict[int, _StructCodec] = {}
+
+
+def register_struct_codec(cls: Type[Packet], code: int, fmt: str,
+                          pack: Callable[[Packet], tuple], unpack: Callable[[tuple], Packet]) -> None:
+    """Give a packet type a fixed-layout binary body.
+
+    `pack` turns a packet into the struct fields and may raise ValueError for
+    values the layout cannot hold, in which case the packet goes out as JSON.
+    `unpack` builds the packet back from the unpacked tuple.
+    """
+    if code == CODE_JSON or not 0 < code < 256:
+        raise ValueError(f"Invalid packet code {code}")
+    existing = _CODECS_BY_CODE.get(code)
+    if existing is not None and existing.cls is not cls:
+        raise ValueError(f"Packet code {code} already used by {existing.cls.__name__}")
+    codec = _StructCodec(cls, code, fmt, pack, unpack)
+    _CODECS_BY_TYPE[cls] = codec
+    _CODECS_BY_CODE[code] = codec
+
+
+def encode_binary(packet: Packet) -> bytes:
+    codec = _CODECS_BY_TYPE.get(type(packet))
+    if codec is not None:
+        try:
+            body = codec.struct.pack(*codec.pack(packet))
+            return _HEADER.pack(len(body), codec.code) + body
+        except (ValueError, struct.error):
+            pass
+    body = encode_packet(packet)[:-1]  # JSON without the line terminator
+    return _HEADER.pack(len(body), CODE_JSON) + body
+
+
+def _decode_frame(code: int, view: memoryview, start: int, end: int) -> Optional[Packet]:
+    if code == CODE_JSON:
+        return decode_line(view[start:end].tobytes())
+    codec = _CODECS_BY_CODE.get(code)
+    if codec is None or codec.struct.size != end - start:
+        return None
+    try:
+        return codec.unpack(codec.struct.unpack_from(view, start))
+    except (ValueError, IndexError):
+        return None
+
+
+def decode_binary(frame: bytes) -> Optional[Packet]:
+    """Decode one complete bin1 frame, or None if it is malformed."""
+    if len(frame) < _HEADER.size:
+        return None
+    length, code = _HEADER.unpack_from(frame)
+    if _HEADER.size + length > len(frame):
+        return None
+    with memoryview(frame) as view:
+        return _decode_frame(code, view, _HEADER.size, _HEADER.size + length)
+
+
+class BinaryFramer:
+    """Incremental decoder for length-prefixed binary frames.
+
+    Frames with an unknown code or a malformed body are skipped and counted. A
+    length over `max_frame` means the stream cannot be resynchronised, so it
+    raises ValueError and the caller should drop the connection.
+    """
+
+    def __init__(self, max_frame: int = 65536):
+        self.max_frame = max_frame
+        self.dropped_frames = 0
+        self._buf = bytearray()
+
+    def clear(self) -> None:
+        self._buf.clear()
+
+    def decode(self, data: bytes) -> List[Packet]:
+        self._buf += data
+        packets: List[Packet] = []
+        offset = 0
+        size = len(self._buf)
+        header_size = _HEADER.size
+        unpack_header = _HEADER.unpack_from
+        # Input arrives as long runs of one struct code, so the last codec is kept at hand
+        # and its frames skip the generic _decode_frame path
+        fast_code = -1
+        fast_size = 0
+        fast_struct = fast_unpack = None
+        with memoryview(self._buf) as view:
+            while size - offset >= header_size:
+                length, code = unpack_header(view, offset)
+                if length > self.max_frame:
+                    raise ValueError(f"Binary frame of {length} bytes exceeds {self.max_frame}")
+                start = offset + header_size
+                end = start + length
+                if end > size:
+                    break
+                if code == fast_code and length == fast_size:
+                    try:
+                        packets.append(fast_unpack(fast_struct.unpack_from(view, start)))
+                    except (ValueError, IndexError):
+                        self.dropped_frames += 1
+                    offset = end
+                    continue
+                codec = _CODECS_BY_CODE.get(code)
+                if codec is not None:
+                    fast_code, fast_size = code, codec.struct.size
+                    fast_struct, fast_unpack = codec.struct, codec.unpack
+                packet = _decode_frame(code, view, start, end)
+                if packet is None:
+                    self.dropped_frames += 1
+                else:
+                    packets.append(packet)
+                offset = end
+        if offset:
+            del self._buf[:offset]
+        return packets
+
+
+def encode_datagrams(token: int, seq: int, packets: List[Packet]) -> List[Tuple[int, bytes]]:
+    """Pack packets into (seq, datagram) pairs of at most MAX_DATAGRAM bytes, numbered from `seq`."""
+    datagrams: List[Tuple[int, bytes]] = []
+    frames: List[bytes] = []
+    size = _DATAGRAM.size
+    for packet in packets:
+        frame = encode_binary(packet)
+        if frames and size + len(frame) > MAX_DATAGRAM:
+            datagrams.append((seq, _DATAGRAM.pack(token, seq) + b"".join(frames)))
+            seq += 1
+            frames.clear()
+            size = _DATAGRAM.size
+        frames.append(frame)
+        size += len(frame)
+    if frames:
+        datagrams.append((seq, _DATAGRAM.pack(token, seq) + b"".join(frames)))
+    return datagrams
+
+
+def decode_datagram(data: bytes) -> Optional[Tuple[int, int, List[Packet]]]:
+    """(token, seq, packets) from one datagram, or None if it is malformed."""
+    if len(data) < _DATAGRAM.size:
+        return None
+    token, seq = _DATAGRAM.unpack_from(data)
+    framer = BinaryFramer(MAX_DATAGRAM)
+    try:
+        packets = framer.decode(data[_DATAGRAM.size:])
+    except ValueError:
+        return None
+    if framer._buf or framer.dropped_frames:
+        return None  # Truncated or garbled
+    return token, seq, packets
+
+
+def choose_wire(offered: object) -> str:
+    """Pick the encoding for a connection from the peer's preference list."""
+    if isinstance(offered, list):
+        for wire in offered:
+            if wire in SUPPORTED_WIRES:
+                return wire
+    return WIRE_JSON
+
+
+def encode_for(packet: Packet, wire: str) -> bytes:
+    return encode_binary(packet) if wire == WIRE_BINARY else encode_packet(packet)
+
+
+def new_framer(wire: str) -> Union[LineFramer, BinaryFramer]:
+    return BinaryFramer() if wire == WIRE_BINARY else LineFramer()
+
+
+register_struct_codec(PingPacket, 4, "Id", lambda p: (p.seq, p.sent), lambda t: PingPacket(seq=t[0], sent=t[1]))
+register_struct_codec(PongPacket, 5, "Id", lambda p: (p.seq, p.sent), lambda t: PongPacket(seq=t[0], sent=t[1]))
+register_struct_codec(UdpAckPacket, 8, "I", lambda p: (p.seq,), lambda t: UdpAckPacket(seq=t[0]))
@@ -22,8 +22,12 @@ def main(argv=None):
     group.add_argument("-s", "--server", action="store_true", help="Run the server")
     group.add_argument("-c", "--client", action="store_true", help="Run the client")
     group.add_argument("-t", "--test", action="store_true", help="Run server + 4 panels on one machine")
+    group.add_argument("-b", "--bench", action="store_true", help="Run the latency benchmark against a local server")
     parser.add_argument("--player", type=int, default=None, help="Which player the client controls (1-9)")
-    args = parser.parse_args(argv)
+    parser.add_argument("--no-mdns", action="store_true", help="Server: do not advertise via mDNS")
+    parser.add_argument("--transport", choices=("tcp", "ring"), default=None,
+                        help="tcp, or ring for shared-memory rings between processes on this host (overrides config)")
+    args, extra = parser.parse_known_args(argv)
 
     # Load top-level config.toml if present
     config: dict = {}
@@ -43,13 +47,18 @@ def main(argv=None):
         role = "client"
     elif args.test:
         role = "test"
+    elif args.bench:
+        role = "bench"
     else:
         raw_role = config.get("role") if config else None
         if isinstance(raw_role, str):
             role = raw_role.strip().lower()
 
+    if extra and role != "bench":
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+
     if role == "server":
-        return server_main()
+        return server_main(advertise=not args.no_mdns, transport=args.transport)
     elif role == "client":
         # Player from CLI if provided; otherwise from config
         player_value = args.player if args.player is not None else (config.get("player") if config else None)
@@ -60,9 +69,15 @@ def main(argv=None):
         if player is None or player < 1 or player > 9:
             logger.error("player must be an integer between 1 and 9 (via --player or config.toml)")
             return 2
-        return client_main(player)
+        return client_main(player, transport=args.transport)
     elif role == "test":
-        return _run_test_mode()
+        # Test mode can skip kernel networking entirely with transport="ring" in config.toml
+        transport = args.transport or (config.get("transport") if config else None)
+        return _run_test_mode(transport if transport in ("tcp", "ring") else None)
+    elif role == "bench":
+        # Remaining arguments go to the benchmark (see `python -m bench.latency --help`)
+        from bench.latency import main as bench_main
+        return bench_main(extra)
     else:
         if config_path.exists():
             logger.error("config.toml must set role to 'server', 'client', or 'test'")
@@ -70,15 +85,17 @@ def main(argv=None):
             logger.error("Must specify --server/--client/--test or provide config.toml with role")
         return 2
 
-def _run_test_mode() -> int:
+def _run_test_mode(transport: str | None = None) -> int:
     procs = []
+    # Server and panels share the transport; otherwise each uses its own config
+    transport_args = ["--transport", transport] if transport else []
     try:
         # Start server
-        procs.append(subprocess.Popen([sys.executable, __file__, "-s"]))
+        procs.append(subprocess.Popen([sys.executable, __file__, "-s", *transport_args]))
         time.sleep(0.3)
         # Start 4 panels: players 1..4
         for player in range(1, 5):
-            procs.append(subprocess.Popen([sys.executable, __file__, "-c", "--player", str(player)]))
+            procs.append(subprocess.Popen([sys.executable, __file__, "-c", "--player", str(player), *transport_args]))
             time.sleep(0.2)
 
         print("Test mode running: server + 4 panels. Press Ctrl-C to stop all.")
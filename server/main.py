@@ -2,99 +2,201 @@
 import time
 import logging
 import socket
+from pathlib import Path
 from typing import Dict
 
-from common.gamestate import GameStatePacket, GameState, ClientState, StartLevelPacket
-from common.names import generate_names
-from common.runner import run
-from common.packets import TextPacket
-from server.network import Client, ensure_server_ready, accept_new_clients, receive_packets, send_packet_to_player, \
-    send_packet_to_all, PORT, all_clients_ready as net_all_clients_ready, set_client_ready, client_count, clients
+from common.config import load_config
+from common.doodad import DoodadInputPacket
+from common.gamestate import GameState, GameStatePacket, ClientState, ResyncPacket, StartLevelPacket
+from common.loop import EventLoop
+from common.names import generate_names, seed_names
+from common.runner import run, TickPolicy
+from common.sessionlog import DEFAULT_KEEP, DEFAULT_MAX_BYTES, prune_sessions
+from common.stats import get_stats
+from common.packets import Packet, TextPacket
+from common.wire import PingPacket, PongPacket
+from server import network, registry, shard, state
+from server.network import PORT, send_counters, start_session_log, stop_session_log, udp_counters
 
 COUNTDOWN_LENGTH = 3
-_game_state: GameState = GameState.IDLE
-_level = 0
+# Game state panels see lives in server.state: "state", "countdown", "level" and
+# each panel's private "doodad_names"
 _countdown: tuple[int, float] | None = None  # (value, last_sent_time)
+_loop: EventLoop | None = None
+_tick_policy = TickPolicy({})
+_stats = get_stats("server")
+_stats.counter_sources["send"] = send_counters
+_stats.counter_sources["udp"] = udp_counters
+# Network I/O in this process (server.network) or in worker processes (server.shard); same functions
+_net = network
 
 def reset():
-    global _game_state, _level, _countdown
-    _game_state = GameState.IDLE
-    _level = 0
+    global _countdown
+    state.clear()
+    state.set_field("state", GameState.IDLE)
+    state.set_field("countdown", 0)
+    state.set_field("level", 0)
     _countdown = None
 
-def main():
-    return run(
-        logger_name="server",
-        advertise_instance="ufogame-0",
-        advertise_port=PORT,
-        advertise_properties=None,
-        run_frame=run_frame,
-    )
+
+def game_state() -> GameState:
+    return state.get("state", GameState.IDLE)
+
+def main(advertise: bool = True, transport: str | None = None):
+    global _loop, _tick_policy, _net
+    config = load_config(Path(__file__).parent / "config.toml")
+    # "tcp", or "ring" for shared-memory rings to panels on this host; the CLI overrides config
+    transport = str(transport or config.get("transport", "tcp")).lower()
+    if transport == "ring":
+        advertise = False  # Ring panels find the server by port number, not mDNS
+    # "select" wakes on socket readiness and timers; "poll" sleeps between frames
+    if str(config.get("loop", "poll")).lower() == "select":
+        _loop = EventLoop()
+    io_workers = int(config.get("io_workers", 0))
+    if io_workers > 0:
+        shard.configure(io_workers, bool(config.get("udp", False)), transport)
+        # Socket counters are kept by the workers, in tmp/stats-server-io-<n>.json
+        _stats.counter_sources.pop("send", None)
+        _stats.counter_sources.pop("udp", None)
+        _stats.counter_sources["shard"] = shard.counters
+        _net = shard
+    else:
+        network.transport = transport
+        network.enable_udp(bool(config.get("udp", False)) and transport != "ring")
+    _net.attach_loop(_loop)
+    _tick_policy = TickPolicy.from_config(config)
+    reset()
+    seed = config.get("name_seed")
+    seed_names(seed if isinstance(seed, int) else None, int(config.get("name_history", 3)))
+    if config.get("session_log", False):
+        # Replay with: python -m bench.replay tmp/sessions/<file>
+        sessions = Path(__file__).resolve().parent.parent / "tmp" / "sessions"
+        max_mb = float(config.get("session_log_max_mb", DEFAULT_MAX_BYTES / (1024 * 1024)))
+        start_session_log(sessions / time.strftime("session-%Y%m%d-%H%M%S.ufolog"),
+                          int(max_mb * 1024 * 1024) if max_mb > 0 else None)
+        # The new file counts as one of the sessions kept
+        prune_sessions(sessions, int(config.get("session_log_keep", DEFAULT_KEEP)))
+    try:
+        return run(
+            logger_name="server",
+            advertise_instance="ufogame-0" if advertise else None,
+            advertise_port=PORT,
+            advertise_properties=None,
+            run_frame=run_frame,
+            loop=_loop,
+            tick=lambda: _tick_policy.period(game_state()),
+        )
+    finally:
+        if _net is shard:
+            shard.stop()
+        stop_session_log()
+        if _loop is not None:
+            _loop.close()
 
 def run_frame(logger: logging.Logger) -> bool:
-    global _game_state, _countdown, _level
     try:
-        ensure_server_ready(logger)
-        new_client_ids = accept_new_clients(logger)
-        for client_id in new_client_ids:
-            # Send current state to newcomer, including countdown value if applicable
-            if _game_state == GameState.LEVEL_COUNTDOWN and _countdown is not None:
-                send_packet_to_player(client_id, GameStatePacket(state=_game_state, countdown=_countdown[0]))
-            else:
-                send_packet_to_player(client_id, GameStatePacket(state=_game_state))
-
-        packets_by_player = receive_packets(logger)
-        for pid, packets in packets_by_player.items():
-            for p in packets:
-                if isinstance(p, TextPacket):
-                    logger.info(f"recv from {pid}: {p.text}")
-                if isinstance(p, ClientState):
-                    handle_client_state(logger, pid, p)
-
-        if _game_state == GameState.IDLE and net_all_clients_ready():
-            logger.info("All clients ready.")
-            _game_state = GameState.LEVEL_COUNTDOWN
-            _countdown = (COUNTDOWN_LENGTH + 1, 100.0)  # Distant past to force immediate countdown
-
-        # Drive countdown timing and transition to IN_LEVEL
-        if _game_state == GameState.LEVEL_COUNTDOWN and _countdown is not None:
-            value, last_time = _countdown
-            now = time.monotonic()
-            if now - last_time >= 1.0:
-                if value > 1:
-                    value -= 1
-                    _countdown = (value, now)
-                    send_packet_to_all(GameStatePacket(state=GameState.LEVEL_COUNTDOWN, countdown=value))
+        with _stats.phase("accept"):
+            _net.ensure_server_ready(logger)
+            new_client_ids = _net.accept_new_clients(logger)
+            for client_id in new_client_ids:
+                # A panel rejoining mid-level gets its doodad names back in the snapshot
+                names = state.get_private(client_id, "doodad_names")
+                if names:
+                    state.set_private(client_id, "doodad_names", registry.restore_names(client_id, names))
+                snapshot = state.snapshot(client_id)
+                if _net.takes_state_sync(client_id):
+                    _net.send_packet_to_player(client_id, snapshot)
                 else:
-                    _game_state = GameState.IN_LEVEL
-                    _level += 1
-                    _countdown = None
-                    send_packet_to_all(GameStatePacket(state=GameState.IN_LEVEL))
-                    # Start the level; provide doodad names
-
-                    doodad_count = 0
-                    for client in clients.values():
-                        doodad_count += len(client.panel.capabilities)
-                    doodad_names = generate_names(doodad_count)
-
-                    n = 0
-                    for pid, client in clients.items():
-                        doodads = {}
-                        for doodad in client.panel.capabilities:
-                            doodads[doodad.id] = doodad_names[n]
-                            n += 1
-                        send_packet_to_player(pid, StartLevelPacket(doodad_names=doodads, level=_level))
+                    for packet in legacy_packets(snapshot.fields):
+                        _net.send_packet_to_player(client_id, packet)
+
+        with _stats.phase("receive"):
+            packets_by_player = _net.receive_packets(logger)
 
+        with _stats.phase("dispatch"):
+            for pid, packets in packets_by_player.items():
+                for p in packets:
+                    if isinstance(p, TextPacket):
+                        logger.info("recv from %s: %s", pid, p.text)
+                    if isinstance(p, ClientState):
+                        handle_client_state(logger, pid, p)
+                    if isinstance(p, PingPacket):
+                        _net.send_packet_to_player(pid, PongPacket(seq=p.seq, sent=p.sent))
+                    if isinstance(p, DoodadInputPacket):
+                        handle_doodad_input(logger, pid, p)
+                    if isinstance(p, ResyncPacket):
+                        logger.info("Panel %s missed state after version %s; resending snapshot", pid, p.seq)
+                        _net.send_packet_to_player(pid, state.snapshot(pid))
+            advance_game(logger)
+
+        with _stats.phase("send"):
+            for players, delta in state.pending_deltas():
+                synced = [pid for pid in players if _net.takes_state_sync(pid)]
+                if synced:
+                    _net.send_packet_to_players(synced, delta)
+                if len(synced) < len(players):
+                    legacy = [pid for pid in players if pid not in synced]
+                    for packet in legacy_packets(delta.changes):
+                        _net.send_packet_to_players(legacy, packet)
+            syscalls = _net.flush_outbound()
+        if syscalls:
+            logger.debug("Frame output flushed in %d send syscalls", syscalls)
         return True
     except Exception as e:
         logger.debug(f"Server frame error: {e}")
         return True
 
 
+def advance_game(logger: logging.Logger) -> None:
+    global _countdown
+    if game_state() == GameState.IDLE and _net.all_clients_ready():
+        logger.info("All clients ready.")
+        _countdown = (COUNTDOWN_LENGTH + 1, 100.0)  # Distant past to force immediate countdown
+
+    # Drive countdown timing and transition to IN_LEVEL
+    if _countdown is not None:
+        value, last_time = _countdown
+        now = time.monotonic()
+        if now - last_time >= 1.0:
+            if value > 1:
+                value -= 1
+                _countdown = (value, now)
+                state.set_field("state", GameState.LEVEL_COUNTDOWN)
+                state.set_field("countdown", value)
+                if _loop is not None:
+                    _loop.call_at(now + 1.0)  # Wake for the next countdown step
+            else:
+                _countdown = None
+                # Start the level; each panel's delta carries the new state and its doodad names
+                state.set_field("state", GameState.IN_LEVEL)
+                state.set_field("countdown", 0)
+                state.set_field("level", state.get("level", 0) + 1)
+                state.replace_private("doodad_names", registry.assign_names(generate_names(registry.doodad_count())))
+
+
+def legacy_packets(fields: dict) -> list[Packet]:
+    """The packets a panel without state sync gets for changed `fields`, as before versioned state."""
+    packets: list[Packet] = []
+    if "state" in fields or "countdown" in fields:
+        packets.append(GameStatePacket(state=game_state(), countdown=state.get("countdown", 0)))
+    names = fields.get("doodad_names")
+    if names:
+        packets.append(StartLevelPacket(doodad_names=names, level=state.get("level")))
+    return packets
+
+
+def handle_doodad_input(logger, pid, packet):
+    doodad = registry.record_input(pid, packet.doodad, packet.value)
+    if doodad is None:
+        logger.debug("Input from unknown doodad %s on panel %s", packet.doodad, pid)
+        return
+    logger.debug("Input %s=%s from %s (panel %s)", doodad.name or doodad.id, packet.value, doodad.id, pid)
+
+
 def handle_client_state(logger, pid, client_state):
     if client_state.ready:
         logger.info(f"Panel {pid} is ready")
-        set_client_ready(pid, True)
+        _net.set_client_ready(pid, True)
     else:
         logger.info(f"Panel {pid} is not ready")
-        set_client_ready(pid, False)
+        _net.set_client_ready(pid, False)
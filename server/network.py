@@ -1,209 +1,629 @@
 import json
 import logging
+import secrets
+import selectors
 import socket
 import time
-from typing import Dict, List
+from collections import deque
+from typing import Deque, Dict, List
 
 from common.gamestate import GameStatePacket, GameState
-from common.packets import encode_packet, Packet, decode_lines, TextPacket
+from common.logger import get_logger
+from common.loop import EventLoop
+from common.packets import encode_packet, Packet, LineFramer, TextPacket
+from common.sessionlog import ALL_PLAYERS, DEFAULT_MAX_BYTES, SessionWriter
+from common.wire import BinaryFramer, UdpAckPacket, WelcomePacket, WIRE_BINARY, WIRE_JSON, choose_wire, \
+    decode_binary, decode_datagram, encode_for, new_framer
 
 from common.panel import Panel, panel_from_json
+from common.ring import RingListener, ring_listener_name
+from server import registry, state
 
 class Client:
-    def __init__(self, panel: Panel, sock: socket.socket):
+    def __init__(self, panel: Panel, sock: socket.socket, wire: str = WIRE_JSON):
         self.panel = panel
         self.sock = sock
+        self.wire = wire  # Encoding negotiated in the handshake
         self.ready = False
+        # Encoded frames not yet accepted by the kernel; broadcasts share one bytes object
+        self.outbox: Deque[bytes | memoryview] = deque()
+        self.outbox_bytes = 0
+        self.want_write = False  # Registered for EVENT_WRITE while outbox is non-empty
+        self.udp_token = 0  # Non-zero once the panel's input datagram channel is accepted
+        self.udp_seq = 0  # Sequence number of the newest datagram accepted
+        self.udp_acked = 0  # udp_seq as of the last UdpAckPacket
+        self.udp_ack_due = 0.0  # Acks go out at most every UDP_ACK_INTERVAL
+        self.udp_ack_wake = 0.0  # Deadline of the loop timer waiting to send a held-back ack
+        self.udp_host = ""  # Datagrams are only accepted from the panel's TCP peer address
+        # Takes versioned state snapshots/deltas; older panels get GameStatePacket/StartLevelPacket
+        self.state_sync = False
+
+
+class _PendingConnection:
+    """An accepted socket that has not completed its handshake line yet.
+
+    State goes "pending" (nothing received) -> "handshaking" (partial line) and the
+    connection is promoted to a Client, or closed once `deadline` passes.
+    """
+
+    def __init__(self, sock: socket.socket, addr, deadline: float):
+        self.sock = sock
+        self.addr = addr
+        self.deadline = deadline
+        self.state = "pending"
+        self.framer = LineFramer()
 
 PORT = 8200
-_server_sock: socket.socket | None = None
+# Seconds a new connection gets to deliver its handshake line
+HANDSHAKE_TIMEOUT = 2.0
+# A panel further behind than this is treated as dead rather than buffered forever
+MAX_OUTBOX_BYTES = 256 * 1024
+# Frames handed to one sendmsg() call; well under IOV_MAX everywhere
+_MAX_IOV = 64
+# Cumulative outbound I/O: send syscalls issued, frames queued, bytes written
+send_counters: Dict[str, int] = {"syscalls": 0, "frames": 0, "bytes": 0}
+# "tcp", or "ring" for shared-memory rings to panels on this host (test mode), without
+# kernel networking; ring panels connect to the RingListener named by ring_listener_name()
+transport = "tcp"
+_server_sock: socket.socket | RingListener | None = None
 clients: Dict[int, Client] = {}
 _last_sent: float = 0.0
-_rx_buffers: Dict[int, bytes] = {}
+_rx_buffers: Dict[int, LineFramer | BinaryFramer] = {}
+# Event-driven mode: readiness reported by the loop instead of polling every socket
+_loop: EventLoop | None = None
+_accept_ready: bool = True
+_readable: set[int] = set()
+_MAX_READS_PER_WAKE = 16
+# Set while whoever consumes our input is behind (see server.shard); sockets stay
+# open and flush output, and TCP flow control pushes back on the panels
+_reading_paused = False
+_pending: Dict[int, _PendingConnection] = {}  # Keyed by socket fileno
+_handshake_readable: set[int] = set()
+# Packets that arrived in the same read as a handshake line
+_early_packets: Dict[int, List[Packet]] = {}
+# Binary record of every packet in and out, when enabled
+session_log: SessionWriter | None = None
+# Optional datagram channel for latest-value-wins input, on the same port number as TCP
+udp_enabled = False
+_udp_sock: socket.socket | None = None
+_udp_ready: bool = True
+_udp_players: Dict[int, int] = {}  # Token -> player
+# Set in I/O worker processes so several can listen on the port (see server.shard)
+reuse_port = False
+_MAX_DATAGRAMS_PER_FRAME = 256
+# Panels fall back to TCP after about a second without an ack, so this must stay well under that
+UDP_ACK_INTERVAL = 0.2
+# Datagrams accepted, dropped as older than one already accepted, or with an unknown token or source
+udp_counters: Dict[str, int] = {"datagrams": 0, "stale": 0, "rejected": 0, "acks": 0}
+
+
+def attach_loop(loop: EventLoop | None) -> None:
+    global _loop
+    _loop = loop
+
+
+def enable_udp(enabled: bool) -> None:
+    """Offer the input datagram channel to panels that ask; takes effect when the server starts listening."""
+    global udp_enabled
+    udp_enabled = enabled
+
+
+def start_session_log(path, max_bytes: int | None = DEFAULT_MAX_BYTES) -> SessionWriter:
+    global session_log
+    stop_session_log()
+    session_log = SessionWriter(path, max_bytes)
+    return session_log
+
+
+def stop_session_log() -> None:
+    global session_log
+    if session_log is not None:
+        session_log.close()
+        session_log = None
+
+
+def _on_listen_ready(mask: int) -> None:
+    global _accept_ready
+    _accept_ready = True
+
+
+def _on_udp_ready(mask: int) -> None:
+    global _udp_ready
+    _udp_ready = True
+
+
+def _watch_client(player_id: int, client: Client) -> None:
+    if _loop is None:
+        return
+    events = (0 if _reading_paused else selectors.EVENT_READ) | (selectors.EVENT_WRITE if client.want_write else 0)
+    if events:
+        _loop.modify(client.sock, lambda mask: _on_client_event(player_id, mask), events)
+    else:
+        _loop.unregister(client.sock)
+
+
+def _watch_pending(fd: int, conn: _PendingConnection) -> None:
+    if _loop is not None and not _reading_paused:
+        _loop.register(conn.sock, lambda mask: _handshake_readable.add(fd))
+
+
+def pause_reading(paused: bool) -> None:
+    """Stop or resume accepting connections and reading panels' input."""
+    global _reading_paused
+    if paused == _reading_paused:
+        return
+    _reading_paused = paused
+    if _loop is None:
+        return
+    for player_id, client in clients.items():
+        _watch_client(player_id, client)
+    for fd, conn in _pending.items():
+        if paused:
+            _loop.unregister(conn.sock)
+        else:
+            _watch_pending(fd, conn)
+            _handshake_readable.add(fd)  # May have arrived while we were not looking
+    for sock, callback in ((_server_sock, _on_listen_ready), (_udp_sock, _on_udp_ready)):
+        if sock is None:
+            continue
+        if paused:
+            _loop.unregister(sock)
+        else:
+            _loop.register(sock, callback)
+
+
+def _on_client_event(player_id: int, mask: int) -> None:
+    if mask & selectors.EVENT_READ:
+        _readable.add(player_id)
+    if mask & selectors.EVENT_WRITE:
+        client = clients.get(player_id)
+        if client is not None:
+            _flush_client(player_id, client)
+
+
+def _close_socket(sock: socket.socket) -> None:
+    if _loop is not None:
+        _loop.unregister(sock)
+    try:
+        sock.close()
+    except Exception:
+        pass
+
+
+def _drop_client(player_id: int) -> None:
+    client = clients.pop(player_id, None)
+    _rx_buffers.pop(player_id, None)
+    _early_packets.pop(player_id, None)
+    _readable.discard(player_id)
+    if client is not None:
+        _close_socket(client.sock)
+        _udp_players.pop(client.udp_token, None)
+        registry.remove_player(player_id)
+        state.forget(player_id)
+        if session_log is not None:
+            session_log.disconnect(player_id)
+
+
+def _flush_client(player_id: int, client: Client) -> bool:
+    """Write the outbox with gathered sendmsg() calls; False if the client was dropped."""
+    outbox = client.outbox
+    try:
+        while outbox:
+            batch = [outbox[i] for i in range(min(len(outbox), _MAX_IOV))]
+            sent = client.sock.sendmsg(batch)
+            send_counters["syscalls"] += 1
+            send_counters["bytes"] += sent
+            client.outbox_bytes -= sent
+            while sent:
+                head = outbox[0]
+                if sent >= len(head):
+                    sent -= len(head)
+                    outbox.popleft()
+                else:
+                    outbox[0] = memoryview(head)[sent:]
+                    sent = 0
+    except (BlockingIOError, InterruptedError):
+        pass
+    except Exception as e:
+        get_logger("server").info(f"Player {player_id} send failed; dropping: {e}")
+        _drop_client(player_id)
+        return False
+    want_write = bool(outbox)
+    if want_write != client.want_write:
+        client.want_write = want_write
+        _watch_client(player_id, client)
+    return True
+
+
+def _queue_send(player_id: int, client: Client, data: bytes) -> bool:
+    """Queue an encoded frame; it is written by the next flush_outbound()."""
+    if client.outbox_bytes + len(data) > MAX_OUTBOX_BYTES:
+        get_logger("server").info(f"Player {player_id} is {client.outbox_bytes} bytes behind; dropping")
+        _drop_client(player_id)
+        return False
+    client.outbox.append(data)
+    client.outbox_bytes += len(data)
+    send_counters["frames"] += 1
+    return True
+
 
 def ensure_server_ready(logger: logging.Logger) -> None:
-    global _server_sock
+    global _server_sock, _udp_sock
     if _server_sock is not None:
         return
+    if transport == "ring":
+        _server_sock = RingListener(ring_listener_name(PORT))
+        if _loop is not None:
+            _loop.register(_server_sock, _on_listen_ready)
+        logger.info(f"Server accepting shared-memory ring connections as {ring_listener_name(PORT)}")
+        return
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     s.bind(("0.0.0.0", PORT))
     s.listen(16)
     s.setblocking(False)
     _server_sock = s
+    if _loop is not None:
+        _loop.register(s, _on_listen_ready)
     logger.info(f"Server listening on 0.0.0.0:{PORT}")
+    if udp_enabled:
+        u = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        u.bind(("0.0.0.0", s.getsockname()[1]))
+        u.setblocking(False)
+        _udp_sock = u
+        if _loop is not None:
+            _loop.register(u, _on_udp_ready)
+        logger.info(f"Input datagrams accepted on UDP 0.0.0.0:{u.getsockname()[1]}")
+
+
+def adopt_connection(sock: socket.socket, addr) -> None:
+    """Start the handshake on a connected socket, as if it had just been accepted."""
+    sock.setblocking(False)
+    conn = _PendingConnection(sock, addr, time.monotonic() + HANDSHAKE_TIMEOUT)
+    fd = sock.fileno()
+    _pending[fd] = conn
+    if _loop is not None:
+        _watch_pending(fd, conn)
+        _loop.call_at(conn.deadline)  # Wake to expire it if nothing arrives
+    else:
+        _handshake_readable.add(fd)
 
 
 def accept_new_clients(logger: logging.Logger) -> list[int]:
-    global clients, _rx_buffers
-    if _server_sock is None:
+    """Accept connections and advance handshakes without blocking.
+
+    Returns the player ids whose handshake completed during this call.
+    """
+    global _accept_ready
+    if _server_sock is None or _reading_paused:
         return []
 
+    if _loop is None or _accept_ready:
+        # Bounded accepts per frame to avoid long frames
+        for _ in range(32):
+            try:
+                c, addr = _server_sock.accept()
+            except BlockingIOError:
+                _accept_ready = False
+                break
+            # Frames are already gathered into one send per client per tick, so Nagle
+            # only delays a pong queued behind an unacknowledged udp_ack segment
+            if isinstance(c, socket.socket):
+                c.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            adopt_connection(c, addr)
+
     new_clients = []
+    if _loop is None:
+        _handshake_readable.update(_pending)
+    for fd in list(_handshake_readable):
+        conn = _pending.get(fd)
+        if conn is None:
+            continue
+        player_id = _advance_handshake(logger, fd, conn)
+        if player_id is not None:
+            new_clients.append(player_id)
+    _handshake_readable.clear()
 
-    # Bounded accepts per frame to avoid long frames
-    for _ in range(32):
-        try:
-            c, addr = _server_sock.accept()
-        except BlockingIOError:
-            break
+    now = time.monotonic()
+    for fd, conn in list(_pending.items()):
+        if now >= conn.deadline:
+            _pending.pop(fd, None)
+            _close_socket(conn.sock)
+            logger.info(f"Handshake from {conn.addr} timed out ({conn.state})")
+    return new_clients
 
-        # Read one JSON line handshake with blocking timeout
-        c.settimeout(1.0)
-        data = b""
-        try:
-            while not data.endswith(b"\n") and len(data) < 65536:
-                chunk = c.recv(4096)
-                if not chunk:
-                    break
-                data += chunk
-        except Exception as e:
-            try:
-                c.close()
-            except Exception:
-                pass
-            logger.info(f"Handshake read failed from {addr}: {e}")
-            continue
-        finally:
-            # Return to blocking mode for initial write; we'll switch to nonblocking later
-            c.settimeout(None)
 
-        panel_obj: Panel | None = None
-        player_id: int | None = None
-        try:
-            obj = json.loads(data.decode("utf-8")) if data else {}
-            if isinstance(obj, dict) and obj.get("player") is not None:
-                panel_obj = panel_from_json(obj)
-                player_id = panel_obj.player
-        except Exception:
-            panel_obj = None
-            player_id = None
-
-        if not player_id or not (1 <= player_id <= 9) or panel_obj is None:
-            try:
-                c.close()
-            except Exception:
-                pass
-            preview = data[:200].decode("utf-8", errors="replace") if data else ""
-            logger.info(f"Rejected connection {addr}: invalid handshake; data preview='{preview}'")
-            continue
+def _advance_handshake(logger: logging.Logger, fd: int, conn: _PendingConnection) -> int | None:
+    try:
+        data = conn.sock.recv(4096)
+    except (BlockingIOError, InterruptedError):
+        return None
+    except Exception as e:
+        _pending.pop(fd, None)
+        _close_socket(conn.sock)
+        logger.info(f"Handshake read failed from {conn.addr}: {e}")
+        return None
+    if not data:
+        _pending.pop(fd, None)
+        _close_socket(conn.sock)
+        logger.info(f"Connection {conn.addr} closed during handshake")
+        return None
 
-        # Replace any existing client for this player
-        old = clients.pop(player_id, None)
-        if old is not None:
-            try:
-                old.sock.close()
-            except Exception:
-                pass
-            logger.info(f"Player {player_id} replaced existing connection")
+    conn.state = "handshaking"
+    lines = conn.framer.feed(data, max_lines=1)
+    if conn.framer.dropped_lines:
+        _pending.pop(fd, None)
+        _close_socket(conn.sock)
+        logger.info(f"Rejected connection {conn.addr}: handshake line too long")
+        return None
+    if not lines:
+        return None
+    _pending.pop(fd, None)
+    return _promote(logger, conn, lines[0], conn.framer.take_buffer())
 
-        # Send initial RESET in blocking mode to avoid EAGAIN on nonblocking send
-        try:
-            c.sendall(encode_packet(GameStatePacket(state=GameState.RESET)))
-        except Exception as e:
-            try:
-                c.close()
-            except Exception:
-                pass
-            logger.info(f"Failed to send initial RESET to player {player_id}; dropping: {e}")
-            continue
-        c.setblocking(False)
-        clients[player_id] = Client(panel=panel_obj, sock=c)
-        new_clients.append(player_id)
-        _rx_buffers[player_id] = b""
-        logger.info(f"Player {player_id} connected from {addr}")
-        logger.info(f"Player {player_id} capabilities: {panel_obj.capabilities}")
-    return new_clients
+
+def _parse_handshake(line: bytes) -> tuple[Panel | None, int | None, str, bool, bool]:
+    """(panel, player, wire, offers udp, takes state sync) from a handshake line."""
+    try:
+        obj = json.loads(line)
+        if isinstance(obj, dict) and obj.get("player") is not None:
+            panel_obj = panel_from_json(obj)
+            # Panels that predate wire negotiation send no list and stay on JSON
+            return (panel_obj, panel_obj.player, choose_wire(obj.get("wire")), obj.get("udp") is True,
+                    obj.get("state_sync") is True)
+    except Exception:
+        pass
+    return None, None, WIRE_JSON, False, False
+
+
+def _new_udp_token() -> int:
+    while True:
+        token = secrets.randbits(32)
+        if token and token not in _udp_players:
+            return token
+
+
+def _promote(logger: logging.Logger, conn: _PendingConnection, line: bytes, leftover: bytes) -> int | None:
+    c, addr = conn.sock, conn.addr
+    panel_obj, player_id, wire, wants_udp, state_sync = _parse_handshake(line)
+    if not player_id or not (1 <= player_id <= 9) or panel_obj is None:
+        _close_socket(c)
+        preview = line[:200].decode("utf-8", errors="replace")
+        logger.info(f"Rejected connection {addr}: invalid handshake; data preview='{preview}'")
+        return None
+
+    # Replace any existing client for this player
+    if player_id in clients:
+        _drop_client(player_id)
+        logger.info(f"Player {player_id} replaced existing connection")
+
+    client = clients[player_id] = Client(panel=panel_obj, sock=c, wire=wire)
+    client.state_sync = state_sync
+    welcome = WelcomePacket(wire=wire)
+    if wants_udp and _udp_sock is not None:
+        client.udp_token = welcome.udp_token = _new_udp_token()
+        client.udp_host = addr[0]
+        welcome.udp_port = _udp_sock.getsockname()[1]
+        _udp_players[client.udp_token] = player_id
+    registry.add_panel(panel_obj)
+    _watch_client(player_id, clients[player_id])
+    _rx_buffers[player_id] = new_framer(wire)
+    if leftover:
+        _early_packets[player_id] = _rx_buffers[player_id].decode(leftover)
+
+    reset = GameStatePacket(state=GameState.RESET)
+    greeting = encode_for(reset, wire)
+    if wire != WIRE_JSON or client.udp_token:
+        greeting = encode_packet(welcome) + greeting
+    if session_log is not None:
+        session_log.connect(player_id, line)
+        session_log.packet_out(player_id, reset)
+    if not _queue_send(player_id, clients[player_id], greeting):
+        logger.info(f"Failed to send initial RESET to player {player_id}; dropped")
+        return None
+    logger.info(f"Player {player_id} connected from {addr} ({wire}{' + udp' if client.udp_token else ''})")
+    logger.info(f"Player {player_id} capabilities: {panel_obj.capabilities}")
+    return player_id
 
 
 def receive_packets(logger: logging.Logger) -> Dict[int, List[Packet]]:
     global clients, _rx_buffers
-    packets_by_player: Dict[int, List[Packet]] = {}
+    if _reading_paused:
+        return {}
+    packets_by_player: Dict[int, List[Packet]] = dict(_early_packets)
+    _early_packets.clear()
     gone: list[int] = []
-    for pid, client in clients.items():
+    if _loop is not None:
+        # Only touch sockets the loop reported readable; level-triggered select re-reports leftovers
+        ready = [(pid, clients[pid]) for pid in _readable if pid in clients]
+        _readable.clear()
+    else:
+        ready = list(clients.items())
+    for pid, client in ready:
         c = client.sock
         try:
-            data = c.recv(4096)
-            if data == b"":
-                try:
-                    c.close()
-                except Exception:
-                    pass
-                logger.info(f"Player {pid} disconnected")
-                gone.append(pid)
-                continue
-            elif data:
-                buf = _rx_buffers.get(pid, b"") + data
-                decoded, remainder = decode_lines(buf)
-                _rx_buffers[pid] = remainder
+            for _ in range(_MAX_READS_PER_WAKE if _loop is not None else 1):
+                data = c.recv(4096)
+                if data == b"":
+                    _close_socket(c)
+                    logger.info(f"Player {pid} disconnected")
+                    gone.append(pid)
+                    break
+                decoded = _rx_buffers[pid].decode(data)
                 if decoded:
-                    packets_by_player[pid] = decoded
+                    packets_by_player.setdefault(pid, []).extend(decoded)
         except BlockingIOError:
             pass
         except Exception as e:
-            try:
-                c.close()
-            except Exception:
-                pass
+            _close_socket(c)
             logger.debug(f"Player {pid} error; dropping: {e}")
             gone.append(pid)
+    _receive_datagrams(packets_by_player)
     for pid in gone:
-        clients.pop(pid, None)
+        client = clients.pop(pid, None)
+        if client is not None:
+            _udp_players.pop(client.udp_token, None)
         _rx_buffers.pop(pid, None)
+        registry.remove_player(pid)
+        state.forget(pid)
+    if _udp_players:
+        _send_udp_acks()
+    if session_log is not None:
+        for pid, packets in packets_by_player.items():
+            for packet in packets:
+                session_log.packet_in(pid, packet)
+        for pid in gone:
+            session_log.disconnect(pid)
     return packets_by_player
 
 
+def _receive_datagrams(packets_by_player: Dict[int, List[Packet]]) -> None:
+    """Add input from the datagram channel, dropping datagrams older than one already taken."""
+    global _udp_ready
+    if _udp_sock is None or (_loop is not None and not _udp_ready):
+        return
+    for _ in range(_MAX_DATAGRAMS_PER_FRAME):
+        try:
+            data, source = _udp_sock.recvfrom(2048)
+        except (BlockingIOError, InterruptedError):
+            _udp_ready = False
+            break
+        except OSError:
+            continue  # e.g. ICMP errors reported on the socket
+        decoded = decode_datagram(data)
+        pid = _udp_players.get(decoded[0]) if decoded is not None else None
+        client = clients.get(pid) if pid is not None else None
+        if client is None or source[0] != client.udp_host:
+            udp_counters["rejected"] += 1
+            continue
+        _, seq, packets = decoded
+        if seq <= client.udp_seq:
+            udp_counters["stale"] += 1
+            continue
+        client.udp_seq = seq
+        udp_counters["datagrams"] += 1
+        if packets:
+            packets_by_player.setdefault(pid, []).extend(packets)
+
+
+def _send_udp_acks() -> None:
+    """Tell panels the newest datagram taken, so one whose datagrams never arrive can fall back to TCP."""
+    now = time.monotonic()
+    for pid in list(_udp_players.values()):
+        client = clients.get(pid)
+        if client is None or client.udp_seq == client.udp_acked:
+            continue
+        if now >= client.udp_ack_due:
+            client.udp_acked = client.udp_seq
+            client.udp_ack_due = now + UDP_ACK_INTERVAL
+            udp_counters["acks"] += 1
+            _queue_send(pid, client, encode_for(UdpAckPacket(seq=client.udp_seq), client.wire))
+        elif _loop is not None and client.udp_ack_wake != client.udp_ack_due:
+            client.udp_ack_wake = client.udp_ack_due
+            _loop.call_at(client.udp_ack_due)  # Send it then even if nothing else wakes us
+
+
 def send_heartbeat_if_due() -> None:
     global _last_sent
     now = time.monotonic()
     if now - _last_sent < 1.0:
         return
     _last_sent = now
-    msg = encode_packet(TextPacket(text="Hello from server"))
-    for pid, client in list(clients.items()):
-        try:
-            client.sock.sendall(msg)
-        except Exception:
-            try:
-                client.sock.close()
-            except Exception:
-                pass
-            clients.pop(pid, None)
+    send_packet_to_all(TextPacket(text="Hello from server"))
 
 
 def send_packet_to_player(player_id: int, packet: Packet) -> bool:
     client = clients.get(player_id)
     if client is None:
         return False
-    try:
-        data = encode_packet(packet)
-        client.sock.sendall(data)
-        return True
-    except Exception:
-        try:
-            client.sock.close()
-        except Exception:
-            pass
-        clients.pop(player_id, None)
-        return False
+    data = encode_for(packet, client.wire)
+    if session_log is not None:
+        session_log.packet_out(player_id, packet, data if client.wire == WIRE_BINARY else None)
+    return _queue_send(player_id, client, data)
 
 
 def send_packet_to_all(packet: Packet) -> int:
-    data = encode_packet(packet)
+    encoded: Dict[str, bytes] = {}  # Encode once per wire format in use
     delivered = 0
     for pid, client in list(clients.items()):
-        try:
-            client.sock.sendall(data)
+        data = encoded.get(client.wire)
+        if data is None:
+            data = encoded[client.wire] = encode_for(packet, client.wire)
+        if _queue_send(pid, client, data):
+            delivered += 1
+    if session_log is not None and delivered:
+        session_log.packet_out(ALL_PLAYERS, packet, encoded.get(WIRE_BINARY))
+    return delivered
+
+
+def send_packet_to_players(player_ids: List[int], packet: Packet) -> int:
+    """Send one packet to several players, encoding it once per wire format in use."""
+    encoded: Dict[str, bytes] = {}
+    delivered = 0
+    for pid in player_ids:
+        client = clients.get(pid)
+        if client is None:
+            continue
+        data = encoded.get(client.wire)
+        if data is None:
+            data = encoded[client.wire] = encode_for(packet, client.wire)
+        if _queue_send(pid, client, data):
+            delivered += 1
+            if session_log is not None:
+                session_log.packet_out(pid, packet, data if client.wire == WIRE_BINARY else None)
+    return delivered
+
+
+def send_frame_to_player(player_id: int, frame: bytes) -> bool:
+    """Send a packet already encoded as a bin1 frame; JSON-wire clients get it transcoded."""
+    client = clients.get(player_id)
+    if client is None:
+        return False
+    if client.wire == WIRE_BINARY:
+        return _queue_send(player_id, client, frame)
+    packet = decode_binary(frame)
+    return packet is not None and _queue_send(player_id, client, encode_for(packet, client.wire))
+
+
+def send_frame_to_all(frame: bytes) -> int:
+    transcoded: Dict[str, bytes] = {WIRE_BINARY: frame}
+    delivered = 0
+    for pid, client in list(clients.items()):
+        data = transcoded.get(client.wire)
+        if data is None:
+            packet = decode_binary(frame)
+            if packet is None:
+                return delivered
+            data = transcoded[client.wire] = encode_for(packet, client.wire)
+        if _queue_send(pid, client, data):
             delivered += 1
-        except Exception:
-            try:
-                client.sock.close()
-            except Exception:
-                pass
-            clients.pop(pid, None)
     return delivered
 
 
+def disconnect_player(player_id: int) -> None:
+    _drop_client(player_id)
+
+
+def flush_outbound() -> int:
+    """Write everything queued this frame, one gathered write per client.
+
+    Call once at the end of each frame. Returns the number of send syscalls made.
+    """
+    before = send_counters["syscalls"]
+    for pid, client in list(clients.items()):
+        # In select mode, clients waiting on EVENT_WRITE are flushed by the loop
+        if client.outbox and (_loop is None or not client.want_write):
+            _flush_client(pid, client)
+    return send_counters["syscalls"] - before
+
+
+def takes_state_sync(player_id: int) -> bool:
+    client = clients.get(player_id)
+    return client is not None and client.state_sync
+
+
 def set_client_ready(player_id: int, ready: bool) -> None:
     client = clients.get(player_id)
     if client is not None:
@@ -0,0 +1,123 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from common.doodad import Doodad
+from common.panel import Panel
+
+# Every doodad on every connected panel, kept up to date as panels connect,
+# disconnect and start levels, so level setup never walks the client list and
+# routing one input is a dict lookup. Doodad ids are only unique within a
+# panel, so a doodad's key is (player, id); its current name maps back to it.
+
+DoodadKey = Tuple[int, str]
+
+_by_player: Dict[int, List[Doodad]] = {}
+_by_key: Dict[DoodadKey, Doodad] = {}
+_by_name: Dict[str, DoodadKey] = {}
+_state: Dict[DoodadKey, int] = {}  # Last input value per doodad
+_count = 0
+
+
+def add_panel(panel: Panel) -> None:
+    """Register a panel's doodads, replacing any earlier panel for the same player."""
+    global _count
+    remove_player(panel.player)
+    doodads = list(panel.capabilities)
+    _by_player[panel.player] = doodads
+    for doodad in doodads:
+        key = (panel.player, doodad.id)
+        _by_key[key] = doodad
+        if doodad.name:
+            _by_name[doodad.name] = key
+    _count += len(doodads)
+
+
+def remove_player(player: int) -> None:
+    global _count
+    doodads = _by_player.pop(player, None)
+    if doodads is None:
+        return
+    for doodad in doodads:
+        key = (player, doodad.id)
+        _by_key.pop(key, None)
+        _state.pop(key, None)
+        if doodad.name and _by_name.get(doodad.name) == key:
+            del _by_name[doodad.name]
+    _count -= len(doodads)
+
+
+def assign_names(names: Iterable[str]) -> Dict[int, Dict[str, str]]:
+    """Give every doodad the next name for a new level.
+
+    Returns {player: {doodad id: name}} for each panel's state.
+    """
+    _by_name.clear()
+    names = iter(names)
+    per_player: Dict[int, Dict[str, str]] = {}
+    for player, doodads in _by_player.items():
+        assigned = per_player[player] = {}
+        for doodad in doodads:
+            doodad.name = next(names)
+            assigned[doodad.id] = doodad.name
+            _by_name[doodad.name] = (player, doodad.id)
+    return per_player
+
+
+def restore_names(player: int, names: Dict[str, str]) -> Dict[str, str]:
+    """Put back the names a reconnecting panel had this level; returns those still applicable."""
+    restored: Dict[str, str] = {}
+    for doodad in _by_player.get(player, []):
+        name = names.get(doodad.id)
+        if name:
+            doodad.name = name
+            _by_name[name] = (player, doodad.id)
+            restored[doodad.id] = name
+    return restored
+
+
+def record_input(player: int, ident: str, value: int) -> Optional[Doodad]:
+    """Store a doodad's latest input value; None if the player has no such doodad."""
+    key = (player, ident)
+    doodad = _by_key.get(key)
+    if doodad is not None:
+        _state[key] = value
+    return doodad
+
+
+def lookup(player: int, ident: str) -> Optional[Doodad]:
+    return _by_key.get((player, ident))
+
+
+def by_name(name: str) -> Optional[Doodad]:
+    """The doodad currently called `name`; its `player` owns the panel to talk to."""
+    key = _by_name.get(name)
+    return _by_key.get(key) if key is not None else None
+
+
+def state(player: int, ident: str) -> Optional[int]:
+    return _state.get((player, ident))
+
+
+def doodad_count() -> int:
+    return _count
+
+
+def players() -> List[int]:
+    return list(_by_player)
+
+
+def doodads_for(player: int) -> List[Doodad]:
+    return _by_player.get(player, [])
+
+
+def all_doodads() -> Iterator[Doodad]:
+    for doodads in _by_player.values():
+        yield from doodads
+
+
+def clear() -> None:
+    global _count
+    _by_player.clear()
+    _by_key.clear()
+    _by_name.clear()
+    _state.clear()
+    _count = 0
@@ -0,0 +1,413 @@
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from common.gamestate import GameState, GameStatePacket
+from common.loop import EventLoop
+from common.packets import Packet
+from common.panel import panel_from_json, panel_to_json
+from common.ring import RingSocket, doorbell_pair
+from common.runner import run
+from common.sessionlog import ALL_PLAYERS
+from common.stats import get_stats
+from common.wire import BinaryFramer, encode_binary
+from server import network, registry, state
+
+# Network I/O in worker processes, so socket reads, framing, JSON decode and
+# validation, and send buffering do not compete with the game-logic tick.
+#
+# Each worker runs server.network unchanged in its own process and loop (with
+# SO_REUSEPORT spreading connections when there are several) and talks to the
+# game-logic process over a shared-memory RingSocket. Records on that link are
+# a !IBB header (payload length, kind, player) and a payload; packets cross as
+# bin1 frames, so the logic process only unpacks structs. This module offers the
+# same functions server.main uses from server.network, and server.main picks it
+# when io_workers > 0 in server/config.toml.
+
+_RECORD = struct.Struct("!IBB")
+# Worker -> logic
+_CONNECT = 1  # Payload: the panel as JSON, plus "state_sync" if the panel takes it
+_PACKETS = 2  # Payload: bin1 frames received from the player
+_DISCONNECT = 3
+# Logic -> worker
+_SEND = 4  # Payload: one bin1 frame; player 0 means every player on the worker
+_DROP = 5  # The player reconnected through another worker
+_STOP = 6
+
+LINK_CAPACITY = 1024 * 1024  # Per direction
+# Workers tick this often even without I/O, to notice the logic process exiting
+WORKER_TICK = 1.0
+# How often the logic process checks that its workers are still running
+HEALTH_CHECK_INTERVAL = 1.0
+
+
+class _Link:
+    """Record framing over a RingSocket; output that does not fit waits in `outbox`.
+
+    Past LINK_CAPACITY waiting the other side is not keeping up: a worker stops
+    reading its panels, and the logic process restarts a worker it cannot reach.
+    """
+
+    def __init__(self, sock: RingSocket):
+        self.sock = sock
+        self.outbox = bytearray()
+        self.inbox = bytearray()
+        self.closed = False
+
+    def queue(self, kind: int, player: int, payload: bytes = b"") -> None:
+        self.outbox += _RECORD.pack(len(payload), kind, player)
+        self.outbox += payload
+
+    def full(self) -> bool:
+        return len(self.outbox) >= LINK_CAPACITY
+
+    def flush(self) -> bool:
+        """Write what the ring takes; True if anything was written."""
+        if not self.outbox:
+            return False
+        try:
+            sent = self.sock.send(self.outbox)
+        except BlockingIOError:
+            return False
+        except OSError:
+            self.closed = True
+            self.outbox.clear()
+            return False
+        del self.outbox[:sent]
+        return True
+
+    def records(self) -> Iterator[Tuple[int, int, bytes]]:
+        try:
+            while True:
+                data = self.sock.recv(LINK_CAPACITY)
+                if not data:
+                    self.closed = True
+                    break
+                self.inbox += data
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.closed = True
+        offset = 0
+        size = len(self.inbox)
+        with memoryview(self.inbox) as view:
+            while size - offset >= _RECORD.size:
+                length, kind, player = _RECORD.unpack_from(view, offset)
+                start = offset + _RECORD.size
+                if start + length > size:
+                    break
+                offset = start + length
+                yield kind, player, view[start:offset].tobytes()
+        del self.inbox[:offset]
+
+
+class _Worker:
+    def __init__(self, index: int, process: multiprocessing.Process, link: _Link):
+        self.index = index
+        self.process = process
+        self.link = link
+        self.framer = BinaryFramer()
+
+
+_count = 0
+_udp = False
+_transport = "tcp"
+_loop: EventLoop | None = None
+_workers: List[_Worker] = []
+_generation = 0  # Keeps ring names unique when a worker is restarted
+_next_health_check = 0.0
+_owner: Dict[int, _Worker] = {}  # Player -> worker holding its connection
+_ready: Dict[int, bool] = {}
+_state_sync: set[int] = set()
+_new: List[int] = []
+_inbound: Dict[int, List[Packet]] = {}
+# Link records each way, and times a worker's link was full at the end of a frame
+counters: Dict[str, int] = {"records_in": 0, "records_out": 0, "stalls": 0}
+
+
+def configure(count: int, udp: bool, transport: str = "tcp") -> None:
+    """Use `count` I/O worker processes. The UDP channel is only offered with one, since
+    datagrams are not steered to the worker holding the panel's TCP connection, and
+    the ring transport has one listener, so it gets one worker."""
+    global _count, _udp, _transport
+    _transport = transport
+    _count = 1 if transport == "ring" else count
+    _udp = udp and _count == 1
+
+
+def attach_loop(loop: EventLoop | None) -> None:
+    global _loop
+    _loop = loop
+
+
+def _start_worker(index: int) -> _Worker:
+    global _generation
+    _generation += 1
+    name = f"ufogame-io-{os.getpid()}-{index}-{_generation}"
+    bell, worker_bell = doorbell_pair()
+    link = _Link(RingSocket.create(name, bell, LINK_CAPACITY))
+    process = multiprocessing.get_context("spawn").Process(
+        target=run_worker, args=(index, _count, name, worker_bell, network.PORT, _udp, _transport),
+        name=f"server-io-{index}", daemon=True,
+    )
+    process.start()
+    worker_bell.close()  # The worker has its own copy; its exit must read as end-of-file here
+    if _loop is not None:
+        # Records are read by the frame; the doorbell only has to wake it
+        _loop.register(link.sock, lambda mask: None)
+    return _Worker(index, process, link)
+
+
+def _close_worker(worker: _Worker) -> None:
+    if _loop is not None:
+        _loop.unregister(worker.link.sock)
+    worker.link.sock.close()
+    for player in [p for p, w in _owner.items() if w is worker]:
+        _forget(player)
+
+
+def ensure_server_ready(logger: logging.Logger) -> None:
+    global _next_health_check
+    if not _workers:
+        for index in range(_count):
+            _workers.append(_start_worker(index))
+        logger.info(f"Network I/O running in {_count} worker process(es) on port {network.PORT}")
+        _next_health_check = time.monotonic() + HEALTH_CHECK_INTERVAL
+        return
+    now = time.monotonic()
+    if now < _next_health_check:
+        return
+    _next_health_check = now + HEALTH_CHECK_INTERVAL
+    for i, worker in enumerate(_workers):
+        if worker.process.is_alive() and not worker.link.closed and not worker.link.full():
+            continue
+        if worker.process.is_alive():
+            if worker.link.full():
+                logger.warning(f"I/O worker {worker.index} is {len(worker.link.outbox)} bytes behind on its link; restarting")
+            else:
+                logger.warning(f"I/O worker {worker.index} closed its link; restarting")
+            worker.process.terminate()
+        else:
+            logger.warning(f"I/O worker {worker.index} exited ({worker.process.exitcode}); restarting")
+        _close_worker(worker)
+        _workers[i] = _start_worker(worker.index)
+
+
+def stop() -> None:
+    for worker in _workers:
+        worker.link.queue(_STOP, 0)
+        worker.link.flush()
+    for worker in _workers:
+        worker.process.join(timeout=2.0)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        _close_worker(worker)
+    _workers.clear()
+
+
+def _forget(player: int) -> None:
+    _owner.pop(player, None)
+    _ready.pop(player, None)
+    _state_sync.discard(player)
+    registry.remove_player(player)
+    state.forget(player)
+    if network.session_log is not None:
+        network.session_log.disconnect(player)
+
+
+def _on_connect(worker: _Worker, player: int, payload: bytes) -> None:
+    previous = _owner.get(player)
+    if previous is not None:
+        if previous is not worker:
+            previous.link.queue(_DROP, player)
+        _forget(player)
+    obj = json.loads(payload)
+    registry.add_panel(panel_from_json(obj))
+    if obj.get("state_sync") is True:
+        _state_sync.add(player)
+    _owner[player] = worker
+    _ready[player] = False
+    if player not in _new:
+        _new.append(player)
+    if network.session_log is not None:
+        network.session_log.connect(player, payload)
+        network.session_log.packet_out(player, GameStatePacket(state=GameState.RESET))
+
+
+def _poll() -> None:
+    global _next_health_check
+    for worker in _workers:
+        if worker.link.closed:
+            continue  # Restarted by the next ensure_server_ready()
+        for kind, player, payload in worker.link.records():
+            counters["records_in"] += 1
+            if kind == _CONNECT:
+                _on_connect(worker, player, payload)
+            elif _owner.get(player) is not worker:
+                continue  # From a connection that has since been replaced
+            elif kind == _PACKETS:
+                packets = worker.framer.decode(payload)
+                _inbound.setdefault(player, []).extend(packets)
+                if network.session_log is not None:
+                    for packet in packets:
+                        network.session_log.packet_in(player, packet)
+            elif kind == _DISCONNECT:
+                _forget(player)
+        if worker.link.closed:
+            _next_health_check = 0.0  # End-of-file on the link: the worker exited
+
+
+def accept_new_clients(logger: logging.Logger) -> list[int]:
+    _poll()
+    new = list(_new)
+    _new.clear()
+    return new
+
+
+def receive_packets(logger: logging.Logger) -> Dict[int, List[Packet]]:
+    _poll()
+    packets = dict(_inbound)
+    _inbound.clear()
+    return packets
+
+
+def send_packet_to_player(player_id: int, packet: Packet) -> bool:
+    worker = _owner.get(player_id)
+    if worker is None:
+        return False
+    frame = encode_binary(packet)
+    worker.link.queue(_SEND, player_id, frame)
+    counters["records_out"] += 1
+    if network.session_log is not None:
+        network.session_log.packet_out(player_id, packet, frame)
+    return True
+
+
+def send_packet_to_players(player_ids: List[int], packet: Packet) -> int:
+    frame = encode_binary(packet)
+    delivered = 0
+    for pid in player_ids:
+        worker = _owner.get(pid)
+        if worker is None:
+            continue
+        worker.link.queue(_SEND, pid, frame)
+        counters["records_out"] += 1
+        delivered += 1
+        if network.session_log is not None:
+            network.session_log.packet_out(pid, packet, frame)
+    return delivered
+
+
+def send_packet_to_all(packet: Packet) -> int:
+    frame = encode_binary(packet)
+    for worker in set(_owner.values()):
+        worker.link.queue(_SEND, 0, frame)
+        counters["records_out"] += 1
+    if network.session_log is not None and _owner:
+        network.session_log.packet_out(ALL_PLAYERS, packet, frame)
+    return len(_owner)
+
+
+def flush_outbound() -> int:
+    """Hand this frame's output to the workers; returns the number of links written."""
+    global _next_health_check
+    written = 0
+    for worker in _workers:
+        if worker.link.flush():
+            written += 1
+        if worker.link.outbox:
+            counters["stalls"] += 1  # The rest goes out next frame
+        if worker.link.full():
+            _next_health_check = 0.0  # Stuck worker; restarted like a dead one
+    return written
+
+
+def takes_state_sync(player_id: int) -> bool:
+    return player_id in _state_sync
+
+
+def set_client_ready(player_id: int, ready: bool) -> None:
+    if player_id in _ready:
+        _ready[player_id] = ready
+
+
+def all_clients_ready() -> bool:
+    return bool(_ready) and all(_ready.values())
+
+
+def client_count() -> int:
+    return len(_owner)
+
+
+def run_worker(index: int, count: int, link_name: str, link_bell: socket.socket, port: int, udp: bool,
+               transport: str = "tcp") -> int:
+    """Entry point of an I/O worker process."""
+    network.PORT = port
+    network.transport = transport
+    network.reuse_port = count > 1
+    network.enable_udp(udp)
+    link = _Link(RingSocket.attach(link_name, link_bell))
+    loop = EventLoop()
+    network.attach_loop(loop)
+    loop.register(link.sock, lambda mask: None)
+    parent = os.getppid()
+    known: set[int] = set()
+    stats = get_stats(f"server-io-{index}")
+    stats.counter_sources["send"] = network.send_counters
+    stats.counter_sources["udp"] = network.udp_counters
+
+    def run_frame(logger: logging.Logger) -> bool:
+        if os.getppid() != parent or link.closed:
+            return False  # The game-logic process is gone
+        network.ensure_server_ready(logger)
+        for kind, player, payload in link.records():
+            if kind == _SEND:
+                if player:
+                    network.send_frame_to_player(player, payload)
+                else:
+                    network.send_frame_to_all(payload)
+            elif kind == _DROP:
+                network.disconnect_player(player)
+                known.discard(player)
+            elif kind == _STOP:
+                return False
+        for player in network.accept_new_clients(logger):
+            client = network.clients.get(player)
+            if client is not None:
+                connect = panel_to_json(client.panel)
+                connect["state_sync"] = client.state_sync
+                link.queue(_CONNECT, player, json.dumps(connect).encode("utf-8"))
+                known.add(player)
+        for player, packets in network.receive_packets(logger).items():
+            link.queue(_PACKETS, player, b"".join(encode_binary(p) for p in packets))
+        network.flush_outbound()
+        for player in known - network.clients.keys():
+            link.queue(_DISCONNECT, player)
+            known.discard(player)
+        link.flush()
+        # Input waits in the panels' sockets rather than here while the logic process is behind
+        network.pause_reading(link.full())
+        if link.outbox:
+            loop.call_later(0.001)  # The logic process is behind; try again shortly
+        return True
+
+    try:
+        return run(
+            logger_name=f"server-io-{index}",
+            advertise_instance=None,
+            advertise_port=None,
+            advertise_properties=None,
+            run_frame=run_frame,
+            loop=loop,
+            tick=lambda: WORKER_TICK,
+        )
+    finally:
+        for player in list(network.clients):
+            network.disconnect_player(player)
+        link.sock.close()
+        loop.close()
@@ -0,0 +1,116 @@
+from typing import Any, Dict, List, Tuple
+
+from common.gamestate import StateDeltaPacket, StateSnapshotPacket
+
+# The authoritative game state panels mirror. Every change bumps one
+# monotonically increasing version, and each field remembers the version that
+# last changed it, so a panel known to hold version `base` needs only the
+# fields changed since then. Private fields (a panel's doodad names) are kept
+# per player and survive a disconnect, so a panel that reconnects mid-level
+# gets everything back in its join snapshot. Fields are never removed; set a
+# neutral value instead.
+
+_seq = 0
+_fields: Dict[str, Any] = {}
+_changed: Dict[str, int] = {}  # Field -> version that last changed it
+_private: Dict[int, Dict[str, Any]] = {}
+_private_changed: Dict[int, Dict[str, int]] = {}
+_sent: Dict[int, int] = {}  # Player -> version of the last snapshot or delta sent to it
+
+
+def seq() -> int:
+    return _seq
+
+
+def get(field: str, default: Any = None) -> Any:
+    return _fields.get(field, default)
+
+
+def get_private(player: int, field: str, default: Any = None) -> Any:
+    return _private.get(player, {}).get(field, default)
+
+
+def set_field(field: str, value: Any) -> None:
+    global _seq
+    if field in _fields and _fields[field] == value:
+        return
+    _seq += 1
+    _fields[field] = value
+    _changed[field] = _seq
+
+
+def set_private(player: int, field: str, value: Any) -> None:
+    global _seq
+    fields = _private.setdefault(player, {})
+    if field in fields and fields[field] == value:
+        return
+    _seq += 1
+    fields[field] = value
+    _private_changed.setdefault(player, {})[field] = _seq
+
+
+def replace_private(field: str, values: Dict[int, Any]) -> None:
+    """Set `field` for every player in `values` and drop it for everyone else.
+
+    Players missing from `values` are expected to be disconnected, so nobody is
+    told about the removal; they simply don't get the field in their next snapshot.
+    """
+    for player, fields in _private.items():
+        if player not in values and field in fields:
+            del fields[field]
+            _private_changed[player].pop(field, None)
+    for player, value in values.items():
+        set_private(player, field, value)
+
+
+def snapshot(player: int) -> StateSnapshotPacket:
+    """Everything `player` should hold; deltas for it continue from this version."""
+    fields = dict(_fields)
+    fields.update(_private.get(player, {}))
+    _sent[player] = _seq
+    return StateSnapshotPacket(seq=_seq, fields=fields)
+
+
+def pending_deltas() -> List[Tuple[List[int], StateDeltaPacket]]:
+    """Deltas bringing every snapshotted player up to the current version.
+
+    Players at the same version with no private changes share one packet, so a
+    broadcast change is encoded once. Players with nothing relevant changed get
+    nothing; their next delta simply has an older base.
+    """
+    shared: Dict[int, List[int]] = {}
+    deltas: List[Tuple[List[int], StateDeltaPacket]] = []
+    global_changes: Dict[int, Dict[str, Any]] = {}
+    for player, base in _sent.items():
+        if base == _seq:
+            continue
+        changes = global_changes.get(base)
+        if changes is None:
+            changes = global_changes[base] = {f: _fields[f] for f, v in _changed.items() if v > base}
+        private = {f: _private[player][f] for f, v in _private_changed.get(player, {}).items() if v > base}
+        if private:
+            deltas.append(([player], StateDeltaPacket(seq=_seq, base=base, changes={**changes, **private})))
+        elif changes:
+            shared.setdefault(base, []).append(player)
+        else:
+            continue
+        _sent[player] = _seq
+    for base, players in shared.items():
+        deltas.append((players, StateDeltaPacket(seq=_seq, base=base, changes=global_changes[base])))
+    return deltas
+
+
+def forget(player: int) -> None:
+    """Stop sending deltas to a disconnected player; its private fields are kept."""
+    _sent.pop(player, None)
+
+
+def clear() -> None:
+    global _seq
+    # The version keeps counting so no panel can mistake new state for old
+    _seq += 1
+    _fields.clear()
+    _changed.clear()
+    _private.clear()
+    _private_changed.clear()
+    _sent.clear()